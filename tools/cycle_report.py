@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import zlib
+
+from typing import (
+    Optional,
+)
+
+from dislib.analysiscache import analysis_cache_key
+from dislib.annotparser import (
+    parse_addr,
+    read_annot_file,
+)
+from dislib.cfg import (
+    FRAME_CYCLES_NTSC,
+    ControlFlowGraph,
+    CostAnalyzer,
+    RoutineCost,
+)
+from dislib.miscdefs import PhysAddress
+from dislib.rom import Rom
+
+DEFAULT_ROOTS = ["ENTRY_IRQ", "@main_level_loop"]
+
+
+def find_root(rom: Rom, name: str) -> Optional[PhysAddress]:
+    # A label, or an address as bb:pppp.
+    if name in rom.label_to_addr:
+        return rom.virt_to_phys(rom.label_to_addr[name])
+    # Local labels don't go in label_to_addr, so look for them the slow way.
+    for phys_addr, labels in rom.labels_from_addr.items():
+        if name in labels:
+            return phys_addr
+    try:
+        return rom.virt_to_phys(parse_addr(name))
+    except Exception:
+        return None
+
+
+def format_cost_line(
+    cfg: ControlFlowGraph, cost: RoutineCost, *, budget: int, width: int
+) -> str:
+    block = cfg.blocks[cost.entry]
+    return (
+        f"{cfg.name_of(cost.entry):<{width}s}"
+        f" {block.virt_addr >> 16:02X}:{block.virt_addr & 0xFFFF:04X}"
+        f" {cost.cycles:8d}T"
+        f" {100.0 * cost.cycles / budget:7.2f}%"
+        f"  {cost.flags()}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Estimate worst-case T-states per routine from the traced code, and how they compare to a frame."
+    )
+    parser.add_argument(
+        "--cache",
+        metavar="FILE",
+        help="reuse the traced ROM state from rom_unpack.py --cache, if it's up to date",
+    )
+    parser.add_argument(
+        "--root",
+        metavar="LABEL",
+        action="append",
+        help=f"show the heaviest path from this label or bb:pppp address, can be given more than once (default: {', '.join(DEFAULT_ROOTS)})",
+    )
+    parser.add_argument(
+        "--top",
+        metavar="N",
+        type=int,
+        default=40,
+        help="how many of the most expensive routines to list (default: 40)",
+    )
+    parser.add_argument(
+        "--budget",
+        metavar="T_STATES",
+        type=int,
+        default=FRAME_CYCLES_NTSC,
+        help=f"T-states in a frame (default: {FRAME_CYCLES_NTSC}, for NTSC)",
+    )
+    parser.add_argument("rom_fname")
+    parser.add_argument("annot_fname")
+    args = parser.parse_args()
+    rom_fname: str = args.rom_fname
+    annot_fname: str = args.annot_fname
+    cache_fname: Optional[str] = args.cache
+    root_names: list[str] = args.root or DEFAULT_ROOTS
+    top: int = args.top
+    budget: int = args.budget
+
+    rom_data = open(rom_fname, "rb").read()
+    assert len(rom_data) == Rom.bank_count * Rom.bank_size
+    assert (zlib.crc32(rom_data) & 0xFFFFFFFF) == Rom.rom_crc
+    rom = Rom(data=rom_data)
+
+    annot_records = read_annot_file(annot_fname)
+    if not (
+        cache_fname is not None
+        and rom.load_analysis(file_name=cache_fname, key=analysis_cache_key(rom=rom))
+        and rom.annot_lines == [record.text for record in annot_records]
+    ):
+        rom = Rom(data=rom_data)
+        rom.apply_annotations(annot_records, file_name=annot_fname)
+        rom.run_tracer()
+
+    roots: list[tuple[str, PhysAddress]] = []
+    for name in root_names:
+        root = find_root(rom, name)
+        if root is None:
+            print(f"WARNING: Can't find root {name!r}, skipping it")
+        else:
+            roots.append((name, root))
+
+    cfg = ControlFlowGraph(rom=rom)
+    cfg.build(roots=[root for _, root in roots])
+    analyzer = CostAnalyzer(cfg=cfg)
+    for entry in sorted(cfg.routine_entries):
+        analyzer.routine_cost(entry)
+
+    print(f"{len(cfg.blocks)} basic blocks, {len(analyzer.costs)} routines")
+    print(f"Frame budget: {budget}T")
+    print(
+        "Flags: L = loop counted once, U = unknown jump/call target, R = recursion, B = block op counted once"
+    )
+
+    for name, root in roots:
+        if root not in cfg.blocks:
+            print(f"WARNING: Root {name!r} isn't traced code, skipping it")
+            continue
+        cost = analyzer.routine_cost(root)
+        print()
+        print(
+            f"{name}: {cost.cycles}T worst case, {100.0 * cost.cycles / budget:.2f}% of a frame  {cost.flags()}"
+        )
+        for p in cost.path:
+            block = cfg.blocks[p]
+            line = f"  {cfg.name_of(p)} {block.cycles}T"
+            callees = [
+                cfg.name_of(call.target) if call.target is not None else "?"
+                for call in block.calls
+            ]
+            if callees:
+                line += f" calls {', '.join(callees)}"
+            print(line)
+
+    ranked = sorted(
+        analyzer.costs.values(), key=lambda cost: (-cost.cycles, cost.entry)
+    )[:top]
+    width = max([len(cfg.name_of(cost.entry)) for cost in ranked], default=0)
+    print()
+    print(f"Top {len(ranked)} routines by worst case:")
+    for cost in ranked:
+        print(format_cost_line(cfg, cost, budget=budget, width=width))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+from __future__ import annotations
+
+import re
+
+from typing import (
+    Iterable,
+    Iterator,
+    Optional,
+)
+
+from dislib.miscdefs import (
+    AT,
+    PhysAddress,
+)
+
+# Code 0 means "no type assigned yet", everything else is AT.value.
+_AT_FROM_CODE: list[Optional[AT]] = [None] * (max(at.value for at in AT) + 1)
+for _at in AT:
+    _AT_FROM_CODE[_at.value] = _at
+
+_DATA_WORD_CODE = AT.DataWord.value
+
+# Matches a run of identical bytes.
+_RUN_RE = re.compile(rb"(.)\1*", re.DOTALL)
+
+
+class AddrTypeMap:
+    # One byte per physical address.
+    # The ROM sits at the start, the RAM window gets tacked on after it.
+
+    def __init__(self, *, rom_size: int, ram_base: int, ram_size: int) -> None:
+        self._rom_size = rom_size
+        self._ram_base = ram_base
+        self._ram_size = ram_size
+        self._codes = bytearray(rom_size + ram_size)
+
+    def _index(self, p: int) -> int:
+        if 0 <= p < self._rom_size:
+            return p
+        ram_offs = p - self._ram_base
+        if 0 <= ram_offs < self._ram_size:
+            return self._rom_size + ram_offs
+        return -1
+
+    def __contains__(self, p: int) -> bool:
+        idx = self._index(p)
+        return idx >= 0 and self._codes[idx] != 0
+
+    def __getitem__(self, p: int) -> AT:
+        idx = self._index(p)
+        at = _AT_FROM_CODE[self._codes[idx]] if idx >= 0 else None
+        if at is None:
+            raise KeyError(p)
+        return at
+
+    def get(self, p: int, default: Optional[AT] = None) -> Optional[AT]:
+        idx = self._index(p)
+        if idx < 0:
+            return default
+        at = _AT_FROM_CODE[self._codes[idx]]
+        return default if at is None else at
+
+    def __setitem__(self, p: int, at: AT) -> None:
+        idx = self._index(p)
+        if idx < 0:
+            raise Exception(f"address ${p:05X} is outside of the ROM and RAM window")
+        self._codes[idx] = at.value
+
+    def copy(self) -> AddrTypeMap:
+        other = AddrTypeMap(
+            rom_size=self._rom_size, ram_base=self._ram_base, ram_size=self._ram_size
+        )
+        other._codes[:] = self._codes
+        return other
+
+    def __len__(self) -> int:
+        return len(self._codes) - self._codes.count(0)
+
+    def set_addr_type(self, p: PhysAddress, addr_type: AT) -> bool:
+        # Returns False if the new type can't be reconciled with the old one.
+        # The Tracer doesn't visit things in any particular order, so whatever gets set
+        # at an address has to end up the same whichever order it came in.
+        # A word only stays a word if nothing else gets typed in its second byte.
+        code = addr_type.value
+        codes = self._codes
+        if (
+            0 < p < self._rom_size
+            and codes[p] == 0
+            and codes[p - 1] != _DATA_WORD_CODE
+            and code != _DATA_WORD_CODE
+        ):
+            # Nearly every call is for something new in the ROM, so that gets done by hand.
+            codes[p] = code
+            return True
+        other_type = self.get(p)
+        if other_type is None:
+            if p >= 1 and self.get(p - 0x01) == AT.DataWord:
+                # Downsize for a split
+                self[p - 0x01] = AT.DataByte
+            if addr_type == AT.DataWord and self.get(p + 0x01) is not None:
+                # Downsize for a split
+                addr_type = AT.DataByte
+            self[p] = addr_type
+        elif other_type == addr_type:
+            if addr_type == AT.File:
+                raise Exception(f"overlapping files at {p:05X}")
+        elif other_type == AT.DataWord and addr_type == AT.DataByte:
+            # Downsize for a split
+            self[p] = AT.DataByte
+        elif other_type == AT.DataByte and addr_type == AT.DataWord:
+            # Block upsize
+            pass
+        elif other_type == AT.File or addr_type == AT.File:
+            # A file is a file is a file
+            self[p] = AT.File
+        elif (
+            other_type in {AT.DataByteLabelLo, AT.DataByteLabelHi}
+            and addr_type == AT.DataByte
+        ):
+            # Split label reference
+            pass
+        elif other_type == AT.DataByte and addr_type in {
+            AT.DataByteLabelLo,
+            AT.DataByteLabelHi,
+        }:
+            # Split label reference
+            self[p] = addr_type
+        else:
+            # The later one in the list of types wins, wherever it came from.
+            if addr_type.value > other_type.value:
+                self[p] = addr_type
+            return False
+        return True
+
+    def differences(self, other: AddrTypeMap) -> list[PhysAddress]:
+        # Every address where the two have different types.
+        # Nearly all of it is usually the same, so this looks in blocks.
+        block_size = 0x400
+        diffs: list[PhysAddress] = []
+        for start in range(0, len(self._codes), block_size):
+            end = min(start + block_size, len(self._codes))
+            if self._codes[start:end] != other._codes[start:end]:
+                for idx in range(start, end):
+                    if self._codes[idx] != other._codes[idx]:
+                        diffs.append(self._addr(idx))
+        return diffs
+
+    def _addr(self, idx: int) -> PhysAddress:
+        if idx < self._rom_size:
+            return PhysAddress(idx)
+        return PhysAddress(self._ram_base + idx - self._rom_size)
+
+    def rebuild_addrs(self, addrs: Iterable[PhysAddress]) -> set[PhysAddress]:
+        # What rebuild() needs to redo if the requests at addrs change.
+        # A word can get split by whatever's after it, so that's the addresses before too.
+        result = set(addrs)
+        result.update(PhysAddress(p - 1) for p in list(result))
+        return {p for p in result if self._index(p) >= 0}
+
+    def rebuild(
+        self,
+        addrs: set[PhysAddress],
+        *,
+        base: AddrTypeMap,
+        requests: Iterable[tuple[PhysAddress, AT]],
+    ) -> None:
+        # Works out the types at addrs again, from the types base has there
+        # and every request there is for them.
+        # Anything at addrs that isn't in base needs to be in requests.
+        for p in addrs:
+            idx = self._index(p)
+            self._codes[idx] = base._codes[idx]
+        for p, addr_type in requests:
+            self.set_addr_type(p, addr_type)
+        # Putting back base's words doesn't check what's after them.
+        for p in addrs:
+            if self.get(p) == AT.DataWord and (p + 1) in self:
+                self[p] = AT.DataByte
+
+    def run_end(self, p: int, end: int) -> int:
+        # Returns the first address in [p, end) whose type differs from p's, or end.
+        idx = self._index(p)
+        assert idx >= 0 and self._index(end - 1) == idx + (end - 1 - p)
+        m = _RUN_RE.match(self._codes, idx, idx + (end - p))
+        assert m is not None
+        return p + (m.end() - idx)
+
+    def runs(self, start: int, end: int) -> Iterator[tuple[int, int, Optional[AT]]]:
+        # Yields (start, end, type) for every same-typed span in [start, end).
+        # Untyped spans come out with a type of None.
+        while start < end:
+            run_end = self.run_end(start, end)
+            yield (start, run_end, self.get(start))
+            start = run_end
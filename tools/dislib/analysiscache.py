@@ -0,0 +1,112 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import os.path
+import pickle
+import zlib
+
+from typing import TYPE_CHECKING
+from typing import (
+    Any,
+)
+
+if TYPE_CHECKING:
+    from dislib.rom import Rom
+
+# Bump this if the layout of the cache changes in a way the code hash won't catch.
+CACHE_FORMAT_VERSION = 2
+
+# Everything the Saver needs from a finished trace.
+CACHED_ATTRS = [
+    "addr_types",
+    "label_to_addr",
+    "labels_from_addr",
+    "label_addrs",
+    "addr_refs",
+    "op_decodes",
+    "forced_immediates",
+    "binexports",
+    "bank_overrides",
+    "annot_lines",
+    "auto_labels",
+    "annotation_auto_labels",
+    # ... and what dislib/incremental.py needs to bring it up to date
+    "annotation_addr_types",
+    "annotation_labels",
+    "annotation_roots",
+    "op_effects",
+]
+
+# Only these go into the cached state.
+# Everything else (the Saver, op formatting, heat maps and so on) only runs after it,
+# so changing those doesn't throw the cache away.
+HASHED_SOURCES = [
+    "addrtypes.py",
+    "analysiscache.py",
+    "annotator.py",
+    "annotparser.py",
+    "incremental.py",
+    "miscdefs.py",
+    "opdecodes.py",
+    "rangemap.py",
+    "rom.py",
+    "tracer.py",
+    "worklist.py",
+    "z80ops.py",
+]
+
+
+def dislib_code_hash() -> str:
+    h = hashlib.sha256()
+    for fname in HASHED_SOURCES:
+        h.update(fname.encode("utf-8") + b"\x00")
+        with open(os.path.join(os.path.dirname(__file__), fname), "rb") as infp:
+            h.update(infp.read())
+    return h.hexdigest()
+
+
+def analysis_cache_key(*, rom: Rom) -> str:
+    # The annotations aren't part of this.
+    # They're kept in the cache so they can be compared line by line.
+    h = hashlib.sha256()
+    h.update(f"v{CACHE_FORMAT_VERSION}\x00".encode("utf-8"))
+    h.update(f"crc {zlib.crc32(rom.data) & 0xFFFFFFFF:08X}\x00".encode("utf-8"))
+    h.update(dislib_code_hash().encode("utf-8"))
+    return h.hexdigest()
+
+
+class AnalysisCache:
+    def __init__(self, *, rom: Rom) -> None:
+        self.rom = rom
+
+    def load(self, *, file_name: str, key: str) -> bool:
+        try:
+            with open(file_name, "rb") as infp:
+                blob = infp.read()
+        except FileNotFoundError:
+            return False
+
+        try:
+            cached_key, state = pickle.loads(zlib.decompress(blob))
+        except Exception as e:
+            print(f"WARNING: Ignoring unreadable analysis cache {file_name!r}: {e}")
+            return False
+
+        if cached_key != key:
+            return False
+
+        for attr in CACHED_ATTRS:
+            setattr(self.rom, attr, state[attr])
+        return True
+
+    def save(self, *, file_name: str, key: str) -> None:
+        assert len(self.rom.tracer_worklist) == 0, "can only cache a finished trace"
+        state: dict[str, Any] = {attr: getattr(self.rom, attr) for attr in CACHED_ATTRS}
+        blob = zlib.compress(
+            pickle.dumps((key, state), protocol=pickle.HIGHEST_PROTOCOL)
+        )
+        tmp_file_name = file_name + ".tmp"
+        with open(tmp_file_name, "wb") as outfp:
+            outfp.write(blob)
+        os.replace(tmp_file_name, file_name)
@@ -0,0 +1,188 @@
+from __future__ import annotations
+
+import hashlib
+import pickle
+
+from typing import (
+    Any,
+    Callable,
+    NamedTuple,
+    Optional,
+    Sequence,
+)
+
+from dislib.fileio import write_if_changed
+from dislib.miscdefs import (
+    LTYPEMAP,
+    VirtAddress,
+    make_virt,
+)
+
+# Bump this if the record layout changes in a way the source hash won't catch.
+CFG_CACHE_FORMAT_VERSION = 2
+
+
+class AnnotError(Exception):
+    pass
+
+
+class AnnotRecord(NamedTuple):
+    line_num: int
+    # The command with comments and extra whitespace stripped out
+    text: str
+    cmd: str
+    args: tuple[Any, ...]
+
+
+def parse_int(s: str) -> int:
+    if s.startswith("$"):
+        return int(s[1:], 16)
+    else:
+        return int(s)
+
+
+def parse_addr(s: str) -> VirtAddress:
+    if len(s) != 7 or s[2] != ":":
+        raise Exception(f"expected bb:pppp for addr, got {s!r} instead")
+    bank_idx = int(s[0:][:2], 16)
+    offs = int(s[3:][:4], 16)
+    return make_virt(bank_idx, offs)
+
+
+def _parse_fixed_hex(digits: int, what: str) -> Callable[[str], int]:
+    def parse(s: str) -> int:
+        if len(s) != digits:
+            raise Exception(f"expected {digits} hex digits for {what}, got {s!r}")
+        return int(s, 16)
+
+    return parse
+
+
+def parse_slot_idx(s: str) -> int:
+    if s not in {"0", "1", "2", "3"}:
+        raise Exception(f"expected a slot from 0 to 3, got {s!r}")
+    return int(s)
+
+
+def parse_ltype(s: str) -> str:
+    # Stays a string, as codewptr and wptr are the same type with different behaviour.
+    if s not in LTYPEMAP:
+        raise Exception(f"unknown label type {s!r}, expected one of {list(LTYPEMAP)}")
+    return s
+
+
+def parse_split_part(s: str) -> str:
+    if s not in {"lo", "hi"}:
+        raise Exception(f"invalid splitaddr type {s!r}")
+    return s
+
+
+def parse_file_name(s: str) -> str:
+    if "\\" in s:
+        raise Exception(f"use forward slashes in file names, got {s!r}")
+    return s
+
+
+def parse_label(s: str) -> str:
+    return s
+
+
+ANNOT_ARG_PARSERS: dict[str, Sequence[Callable[[str], Any]]] = {
+    "code": (parse_addr, parse_label),
+    "label": (parse_addr, parse_ltype, parse_label),
+    "arraylabel": (parse_addr, parse_ltype, parse_int, parse_label),
+    "stridearraylabel": (parse_addr, parse_int, parse_ltype, parse_int, parse_label),
+    "splitaddr": (parse_addr, parse_split_part, parse_addr),
+    "forceimm": (parse_addr,),
+    "bankslot": (_parse_fixed_hex(2, "bank"), parse_slot_idx),
+    "banksetting": (
+        parse_slot_idx,
+        _parse_fixed_hex(2, "bank"),
+        parse_addr,
+        parse_addr,
+    ),
+    "binexport": (parse_addr, _parse_fixed_hex(5, "length"), parse_file_name),
+}
+
+
+def parse_annot_line(
+    line: str, *, file_name: str, line_num: int
+) -> Optional[AnnotRecord]:
+    # Returns None for blank lines and comments.
+    tokens = line.partition("#")[0].split()
+    if len(tokens) == 0:
+        return None
+
+    cmd, *arg_strs = tokens
+    try:
+        arg_parsers = ANNOT_ARG_PARSERS[cmd]
+    except LookupError:
+        raise AnnotError(f"{file_name}:{line_num}: unknown command {cmd!r}")
+    if len(arg_strs) != len(arg_parsers):
+        raise AnnotError(
+            f"{file_name}:{line_num}: {cmd!r} takes {len(arg_parsers)} arguments, got {len(arg_strs)}"
+        )
+    try:
+        args = tuple(parse(s) for parse, s in zip(arg_parsers, arg_strs))
+    except Exception as e:
+        raise AnnotError(f"{file_name}:{line_num}: {e}") from e
+
+    return AnnotRecord(
+        line_num=line_num,
+        text=" ".join(tokens),
+        cmd=cmd,
+        args=args,
+    )
+
+
+def parse_annot_source(source: str, *, file_name: str) -> list[AnnotRecord]:
+    records: list[AnnotRecord] = []
+    for line_idx, line in enumerate(source.splitlines()):
+        record = parse_annot_line(line, file_name=file_name, line_num=line_idx + 1)
+        if record is not None:
+            records.append(record)
+    return records
+
+
+def _parser_hash() -> bytes:
+    h = hashlib.sha256()
+    h.update(f"v{CFG_CACHE_FORMAT_VERSION}\x00".encode("utf-8"))
+    with open(__file__, "rb") as infp:
+        h.update(infp.read())
+    return h.digest()
+
+
+def read_annot_file(
+    file_name: str, *, cache_file_name: Optional[str] = None
+) -> list[AnnotRecord]:
+    # If given a cache file, the parsed records get cached there, keyed on the source's hash.
+    # That wants to be somewhere like build/, not next to the source.
+    with open(file_name, "rb") as infp:
+        source = infp.read()
+    key = hashlib.sha256(_parser_hash() + source).digest()
+
+    if cache_file_name is not None:
+        try:
+            with open(cache_file_name, "rb") as infp:
+                cached_key, records = pickle.loads(infp.read())
+            if cached_key == key:
+                assert isinstance(records, list)
+                return records
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            print(f"WARNING: Ignoring unreadable cfg cache {cache_file_name!r}: {e}")
+
+    records = parse_annot_source(source.decode("utf-8"), file_name=file_name)
+
+    if cache_file_name is not None:
+        try:
+            write_if_changed(
+                cache_file_name,
+                pickle.dumps((key, records), protocol=pickle.HIGHEST_PROTOCOL),
+            )
+        except OSError as e:
+            # Not being able to cache shouldn't stop anything.
+            print(f"WARNING: Couldn't write cfg cache {cache_file_name!r}: {e}")
+
+    return records
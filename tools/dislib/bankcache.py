@@ -0,0 +1,103 @@
+from __future__ import annotations
+
+import hashlib
+import os
+import os.path
+import pickle
+import zlib
+
+from typing import TYPE_CHECKING
+from typing import (
+    Any,
+    Optional,
+)
+
+from dislib.incremental import AnalysisChanges
+from dislib.saver import RenderedBank
+
+if TYPE_CHECKING:
+    from dislib.rom import Rom
+
+# Bump this if the layout of the cache changes in a way the code hash won't catch.
+BANK_CACHE_FORMAT_VERSION = 1
+
+# Everything that turns a finished trace into text.
+# The trace itself is covered by the analysis cache key.
+HASHED_SOURCES = [
+    "bankcache.py",
+    "heatmap.py",
+    "opformatter.py",
+    "saver.py",
+]
+
+
+def bank_cache_key(
+    *, analysis_key: str, cycles: bool, heat_data: Optional[bytes]
+) -> str:
+    h = hashlib.sha256()
+    h.update(f"v{BANK_CACHE_FORMAT_VERSION}\x00".encode("utf-8"))
+    h.update(analysis_key.encode("utf-8") + b"\x00")
+    for fname in HASHED_SOURCES:
+        h.update(fname.encode("utf-8") + b"\x00")
+        with open(os.path.join(os.path.dirname(__file__), fname), "rb") as infp:
+            h.update(infp.read())
+    h.update(f"cycles {cycles}\x00".encode("utf-8"))
+    if heat_data is not None:
+        h.update(b"heat\x00" + heat_data)
+    return h.hexdigest()
+
+
+def annot_lines_hash(annot_lines: list[str]) -> str:
+    h = hashlib.sha256()
+    for line in annot_lines:
+        h.update(line.encode("utf-8") + b"\x00")
+    return h.hexdigest()
+
+
+class BankCache:
+    # The text of every bank from the last save, and the annotations it came from.
+    # After an incremental update, a bank only needs rendering again if something
+    # in it changed, or a label it refers to did.
+
+    def __init__(self, *, rom: Rom, file_name: str, key: str) -> None:
+        self.rom = rom
+        self.file_name = file_name
+        self.key = key
+
+    def load(
+        self, *, annot_lines: list[str], changes: AnalysisChanges
+    ) -> dict[int, RenderedBank]:
+        # annot_lines is what the trace had before changes got made to it.
+        try:
+            with open(self.file_name, "rb") as infp:
+                blob = infp.read()
+        except FileNotFoundError:
+            return {}
+
+        try:
+            cached_key, cached_annot_hash, banks = pickle.loads(zlib.decompress(blob))
+        except Exception as e:
+            print(f"WARNING: Ignoring unreadable bank cache {self.file_name!r}: {e}")
+            return {}
+
+        if cached_key != self.key or cached_annot_hash != annot_lines_hash(annot_lines):
+            return {}
+
+        changed_bank_idxs = {
+            phys_addr // self.rom.bank_size for phys_addr in changes.addrs
+        }
+        return {
+            bank_idx: bank
+            for bank_idx, bank in enumerate(banks)
+            if bank_idx not in changed_bank_idxs
+            and bank.label_deps.isdisjoint(changes.label_addrs)
+        }
+
+    def save(self, *, banks: list[RenderedBank]) -> None:
+        state: Any = (self.key, annot_lines_hash(self.rom.annot_lines), banks)
+        # Most of the time goes on compressing, and it's mostly text, so go easy on it.
+        blob = zlib.compress(pickle.dumps(state, protocol=pickle.HIGHEST_PROTOCOL), 1)
+        tmp_file_name = self.file_name + ".tmp"
+        with open(tmp_file_name, "wb") as outfp:
+            outfp.write(blob)
+        os.replace(tmp_file_name, self.file_name)
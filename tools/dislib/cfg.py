@@ -0,0 +1,366 @@
+from __future__ import annotations
+
+import dataclasses
+import struct
+
+from typing import TYPE_CHECKING
+from typing import (
+    Iterable,
+    NamedTuple,
+    Optional,
+)
+
+from dislib.miscdefs import (
+    PhysAddress,
+    VirtAddress,
+    format_virt,
+)
+from dislib.opdecodes import OpDecode
+from dislib.z80ops import (
+    OA,
+    OA_MAP_CONST_ADDR,
+    OE,
+)
+
+if TYPE_CHECKING:
+    from dislib.rom import Rom
+
+S8 = struct.Struct("<b")
+U16 = struct.Struct("<H")
+
+# NTSC SMS: 228 T-states per scanline, 262 scanlines per frame.
+FRAME_CYCLES_NTSC = 228 * 262
+
+_COND_OAS = {
+    OA.CondNZ,
+    OA.CondZ,
+    OA.CondNC,
+    OA.CondC,
+    OA.CondPO,
+    OA.CondPE,
+    OA.CondP,
+    OA.CondM,
+}
+
+
+class Edge(NamedTuple):
+    # "jump", "fall" or "exit"
+    kind: str
+    # Where it goes, or None for an exit or a jump that can't be followed
+    target: Optional[PhysAddress]
+    # On top of the block's cycles, for the taken side of a conditional op
+    extra_cycles: int
+
+
+class Call(NamedTuple):
+    # None if the target can't be worked out
+    target: Optional[PhysAddress]
+    # On top of the block's cycles when the call happens, not counting the callee
+    extra_cycles: int
+
+
+@dataclasses.dataclass
+class BasicBlock:
+    start: PhysAddress
+    # One past the last byte of the last op
+    end: PhysAddress
+    virt_addr: VirtAddress
+    op_count: int
+    # Every op at its not-taken cost
+    cycles: int
+    edges: list[Edge]
+    calls: list[Call]
+    # Has an ldir/otir/etc. which will run an unknown number of times
+    repeats: bool
+
+
+class RoutineCost(NamedTuple):
+    entry: PhysAddress
+    # Worst case, callees included
+    cycles: int
+    # Blocks along the worst-case path, in order
+    path: list[PhysAddress]
+    # Flags for anything which makes this an underestimate
+    has_loops: bool
+    has_unknown: bool
+    has_recursion: bool
+    has_repeats: bool
+
+    def flags(self) -> str:
+        return "".join(
+            flag if present else "-"
+            for flag, present in [
+                ("L", self.has_loops),
+                ("U", self.has_unknown),
+                ("R", self.has_recursion),
+                ("B", self.has_repeats),
+            ]
+        )
+
+
+class ControlFlowGraph:
+    # Basic blocks over everything the Tracer decoded.
+    #
+    # A block ends at any jump, return or op which doesn't fall through,
+    # and a new one starts at anything jumped to, called, or labelled.
+    # Calls don't end a block, their cost gets folded into the block instead.
+
+    def __init__(self, *, rom: Rom) -> None:
+        self.rom = rom
+        self.blocks: dict[PhysAddress, BasicBlock] = {}
+        # Everything which gets called, plus anything treated as a root
+        self.routine_entries: set[PhysAddress] = set()
+
+    def build(self, *, roots: Iterable[PhysAddress] = ()) -> None:
+        decodes = dict(self.rom.op_decodes.items())
+
+        leaders: set[PhysAddress] = set(roots)
+        self.routine_entries.update(leaders)
+        for p, decode in decodes.items():
+            if p in self.rom.labels_from_addr:
+                leaders.add(p)
+            entry = decode.entry
+            jump_target, call_target = self.op_targets(p, decode)
+            if jump_target is not None:
+                leaders.add(jump_target)
+            if call_target is not None:
+                leaders.add(call_target)
+                self.routine_entries.add(call_target)
+            if self.ends_block(entry):
+                leaders.add(PhysAddress(p + entry.length))
+
+        for start in sorted(leaders):
+            if start in decodes:
+                self.blocks[start] = self.build_block(start, decodes, leaders)
+
+    def ends_block(self, entry: OE) -> bool:
+        spec = entry.spec
+        return spec.stop or spec.name in {"JP", "JR", "DJNZ", "RET"}
+
+    def op_targets(
+        self, p: PhysAddress, decode: OpDecode
+    ) -> tuple[Optional[PhysAddress], Optional[PhysAddress]]:
+        # (jump target, call target), going by the same rules as the Tracer.
+        entry = decode.entry
+        bank_idx = decode.virt_addr >> 16
+        bank = self.rom.bank_views[bank_idx]
+        bank_phys_addr = bank_idx * self.rom.bank_size
+        rel_addr = p % self.rom.bank_size
+        is_call = entry.spec.name in {"CALL", "RST"}
+
+        for a, arg_offs, _ in entry.layout:
+            pc = rel_addr + arg_offs
+            target: Optional[PhysAddress] = None
+            if a == OA.JumpRelByte:
+                (val,) = S8.unpack_from(bank, pc)
+                target = PhysAddress(bank_phys_addr + pc + 1 + val)
+            elif a == OA.JumpWord:
+                (val,) = U16.unpack_from(bank, pc)
+                if val < 0xC000:
+                    target = self.rom.virt_to_phys(
+                        self.rom.naive_to_virt(
+                            val, relative_to=VirtAddress((bank_idx << 16) | pc)
+                        )
+                    )
+            elif a in OA_MAP_CONST_ADDR:
+                target = PhysAddress(OA_MAP_CONST_ADDR[a])
+            else:
+                continue
+            return (None, target) if is_call else (target, None)
+        return (None, None)
+
+    def build_block(
+        self,
+        start: PhysAddress,
+        decodes: dict[PhysAddress, OpDecode],
+        leaders: set[PhysAddress],
+    ) -> BasicBlock:
+        cycles = 0
+        op_count = 0
+        edges: list[Edge] = []
+        calls: list[Call] = []
+        repeats = False
+        p = start
+        while True:
+            decode = decodes[p]
+            entry = decode.entry
+            spec = entry.spec
+            is_cond = spec.name == "DJNZ" or any(
+                a in _COND_OAS for a, _, _ in entry.layout
+            )
+            extra = entry.cycles_taken - entry.cycles
+            cycles += entry.cycles
+            op_count += 1
+            jump_target, call_target = self.op_targets(p, decode)
+            next_p = PhysAddress(p + entry.length)
+
+            if spec.name in {"CALL", "RST"}:
+                calls.append(Call(target=call_target, extra_cycles=extra))
+            elif spec.name == "JP" and entry.layout[0][0] == OA.MemHL:
+                # jp (hl), nothing to go on
+                edges.append(Edge(kind="jump", target=None, extra_cycles=extra))
+            elif spec.name in {"JP", "JR", "DJNZ"}:
+                edges.append(Edge(kind="jump", target=jump_target, extra_cycles=extra))
+            elif spec.name == "RET":
+                edges.append(Edge(kind="exit", target=None, extra_cycles=extra))
+            elif extra != 0:
+                # Block ops which repeat
+                repeats = True
+
+            if self.ends_block(entry):
+                if is_cond or not spec.stop:
+                    edges.append(Edge(kind="fall", target=next_p, extra_cycles=0))
+                break
+            if next_p in leaders or next_p not in decodes:
+                edges.append(Edge(kind="fall", target=next_p, extra_cycles=0))
+                break
+            p = next_p
+
+        return BasicBlock(
+            start=start,
+            end=PhysAddress(p + decodes[p].entry.length),
+            virt_addr=decodes[start].virt_addr,
+            op_count=op_count,
+            cycles=cycles,
+            edges=edges,
+            calls=calls,
+            repeats=repeats,
+        )
+
+    def name_of(self, p: PhysAddress) -> str:
+        # Relative labels like "-" and "++" don't say much out of context.
+        for label in self.rom.labels_from_addr.get(p, []):
+            if label.strip("-+_") != "":
+                return label
+        block = self.blocks.get(p)
+        if block is not None:
+            return format_virt(block.virt_addr)
+        return f"${p:05X}"
+
+
+class CostAnalyzer:
+    # Worst-case cycles through each routine, callees included.
+    #
+    # Loops get counted once: a jump back to a block which is already on the
+    # current path ends the path there. Recursive calls count as nothing.
+    # Anything like that gets flagged in the RoutineCost, as the real figure will be higher.
+
+    def __init__(self, *, cfg: ControlFlowGraph) -> None:
+        self.cfg = cfg
+        self.costs: dict[PhysAddress, RoutineCost] = {}
+        self.in_progress: set[PhysAddress] = set()
+
+    def routine_cost(self, entry: PhysAddress) -> RoutineCost:
+        cost = self.costs.get(entry)
+        if cost is not None:
+            return cost
+        if entry in self.in_progress or entry not in self.cfg.blocks:
+            return RoutineCost(
+                entry=entry,
+                cycles=0,
+                path=[],
+                has_loops=False,
+                has_unknown=entry not in self.cfg.blocks,
+                has_recursion=entry in self.in_progress,
+                has_repeats=False,
+            )
+
+        self.in_progress.add(entry)
+        try:
+            cost = self.compute_routine_cost(entry)
+        finally:
+            self.in_progress.remove(entry)
+        self.costs[entry] = cost
+        return cost
+
+    def compute_routine_cost(self, entry: PhysAddress) -> RoutineCost:
+        blocks = self.cfg.blocks
+        flags = {"loops": False, "unknown": False, "recursion": False, "repeats": False}
+
+        def note(cost: RoutineCost) -> None:
+            flags["loops"] |= cost.has_loops
+            flags["unknown"] |= cost.has_unknown
+            flags["recursion"] |= cost.has_recursion
+            flags["repeats"] |= cost.has_repeats
+
+        # Depth-first order over this routine's blocks, without recursing in Python,
+        # so every block comes after everything it can reach (back edges aside).
+        # Jumping to another routine is a tail call, so those end a path too.
+        order: list[PhysAddress] = []
+        state: dict[PhysAddress, int] = {entry: 1}
+        back_edges: set[tuple[PhysAddress, int]] = set()
+        stack: list[tuple[PhysAddress, int]] = [(entry, 0)]
+        while stack:
+            p, edge_idx = stack.pop()
+            edges = blocks[p].edges
+            if edge_idx < len(edges):
+                stack.append((p, edge_idx + 1))
+                target = edges[edge_idx].target
+                if (
+                    target is None
+                    or target not in blocks
+                    or (target != entry and target in self.cfg.routine_entries)
+                ):
+                    continue
+                if state.get(target) == 1:
+                    back_edges.add((p, edge_idx))
+                elif target not in state:
+                    state[target] = 1
+                    stack.append((target, 0))
+            else:
+                state[p] = 2
+                order.append(p)
+
+        # Longest path from each block to the end of the routine.
+        longest: dict[PhysAddress, tuple[int, Optional[PhysAddress]]] = {}
+        for p in order:
+            block = blocks[p]
+            block_cycles = block.cycles
+            for call in block.calls:
+                if call.target is None:
+                    flags["unknown"] = True
+                    block_cycles += call.extra_cycles
+                    continue
+                callee_cost = self.routine_cost(call.target)
+                note(callee_cost)
+                block_cycles += call.extra_cycles + callee_cost.cycles
+            flags["repeats"] |= block.repeats
+
+            best = 0
+            best_next: Optional[PhysAddress] = None
+            for edge_idx, edge in enumerate(block.edges):
+                after = edge.extra_cycles
+                next_p: Optional[PhysAddress] = None
+                if (p, edge_idx) in back_edges:
+                    flags["loops"] = True
+                elif edge.kind == "exit":
+                    pass
+                elif edge.target is None or edge.target not in blocks:
+                    flags["unknown"] = True
+                elif edge.target != entry and edge.target in self.cfg.routine_entries:
+                    tail_cost = self.routine_cost(edge.target)
+                    note(tail_cost)
+                    after += tail_cost.cycles
+                else:
+                    after += longest[edge.target][0]
+                    next_p = edge.target
+                if after > best or (after == best and best_next is None):
+                    best = after
+                    best_next = next_p
+            longest[p] = (block_cycles + best, best_next)
+
+        path: list[PhysAddress] = []
+        step: Optional[PhysAddress] = entry
+        while step is not None and step not in path:
+            path.append(step)
+            step = longest[step][1]
+
+        return RoutineCost(
+            entry=entry,
+            cycles=longest[entry][0],
+            path=path,
+            has_loops=flags["loops"],
+            has_unknown=flags["unknown"],
+            has_recursion=flags["recursion"],
+            has_repeats=flags["repeats"],
+        )
@@ -0,0 +1,28 @@
+from __future__ import annotations
+
+import os
+import threading
+
+
+def write_if_changed(file_name: str, data: bytes) -> bool:
+    # Leaves the file alone if it already holds exactly this, so its mtime doesn't change.
+    # Otherwise it gets replaced in one go, so nothing ever sees half a file.
+    try:
+        if os.stat(file_name).st_size == len(data):
+            with open(file_name, "rb") as infp:
+                if infp.read() == data:
+                    return False
+    except FileNotFoundError:
+        pass
+
+    # Blobs get written from several threads at once, so the temp name has to be unique.
+    tmp_file_name = f"{file_name}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(tmp_file_name, "wb") as outfp:
+            outfp.write(data)
+        os.replace(tmp_file_name, file_name)
+    except BaseException:
+        if os.path.exists(tmp_file_name):
+            os.remove(tmp_file_name)
+        raise
+    return True
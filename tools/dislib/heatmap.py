@@ -0,0 +1,62 @@
+from __future__ import annotations
+
+import json
+
+from typing import (
+    NamedTuple,
+    Optional,
+)
+
+from dislib.fileio import write_if_changed
+from dislib.miscdefs import PhysAddress
+
+
+class HeatCount(NamedTuple):
+    ops: int
+    cycles: int
+
+
+class HeatMap:
+    # How often the code at each ROM address ran in an emulated run,
+    # for the Saver to put next to each op.
+    # Only addresses which ran at all are kept.
+
+    def __init__(
+        self, *, counts: dict[PhysAddress, HeatCount], total_cycles: int, frames: int
+    ) -> None:
+        self.counts = counts
+        self.total_cycles = total_cycles
+        self.frames = frames
+
+    def format_addr(self, p: PhysAddress) -> Optional[str]:
+        # "1234x 5.67%": times run, and its share of all the T-states
+        count = self.counts.get(p)
+        if count is None:
+            return None
+        share = 100.0 * count.cycles / max(1, self.total_cycles)
+        return f"{count.ops}x {share:.2f}%"
+
+
+def write_heat_map(file_name: str, heat_map: HeatMap) -> None:
+    doc = {
+        "frames": heat_map.frames,
+        "total_cycles": heat_map.total_cycles,
+        "addrs": {
+            f"{p:05X}": [count.ops, count.cycles]
+            for p, count in sorted(heat_map.counts.items())
+        },
+    }
+    write_if_changed(file_name, (json.dumps(doc, indent=1) + "\n").encode("utf-8"))
+
+
+def read_heat_map(file_name: str) -> HeatMap:
+    with open(file_name, "r") as infp:
+        doc = json.load(infp)
+    return HeatMap(
+        counts={
+            PhysAddress(int(addr, 16)): HeatCount(ops=ops, cycles=cycles)
+            for addr, (ops, cycles) in doc["addrs"].items()
+        },
+        total_cycles=doc["total_cycles"],
+        frames=doc["frames"],
+    )
@@ -0,0 +1,272 @@
+from __future__ import annotations
+
+import bisect
+
+from typing import TYPE_CHECKING
+from typing import (
+    NamedTuple,
+    Optional,
+)
+
+from dislib.miscdefs import (
+    PhysAddress,
+    VirtAddress,
+)
+
+if TYPE_CHECKING:
+    from dislib.rom import Rom
+
+
+class AnalysisChanges(NamedTuple):
+    # What an incremental update changed, for working out which banks need saving again.
+    # Everything whose type, op or labels changed
+    addrs: set[PhysAddress]
+    # ... and just the ones whose labels changed, as other banks can refer to those
+    label_addrs: set[PhysAddress]
+
+
+def is_relative_label(label: str) -> bool:
+    # These don't go in label_to_addr, see Rom.set_label().
+    return (
+        label.strip("-") == ""
+        or label.strip("+") == ""
+        or label == "__"
+        or label.startswith("@")
+    )
+
+
+class IncrementalUpdater:
+    # Brings a finished trace up to date with a changed annotations file,
+    # giving exactly what a full run would have.
+    #
+    # The annotations get applied from scratch to an empty Rom, as that's quick.
+    # What's kept is the trace, which is where the time goes:
+    # - Anything the new annotations start tracing from which wasn't decoded before gets traced.
+    # - Anything which can't be reached from what they start tracing from any more gets dropped.
+    # - The types and labels get worked out again wherever the annotations changed them,
+    #   or wherever anything that got traced or dropped had an effect on them.
+    # This works because each op's effects (Rom.op_effects) only depend on the ROM and the
+    # bank settings, and AddrTypeMap.set_addr_type() gives the same answer in any order.
+    # Anything that would change what an op does, such as the bank settings,
+    # makes update() give up, and the caller starts over.
+
+    def __init__(self, *, rom: Rom) -> None:
+        self.rom = rom
+        self.changed_addrs: set[PhysAddress] = set()
+        self.changed_label_addrs: set[PhysAddress] = set()
+
+    def update(self, annotated: Rom) -> Optional[AnalysisChanges]:
+        # annotated has had the new annotations applied, and nothing else.
+        rom = self.rom
+        if not self.same_trace_inputs(annotated):
+            return None
+
+        # The Tracer sets types and labels as it goes, so this is what they get compared against
+        old_addr_types = rom.addr_types.copy()
+        old_labels_from_addr = {
+            phys_addr: list(labels)
+            for phys_addr, labels in rom.labels_from_addr.items()
+        }
+
+        # Anything that's been decoded doesn't need it again
+        worklist = rom.tracer_worklist
+        for phys_addr in rom.op_effects:
+            worklist.mark_visited(phys_addr)
+        old_op_count = len(rom.op_effects)
+        roots = annotated.tracer_worklist.pending()
+        for virt_addr in roots:
+            worklist.push(virt_addr)
+        rom.run_tracer()
+        new_ops = list(rom.op_effects)[old_op_count:]
+
+        # Types and labels that need working out again
+        type_addrs: set[PhysAddress] = set()
+        label_addrs: set[PhysAddress] = set()
+        for phys_addr in new_ops:
+            self.note_effects(phys_addr, type_addrs, label_addrs)
+        for phys_addr in self.unreachable_ops(rom.annotation_roots, roots):
+            self.note_effects(phys_addr, type_addrs, label_addrs)
+            del rom.op_effects[phys_addr]
+            rom.op_decodes.discard(phys_addr)
+            worklist.forget(phys_addr)
+
+        type_addrs.update(
+            rom.annotation_addr_types.differences(annotated.annotation_addr_types)
+        )
+        for phys_addr in (
+            rom.annotation_labels.keys() | annotated.annotation_labels.keys()
+        ):
+            if rom.annotation_labels.get(phys_addr) != annotated.annotation_labels.get(
+                phys_addr
+            ):
+                label_addrs.add(phys_addr)
+        label_addrs.update(
+            rom.annotation_auto_labels ^ annotated.annotation_auto_labels
+        )
+
+        rom.annot_lines = annotated.annot_lines
+        rom.annotation_addr_types = annotated.annotation_addr_types
+        rom.annotation_labels = annotated.annotation_labels
+        rom.annotation_roots = annotated.annotation_roots
+        rom.annotation_auto_labels = annotated.annotation_auto_labels
+        self.update_types(type_addrs)
+        self.changed_addrs.update(rom.addr_types.differences(old_addr_types))
+        self.update_labels(label_addrs, annotated)
+        for phys_addr in label_addrs:
+            if rom.labels_from_addr.get(phys_addr) != old_labels_from_addr.get(
+                phys_addr
+            ):
+                self.changed_addrs.add(phys_addr)
+                self.changed_label_addrs.add(phys_addr)
+
+        return AnalysisChanges(
+            addrs=self.changed_addrs, label_addrs=self.changed_label_addrs
+        )
+
+    def same_trace_inputs(self, annotated: Rom) -> bool:
+        # Everything the annotations set up other than labels, types and where to trace from.
+        rom = self.rom
+        return (
+            [list(m) for m in rom.bank_overrides]
+            == [list(m) for m in annotated.bank_overrides]
+            and rom.forced_immediates == annotated.forced_immediates
+            and list(rom.binexports) == list(annotated.binexports)
+            and rom.addr_refs == annotated.addr_refs
+        )
+
+    def note_effects(
+        self,
+        phys_addr: PhysAddress,
+        type_addrs: set[PhysAddress],
+        label_addrs: set[PhysAddress],
+    ) -> None:
+        # An op which got decoded or dropped.
+        effects = self.rom.op_effects[phys_addr]
+        self.changed_addrs.add(phys_addr)
+        type_addrs.update(addr for addr, _ in effects.addr_types)
+        label_addrs.update(
+            self.rom.virt_to_phys(virt_addr) for virt_addr, _ in effects.labels
+        )
+
+    def rom_phys(self, virt_addr: VirtAddress) -> Optional[PhysAddress]:
+        # Where the worklist would put this, if anywhere.
+        if (virt_addr >> 16) >= self.rom.bank_count:
+            return None
+        return self.rom.virt_to_phys(virt_addr)
+
+    def unreachable_ops(
+        self, old_roots: list[VirtAddress], roots: list[VirtAddress]
+    ) -> list[PhysAddress]:
+        # Everything was reachable from the old roots, so anything that isn't now
+        # has to be reachable from the ones that went, which is usually not much.
+        # Whatever else there is can still be reached, and so can anything it pushes.
+        op_effects = self.rom.op_effects
+        root_addrs = {
+            phys_addr
+            for phys_addr in map(self.rom_phys, roots)
+            if phys_addr is not None
+        }
+        gone_root_addrs = {
+            phys_addr
+            for phys_addr in map(self.rom_phys, old_roots)
+            if phys_addr is not None and phys_addr not in root_addrs
+        }
+        suspects = self.reachable_ops(gone_root_addrs, within=None)
+        if len(suspects) == 0:
+            return []
+        still_reachable = self.reachable_ops(
+            (root_addrs & suspects)
+            | {
+                phys_addr
+                for op_phys_addr, phys_addr in op_effects.pushes_into(suspects)
+                if op_phys_addr not in suspects
+            },
+            within=suspects,
+        )
+        return sorted(suspects - still_reachable)
+
+    def reachable_ops(
+        self, starts: set[PhysAddress], *, within: Optional[set[PhysAddress]]
+    ) -> set[PhysAddress]:
+        # Every decoded op that can be got to from starts, without leaving within.
+        op_effects = self.rom.op_effects
+        reachable: set[PhysAddress] = set()
+        stack = list(starts)
+        while stack:
+            phys_addr = stack.pop()
+            if (
+                phys_addr in reachable
+                or phys_addr not in op_effects
+                or (within is not None and phys_addr not in within)
+            ):
+                continue
+            reachable.add(phys_addr)
+            stack.extend(op_effects.pushes(phys_addr))
+        return reachable
+
+    def update_types(self, type_addrs: set[PhysAddress]) -> None:
+        rom = self.rom
+        addrs = rom.addr_types.rebuild_addrs(type_addrs)
+        rom.addr_types.rebuild(
+            addrs,
+            base=rom.annotation_addr_types,
+            requests=rom.op_effects.addr_types_in(addrs),
+        )
+
+    def update_labels(self, label_addrs: set[PhysAddress], annotated: Rom) -> None:
+        rom = self.rom
+
+        # Which of these the remaining ops want a label for, and what they'd call it.
+        first_virt_addrs: dict[PhysAddress, VirtAddress] = {}
+        traced_labels: dict[PhysAddress, list[tuple[VirtAddress, str]]] = {}
+        for virt_addr, label in rom.op_effects.labels():
+            phys_addr = rom.virt_to_phys(virt_addr)
+            if phys_addr not in label_addrs:
+                continue
+            first_virt_addrs.setdefault(phys_addr, virt_addr)
+            if label is not None:
+                traced_labels.setdefault(phys_addr, [])
+                if (virt_addr, label) not in traced_labels[phys_addr]:
+                    traced_labels[phys_addr].append((virt_addr, label))
+
+        # Same as a full run: the annotations' labels, then the Tracer's,
+        # or a made-up one if there aren't any of those.
+        new_labels: dict[PhysAddress, list[tuple[VirtAddress, str]]] = {}
+        for phys_addr in label_addrs:
+            labels = [
+                (annotated.label_to_addr.get(label, VirtAddress(0)), label)
+                for label in rom.annotation_labels.get(phys_addr, [])
+            ]
+            for virt_addr, label in traced_labels.get(phys_addr, []):
+                if all(label != other for _, other in labels):
+                    labels.append((virt_addr, label))
+            is_auto = phys_addr in rom.annotation_auto_labels
+            if len(labels) == 0 and phys_addr in first_virt_addrs:
+                virt_addr = first_virt_addrs[phys_addr]
+                labels.append((virt_addr, rom.auto_label(virt_addr)))
+                is_auto = True
+            if is_auto:
+                rom.auto_labels.add(phys_addr)
+            else:
+                rom.auto_labels.discard(phys_addr)
+            if [label for _, label in labels] != rom.labels_from_addr.get(
+                phys_addr, []
+            ):
+                new_labels[phys_addr] = labels
+
+        # Take all the old ones out first, as a label can move from one address to another.
+        for phys_addr in new_labels:
+            for label in rom.labels_from_addr.pop(phys_addr, []):
+                if not is_relative_label(label):
+                    del rom.label_to_addr[label]
+            idx = bisect.bisect_left(rom.label_addrs, phys_addr)
+            if idx < len(rom.label_addrs) and rom.label_addrs[idx] == phys_addr:
+                del rom.label_addrs[idx]
+        for phys_addr, labels in new_labels.items():
+            if len(labels) >= 1:
+                rom.labels_from_addr[phys_addr] = [label for _, label in labels]
+                bisect.insort(rom.label_addrs, phys_addr)
+                for virt_addr, label in labels:
+                    if not is_relative_label(label):
+                        assert label not in rom.label_to_addr, label
+                        rom.label_to_addr[label] = virt_addr
@@ -7,10 +7,28 @@ from typing import (
     NewType,
 )
 
-VirtAddress = NewType("VirtAddress", tuple[int, int])
+# Bank in the upper bits, offset in the lower 16.
+# An int instead of a tuple, so making one doesn't need a whole extra object.
+VirtAddress = NewType("VirtAddress", int)
 PhysAddress = NewType("PhysAddress", int)
 
 
+def make_virt(bank: int, offs: int) -> VirtAddress:
+    return VirtAddress((bank << 16) | offs)
+
+
+def virt_bank(v: VirtAddress) -> int:
+    return v >> 16
+
+
+def virt_offs(v: VirtAddress) -> int:
+    return v & 0xFFFF
+
+
+def format_virt(v: VirtAddress) -> str:
+    return f"{v >> 16:02X}:{v & 0xFFFF:04X}"
+
+
 class AT(enum.Enum):
     DataByte = enum.auto()
     DataWord = enum.auto()
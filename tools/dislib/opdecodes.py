@@ -0,0 +1,262 @@
+from __future__ import annotations
+
+import array
+import bisect
+
+from typing import (
+    Iterator,
+    NamedTuple,
+    Optional,
+)
+
+from dislib.miscdefs import (
+    AT,
+    PhysAddress,
+    VirtAddress,
+    make_virt,
+    virt_bank,
+    virt_offs,
+)
+from dislib.z80ops import (
+    OE,
+    OP_ENTRIES,
+)
+
+
+class OpDecode(NamedTuple):
+    virt_addr: VirtAddress
+    entry: OE
+
+
+class OpEffects(NamedTuple):
+    # Everything the Tracer did while decoding one op, so it can be undone later.
+    # (address, type) for every type it asked for
+    addr_types: list[tuple[PhysAddress, AT]]
+    # Every address it wanted a label for, with the label if it isn't a made-up one
+    labels: list[tuple[VirtAddress, Optional[str]]]
+    # Every address it pushed, even ones which were already decoded
+    pushes: list[VirtAddress]
+
+
+# What an entry in an OpEffectLog is, in its bottom 2 bits.
+# The rest is the op's address, the address << 4 | AT.value, or the virtual address.
+_EFFECT_OP = 0
+_EFFECT_TYPE = 1
+_EFFECT_PUSH = 2
+_EFFECT_LABEL = 3
+
+_AT_FROM_VALUE = {at.value: at for at in AT}
+
+
+class OpEffectLog:
+    # The OpEffects of every op, in the order they got decoded.
+    # This gets added to for every op the Tracer decodes, so it's one flat array,
+    # as making an object for each one is slow and keeps the garbage collector busy.
+    # Each op's entries go from where it starts to where the next one starts.
+
+    def __init__(self, *, bank_count: int, bank_size: int) -> None:
+        self._bank_count = bank_count
+        self._bank_size = bank_size
+        self._log = array.array("I")
+        # Where each op's entries start
+        self._starts: dict[PhysAddress, int] = {}
+        # The labels the Tracer gave a name to, by where they are in the log
+        self._names: dict[int, str] = {}
+        # How much of the log is for ops that got taken out
+        self._dead_count = 0
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def __iter__(self) -> Iterator[PhysAddress]:
+        return iter(self._starts)
+
+    def __contains__(self, p: int) -> bool:
+        return p in self._starts
+
+    def start_op(self, p: PhysAddress) -> None:
+        # Every op asks for AT.Op where it starts, so that isn't noted down separately.
+        self._starts[p] = len(self._log)
+        self._log.append(p << 2)
+
+    def add_type(self, p: PhysAddress, addr_type: AT) -> None:
+        self._log.append((p << 6) | (addr_type.value << 2) | _EFFECT_TYPE)
+
+    def add_push(self, v: VirtAddress) -> None:
+        self._log.append((v << 2) | _EFFECT_PUSH)
+
+    def add_label(self, v: VirtAddress, label: Optional[str]) -> None:
+        if label is not None:
+            self._names[len(self._log)] = label
+        self._log.append((v << 2) | _EFFECT_LABEL)
+
+    def __getitem__(self, p: PhysAddress) -> OpEffects:
+        effects = OpEffects(addr_types=[(p, AT.Op)], labels=[], pushes=[])
+        start = self._starts[p]
+        for idx in range(start + 1, self._end(start)):
+            entry = self._log[idx]
+            kind = entry & 3
+            if kind == _EFFECT_TYPE:
+                effects.addr_types.append(
+                    (PhysAddress(entry >> 6), _AT_FROM_VALUE[(entry >> 2) & 15])
+                )
+            elif kind == _EFFECT_PUSH:
+                effects.pushes.append(VirtAddress(entry >> 2))
+            else:
+                effects.labels.append((VirtAddress(entry >> 2), self._names.get(idx)))
+        return effects
+
+    def __delitem__(self, p: PhysAddress) -> None:
+        # What it leaves in the log gets skipped, until the next time it's looked through.
+        start = self._starts.pop(p)
+        self._dead_count += self._end(start) - start
+
+    def pushes(self, p: PhysAddress) -> list[PhysAddress]:
+        # Just the pushes which are in the ROM, as that's all the Tracer follows.
+        log = self._log
+        bank_count = self._bank_count
+        bank_size = self._bank_size
+        pushes: list[PhysAddress] = []
+        idx = self._starts[p] + 1
+        while idx < len(log):
+            entry = log[idx]
+            kind = entry & 3
+            if kind == _EFFECT_OP:
+                break
+            if kind == _EFFECT_PUSH and (entry >> 18) < bank_count:
+                pushes.append(
+                    PhysAddress(
+                        (entry >> 18) * bank_size + ((entry >> 2) & 0xFFFF) % bank_size
+                    )
+                )
+            idx += 1
+        return pushes
+
+    def pushes_into(
+        self, targets: set[PhysAddress]
+    ) -> list[tuple[PhysAddress, PhysAddress]]:
+        # (op, target) for every push any op did to targets.
+        bank_count = self._bank_count
+        bank_size = self._bank_size
+        result: list[tuple[PhysAddress, PhysAddress]] = []
+        op = PhysAddress(0)
+        for entry in self._live_log():
+            kind = entry & 3
+            if kind == _EFFECT_OP:
+                op = PhysAddress(entry >> 2)
+            elif kind == _EFFECT_PUSH and (entry >> 18) < bank_count:
+                p = (entry >> 18) * bank_size + ((entry >> 2) & 0xFFFF) % bank_size
+                if p in targets:
+                    result.append((op, PhysAddress(p)))
+        return result
+
+    def addr_types_in(self, addrs: set[PhysAddress]) -> list[tuple[PhysAddress, AT]]:
+        # Every type any op asked for at addrs.
+        addr_types: list[tuple[PhysAddress, AT]] = []
+        for entry in self._live_log():
+            kind = entry & 3
+            if kind == _EFFECT_TYPE:
+                if (entry >> 6) in addrs:
+                    addr_types.append(
+                        (PhysAddress(entry >> 6), _AT_FROM_VALUE[(entry >> 2) & 15])
+                    )
+            elif kind == _EFFECT_OP and (entry >> 2) in addrs:
+                addr_types.append((PhysAddress(entry >> 2), AT.Op))
+        return addr_types
+
+    def labels(self) -> list[tuple[VirtAddress, Optional[str]]]:
+        # Every label any op wanted, in the order they got decoded.
+        log = self._live_log()
+        names = self._names
+        return [
+            (VirtAddress(entry >> 2), names.get(idx))
+            for idx, entry in enumerate(log)
+            if (entry & 3) == _EFFECT_LABEL
+        ]
+
+    def _live_log(self) -> array.array[int]:
+        # Tidies up after any ops that got taken out first, so all of it is live.
+        if self._dead_count != 0:
+            self._compact()
+        return self._log
+
+    def _end(self, start: int) -> int:
+        log = self._log
+        idx = start + 1
+        while idx < len(log) and (log[idx] & 3) != _EFFECT_OP:
+            idx += 1
+        return idx
+
+    def _compact(self) -> None:
+        # The ops are still in the order they got decoded, so their starts are sorted.
+        old_names = self._names
+        old_starts = list(self._starts.values())
+        ends = [self._end(start) for start in old_starts]
+        old_log = self._log
+        self._log = array.array("I")
+        self._names = {}
+        self._dead_count = 0
+        new_starts: list[int] = []
+        for p, start, end in zip(self._starts, old_starts, ends):
+            self._starts[p] = len(self._log)
+            new_starts.append(len(self._log))
+            self._log.extend(old_log[start:end])
+        for idx, name in old_names.items():
+            op_idx = bisect.bisect_right(old_starts, idx) - 1
+            if op_idx >= 0 and idx < ends[op_idx]:
+                self._names[new_starts[op_idx] + idx - old_starts[op_idx]] = name
+
+
+class OpDecodeMap:
+    # Which op table entry got decoded at each ROM address, and at which virtual address.
+    # The text is made when saving, see OpFormatter.
+    # Code 0 means "nothing decoded here", everything else is OE.idx + 1.
+
+    def __init__(self, *, rom_size: int, bank_size: int) -> None:
+        self._bank_size = bank_size
+        self._entry_codes = array.array("H", [0]) * rom_size
+        # The bank is always the physical bank, so only the offset needs keeping.
+        self._virt_offs = array.array("H", [0]) * rom_size
+
+    def __contains__(self, p: int) -> bool:
+        return 0 <= p < len(self._entry_codes) and self._entry_codes[p] != 0
+
+    def __len__(self) -> int:
+        return len(self._entry_codes) - self._entry_codes.count(0)
+
+    def get(self, p: int) -> Optional[OpDecode]:
+        if not (0 <= p < len(self._entry_codes)):
+            return None
+        code = self._entry_codes[p]
+        if code == 0:
+            return None
+        return OpDecode(
+            virt_addr=make_virt(p // self._bank_size, self._virt_offs[p]),
+            entry=OP_ENTRIES[code - 1],
+        )
+
+    def __getitem__(self, p: int) -> OpDecode:
+        decode = self.get(p)
+        if decode is None:
+            raise KeyError(p)
+        return decode
+
+    def set(self, p: PhysAddress, virt_addr: VirtAddress, entry: OE) -> None:
+        assert virt_bank(virt_addr) == p // self._bank_size
+        self._entry_codes[p] = entry.idx + 1
+        self._virt_offs[p] = virt_offs(virt_addr)
+
+    def discard(self, p: PhysAddress) -> None:
+        self._entry_codes[p] = 0
+        self._virt_offs[p] = 0
+
+    def items(self) -> Iterator[tuple[PhysAddress, OpDecode]]:
+        for p, code in enumerate(self._entry_codes):
+            if code != 0:
+                yield (
+                    PhysAddress(p),
+                    OpDecode(
+                        virt_addr=make_virt(p // self._bank_size, self._virt_offs[p]),
+                        entry=OP_ENTRIES[code - 1],
+                    ),
+                )
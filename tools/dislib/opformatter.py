@@ -0,0 +1,230 @@
+from __future__ import annotations
+
+import functools
+import struct
+
+from typing import TYPE_CHECKING
+from typing import (
+    Callable,
+)
+
+from dislib.miscdefs import (
+    AT,
+    PhysAddress,
+    VirtAddress,
+)
+from dislib.opdecodes import OpDecode
+from dislib.z80ops import (
+    OA,
+    OA_MAP_CONST_ADDR,
+)
+
+if TYPE_CHECKING:
+    from dislib.rom import Rom
+
+U8 = struct.Struct("<B")
+S8 = struct.Struct("<b")
+U16 = struct.Struct("<H")
+
+# (bank, bank index, bank physical address, arg offset in bank) -> arg text
+ArgFormatter = Callable[[memoryview, int, PhysAddress, int], str]
+
+
+class OpFormatter:
+    # Turns the ops the Tracer decoded into text.
+    # This happens when saving, so every label from the whole trace is known by then.
+    # Each format_arg_* goes with the Tracer's decode_arg_* of the same name.
+
+    def __init__(self, *, rom: Rom) -> None:
+        self.rom = rom
+        # Every address whose labels made a difference to the text, wherever it is.
+        # An incremental update uses this to find the banks a label change affects.
+        self.label_deps: set[PhysAddress] = set()
+        self.arg_formatters: dict[OA, ArgFormatter] = {
+            OA.Byte: self.format_arg_byte,
+            OA.Word: self.format_arg_word,
+            OA.MemByteImmWord: self.format_arg_mem_imm_word,
+            OA.MemWordImmWord: self.format_arg_mem_imm_word,
+            OA.PortByteImm: self.format_arg_port_byte_imm,
+            OA.JumpRelByte: self.format_arg_jump_rel_byte,
+            OA.JumpWord: self.format_arg_jump_word,
+            OA.MemIXdd: self.format_arg_mem_ixdd,
+            OA.MemIYdd: self.format_arg_mem_iydd,
+            OA.MemIXddCB: self.format_arg_mem_ixdd_cb,
+            OA.MemIYddCB: self.format_arg_mem_iydd_cb,
+        }
+        for a, val in OA_MAP_CONST_ADDR.items():
+            self.arg_formatters[a] = functools.partial(self.format_arg_const_addr, val)
+
+    def format_op(self, op_phys_addr: PhysAddress, decode: OpDecode) -> str:
+        entry = decode.entry
+        bank_idx = decode.virt_addr >> 16
+        rel_addr = op_phys_addr % self.rom.bank_size
+        bank_phys_addr = PhysAddress(bank_idx * self.rom.bank_size)
+        bank = self.rom.bank_views[bank_idx]
+
+        op_args: list[str] = []
+        for a, arg_offs, arg_str in entry.layout:
+            if arg_str == "":
+                arg_str = self.arg_formatters[a](
+                    bank, bank_idx, bank_phys_addr, rel_addr + arg_offs
+                )
+            op_args.append(arg_str)
+
+        if len(op_args) >= 1:
+            return f"{entry.mnemonic} {', '.join(op_args)}"
+        else:
+            return entry.mnemonic
+
+    def label_text(
+        self,
+        val: int,
+        *,
+        relative_to: VirtAddress,
+        allow_relative_labels: bool = False,
+    ) -> str:
+        return self.virt_label_text(
+            self.rom.naive_to_virt(val, relative_to=relative_to),
+            relative_to=relative_to,
+            allow_relative_labels=allow_relative_labels,
+        )
+
+    def virt_label_text(
+        self,
+        virt_addr: VirtAddress,
+        *,
+        relative_to: VirtAddress,
+        allow_relative_labels: bool = False,
+    ) -> str:
+        self.label_deps.add(self.rom.virt_to_phys(virt_addr))
+        return self.rom.label_text(
+            virt_addr,
+            relative_to=relative_to,
+            allow_relative_labels=allow_relative_labels,
+        )
+
+    def first_label(self, phys_addr: PhysAddress) -> str:
+        self.label_deps.add(phys_addr)
+        return self.rom.labels_from_addr[phys_addr][0]
+
+    def format_arg_byte(
+        self, bank: memoryview, bank_idx: int, bank_phys_addr: PhysAddress, pc: int
+    ) -> str:
+        arg_phys_addr = PhysAddress(bank_phys_addr + pc)
+        atype = self.rom.addr_types[arg_phys_addr]
+        (val,) = U8.unpack_from(bank, pc)
+        if atype == AT.DataByteLabelLo:
+            refaddr = self.rom.addr_refs[arg_phys_addr]
+            label = self.first_label(self.rom.virt_to_phys(refaddr))
+            return f"{label}&$FF"
+        elif atype == AT.DataByteLabelHi:
+            refaddr = self.rom.addr_refs[arg_phys_addr]
+            label = self.first_label(self.rom.virt_to_phys(refaddr))
+            return f"{label}>>8"
+        else:
+            return f"${val:02X}"
+
+    def format_arg_word(
+        self, bank: memoryview, bank_idx: int, bank_phys_addr: PhysAddress, pc: int
+    ) -> str:
+        arg_phys_addr = PhysAddress(bank_phys_addr + pc)
+        (val,) = U16.unpack_from(bank, pc)
+        virt_val = self.rom.naive_to_virt(
+            val, relative_to=VirtAddress((bank_idx << 16) | pc)
+        )
+        phys_val = self.rom.virt_to_phys(virt_val)
+        self.label_deps.add(phys_val)
+        if (
+            0xC000 <= val <= 0xDFFF
+            or (val < 0xE000 and val > 0x0038 and phys_val in self.rom.labels_from_addr)
+            or arg_phys_addr in self.rom.bank_overrides[val // self.rom.bank_size]
+        ) and (arg_phys_addr) not in self.rom.forced_immediates:
+            return self.virt_label_text(
+                self.rom.phys_to_virt(
+                    phys_val, relative_to=VirtAddress((bank_idx << 16) | pc)
+                ),
+                relative_to=VirtAddress((bank_idx << 16) | pc),
+            )
+        else:
+            return f"${val:04X}"
+
+    def format_arg_mem_imm_word(
+        self, bank: memoryview, bank_idx: int, bank_phys_addr: PhysAddress, pc: int
+    ) -> str:
+        (val,) = U16.unpack_from(bank, pc)
+        label = self.label_text(val, relative_to=VirtAddress((bank_idx << 16) | pc))
+        return f"({label})"
+
+    def format_arg_port_byte_imm(
+        self, bank: memoryview, bank_idx: int, bank_phys_addr: PhysAddress, pc: int
+    ) -> str:
+        (val,) = U8.unpack_from(bank, pc)
+        return f"(${val:02X})"
+
+    def format_arg_jump_rel_byte(
+        self, bank: memoryview, bank_idx: int, bank_phys_addr: PhysAddress, pc: int
+    ) -> str:
+        (val,) = S8.unpack_from(bank, pc)
+        val += bank_phys_addr + pc + 1
+        relative_to = VirtAddress((bank_idx << 16) | (pc - 1))
+        return self.virt_label_text(
+            self.rom.phys_to_virt(PhysAddress(val), relative_to=relative_to),
+            relative_to=relative_to,
+            allow_relative_labels=True,
+        )
+
+    def format_arg_jump_word(
+        self, bank: memoryview, bank_idx: int, bank_phys_addr: PhysAddress, pc: int
+    ) -> str:
+        (val,) = U16.unpack_from(bank, pc)
+        if val < 0xC000:
+            return self.label_text(
+                val,
+                relative_to=VirtAddress((bank_idx << 16) | pc),
+                allow_relative_labels=True,
+            )
+        else:
+            return f"${val:04X}"
+
+    def format_arg_const_addr(
+        self,
+        val: int,
+        bank: memoryview,
+        bank_idx: int,
+        bank_phys_addr: PhysAddress,
+        pc: int,
+    ) -> str:
+        return f"${val:02X}"
+
+    def format_arg_mem_ixdd(
+        self, bank: memoryview, bank_idx: int, bank_phys_addr: PhysAddress, pc: int
+    ) -> str:
+        (val,) = S8.unpack_from(bank, pc)
+        if val >= 0:
+            return f"(ix+{val})"
+        else:
+            return f"(ix-{-val})"
+
+    def format_arg_mem_iydd(
+        self, bank: memoryview, bank_idx: int, bank_phys_addr: PhysAddress, pc: int
+    ) -> str:
+        (val,) = S8.unpack_from(bank, pc)
+        label = self.label_text(
+            val + 0xD200, relative_to=VirtAddress((bank_idx << 16) | pc)
+        )
+        return f"(iy+{label}-IYBASE)"
+
+    def format_arg_mem_ixdd_cb(
+        self, bank: memoryview, bank_idx: int, bank_phys_addr: PhysAddress, pc: int
+    ) -> str:
+        # Unsigned, unlike format_arg_mem_ixdd.
+        val = bank[pc]
+        return f"(ix+{val})"
+
+    def format_arg_mem_iydd_cb(
+        self, bank: memoryview, bank_idx: int, bank_phys_addr: PhysAddress, pc: int
+    ) -> str:
+        label = self.label_text(
+            bank[pc] + 0xD200, relative_to=VirtAddress((bank_idx << 16) | (pc + 1))
+        )
+        return f"(iy+{label}-IYBASE)"
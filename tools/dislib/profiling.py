@@ -0,0 +1,68 @@
+from __future__ import annotations
+
+import contextlib
+import json
+import time
+import tracemalloc
+
+from typing import (
+    Any,
+    Iterator,
+    Mapping,
+)
+
+
+class PhaseProfiler:
+    # Wall time and peak traced allocation for each phase of a run.
+    # When disabled, phase() does nothing, so callers don't need to care.
+
+    def __init__(self, *, enabled: bool) -> None:
+        self.enabled = enabled
+        self.phases: dict[str, tuple[float, int]] = {}
+
+    @contextlib.contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        if not self.enabled:
+            yield
+            return
+
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+        tracemalloc.reset_peak()
+        base_size, _ = tracemalloc.get_traced_memory()
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start_time
+            _, peak_size = tracemalloc.get_traced_memory()
+            old_elapsed, old_peak = self.phases.get(name, (0.0, 0))
+            self.phases[name] = (
+                old_elapsed + elapsed,
+                max(old_peak, peak_size - base_size),
+            )
+
+    def report(self, stats: Mapping[str, int]) -> dict[str, Any]:
+        return {
+            "phases": {
+                name: {"seconds": elapsed, "peak_bytes": peak}
+                for name, (elapsed, peak) in self.phases.items()
+            },
+            "counters": dict(sorted(stats.items())),
+        }
+
+    def report_text(self, stats: Mapping[str, int]) -> str:
+        lines = [f"{'phase':<12s} {'seconds':>9s} {'peak KiB':>10s}"]
+        for name, (elapsed, peak) in self.phases.items():
+            lines.append(f"{name:<12s} {elapsed:9.3f} {peak // 1024:10d}")
+        total = sum(elapsed for elapsed, _ in self.phases.values())
+        lines.append(f"{'total':<12s} {total:9.3f}")
+        lines.append("")
+        for key, count in sorted(stats.items()):
+            lines.append(f"{key:<40s} {count:10d}")
+        return "\n".join(lines) + "\n"
+
+    def save_json(self, file_name: str, stats: Mapping[str, int]) -> None:
+        with open(file_name, "w") as outfp:
+            json.dump(self.report(stats), outfp, indent=2)
+            outfp.write("\n")
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import bisect
+
+from typing import (
+    Generic,
+    Iterator,
+    Optional,
+    TypeVar,
+    overload,
+)
+
+T = TypeVar("T")
+
+
+class RangeMap(Generic[T]):
+    # Sorted, non-overlapping [start, end) intervals, each with a value.
+    # Writing over an existing range replaces whatever was there (last writer wins).
+
+    def __init__(self) -> None:
+        self._starts: list[int] = []
+        self._ends: list[int] = []
+        self._values: list[T] = []
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def __iter__(self) -> Iterator[tuple[int, int, T]]:
+        return iter(zip(self._starts, self._ends, self._values))
+
+    def __contains__(self, p: int) -> bool:
+        return self._find_idx(p) >= 0
+
+    def _find_idx(self, p: int) -> int:
+        idx = bisect.bisect_right(self._starts, p) - 1
+        if idx >= 0 and p < self._ends[idx]:
+            return idx
+        else:
+            return -1
+
+    @overload
+    def get(self, p: int) -> Optional[T]: ...
+    @overload
+    def get(self, p: int, default: T) -> T: ...
+    def get(self, p: int, default: Optional[T] = None) -> Optional[T]:
+        idx = self._find_idx(p)
+        return self._values[idx] if idx >= 0 else default
+
+    def find(self, p: int) -> Optional[tuple[int, int, T]]:
+        # Returns the whole interval containing p, if there is one.
+        idx = self._find_idx(p)
+        if idx >= 0:
+            return (self._starts[idx], self._ends[idx], self._values[idx])
+        else:
+            return None
+
+    def _overlap_idxs(self, start: int, end: int) -> tuple[int, int]:
+        # Anything ending after our start and starting before our end.
+        return (
+            bisect.bisect_right(self._ends, start),
+            bisect.bisect_left(self._starts, end),
+        )
+
+    def overlapping(self, start: int, end: int) -> list[tuple[int, int, T]]:
+        lo, hi = self._overlap_idxs(start, end)
+        return [
+            (self._starts[i], self._ends[i], self._values[i]) for i in range(lo, hi)
+        ]
+
+    def set_range(self, start: int, end: int, value: T) -> None:
+        if start >= end:
+            return
+        lo, hi = self._overlap_idxs(start, end)
+
+        # Keep whatever sticks out either side of the new range.
+        new_starts = [start]
+        new_ends = [end]
+        new_values = [value]
+        if lo < hi and self._starts[lo] < start:
+            new_starts.insert(0, self._starts[lo])
+            new_ends.insert(0, start)
+            new_values.insert(0, self._values[lo])
+        if lo < hi and self._ends[hi - 1] > end:
+            new_starts.append(end)
+            new_ends.append(self._ends[hi - 1])
+            new_values.append(self._values[hi - 1])
+
+        # Pull in touching neighbours, then merge anything next to each other with the same value.
+        # That includes the bits kept either side, if they have the value being written.
+        if lo >= 1 and self._ends[lo - 1] == new_starts[0]:
+            lo -= 1
+            new_starts.insert(0, self._starts[lo])
+            new_ends.insert(0, self._ends[lo])
+            new_values.insert(0, self._values[lo])
+        if hi < len(self._starts) and self._starts[hi] == new_ends[-1]:
+            new_starts.append(self._starts[hi])
+            new_ends.append(self._ends[hi])
+            new_values.append(self._values[hi])
+            hi += 1
+        merged_starts = [new_starts[0]]
+        merged_ends = [new_ends[0]]
+        merged_values = [new_values[0]]
+        for i in range(1, len(new_starts)):
+            if merged_ends[-1] == new_starts[i] and merged_values[-1] == new_values[i]:
+                merged_ends[-1] = new_ends[i]
+            else:
+                merged_starts.append(new_starts[i])
+                merged_ends.append(new_ends[i])
+                merged_values.append(new_values[i])
+
+        self._starts[lo:hi] = merged_starts
+        self._ends[lo:hi] = merged_ends
+        self._values[lo:hi] = merged_values
@@ -0,0 +1,211 @@
+from __future__ import annotations
+
+import random
+import struct
+
+from dislib.z80ops import (
+    OA,
+    OP_SPECS_CB,
+    OP_SPECS_DD_XX,
+    OP_SPECS_ED,
+    OP_SPECS_FD_XX,
+    OP_SPECS_XX,
+    OS,
+)
+
+BANK_SIZE = 0x4000
+# Code fills the first half of each bank, made-up data structures sit in the second.
+CODE_END = 0x2000
+DATA_BASE = 0x2000
+# Where the extra labels for bigger annotation files go.
+EXTRA_LABEL_BASE = 0x3800
+EXTRA_LABEL_SPACE = BANK_SIZE - EXTRA_LABEL_BASE
+
+# (prefix bytes, opcode, spec)
+_ALL_SPECS: list[tuple[bytes, int, OS]] = [
+    (prefix, op, spec)
+    for prefix, specs in [
+        (b"", OP_SPECS_XX),
+        (b"\xed", OP_SPECS_ED),
+        (b"\xcb", OP_SPECS_CB),
+        (b"\xdd", OP_SPECS_DD_XX),
+        (b"\xfd", OP_SPECS_FD_XX),
+    ]
+    for op, spec in specs.items()
+    # jp (hl) goes nowhere the tracer can follow, so it'd cut off half the code.
+    if not (prefix == b"" and op == 0o351)
+]
+
+
+def _virt_base(bank_idx: int) -> int:
+    if bank_idx == 0:
+        return 0x0000
+    elif bank_idx == 1:
+        return 0x4000
+    else:
+        return 0x8000
+
+
+class SyntheticRomBuilder:
+    # Makes a ROM full of random but valid Z80 code, plus an annotations file for it.
+    # Same seed and sizes in, same ROM and annotations out.
+
+    def __init__(
+        self, *, seed: int, bank_count: int, annot_scale: int, data_dir: str
+    ) -> None:
+        assert 2 <= bank_count <= 0xF0, "bank $F0 is where RAM lives"
+        assert 1 <= annot_scale <= EXTRA_LABEL_SPACE // 32
+        assert " " not in data_dir
+        self.rand = random.Random(seed)
+        self.bank_count = bank_count
+        self.annot_scale = annot_scale
+        self.data_dir = data_dir
+        self.data = bytearray(
+            self.rand.getrandbits(8) for _ in range(bank_count * BANK_SIZE)
+        )
+        self.annot_lines: list[str] = []
+
+    def build(self) -> tuple[bytes, list[str]]:
+        self.annot_lines += [
+            "code 00:0000 ENTRY_RESET",
+            "code 00:0038 ENTRY_IRQ",
+            "code 00:0066 ENTRY_NMI",
+        ]
+        for addr in range(0x00, 0x40, 0x08):
+            self.data[addr] = 0xC9  # ret
+        self.data[0x66] = 0xC9  # ret
+        for bank_idx in range(2, self.bank_count):
+            self.annot_lines.append(f"bankslot {bank_idx:02X} 2")
+        self.annot_lines += [
+            "label F0:D200 byte iy_00",
+            "arraylabel F0:C000 byte 64 g_table",
+            "label F0:C100 word g_word",
+        ]
+
+        for bank_idx in range(self.bank_count):
+            op_starts = self.build_code(bank_idx)
+            self.build_data(bank_idx, op_starts)
+
+        return (bytes(self.data), self.annot_lines)
+
+    def build_code(self, bank_idx: int) -> list[int]:
+        # Returns the offset of every op in the bank.
+        rand = self.rand
+        bank_phys_addr = bank_idx * BANK_SIZE
+        virt_base = _virt_base(bank_idx)
+        ops: list[tuple[int, bytearray]] = []
+        # (op index, arg offset, is relative)
+        fixups: list[tuple[int, int, bool]] = []
+
+        pc = 0x0100 if bank_idx == 0 else 0x0000
+        while pc < CODE_END - 8:
+            prefix, op, spec = rand.choice(_ALL_SPECS)
+            buf = bytearray(prefix)
+            if (
+                prefix == b"\xcb"
+                and len(spec.args) >= 1
+                and spec.args[-1] == OA.MemHL
+                and rand.random() < 0.2
+            ):
+                # DD CB dd xx / FD CB dd xx
+                buf = bytearray(rand.choice([b"\xdd\xcb", b"\xfd\xcb"]))
+                buf.append(rand.getrandbits(8))
+            buf.append(op)
+            for a in spec.args:
+                if a in {OA.Byte, OA.PortByteImm, OA.MemIXdd, OA.MemIYdd}:
+                    buf.append(rand.getrandbits(8))
+                elif a == OA.Word:
+                    val = rand.choice(
+                        [
+                            rand.randrange(0xC000, 0xE000),
+                            rand.randrange(0x0000, 0x10000),
+                            virt_base + rand.randrange(DATA_BASE, BANK_SIZE),
+                        ]
+                    )
+                    buf += struct.pack("<H", val)
+                elif a in {OA.MemByteImmWord, OA.MemWordImmWord}:
+                    buf += struct.pack("<H", rand.randrange(0xC000, 0xDFFE))
+                elif a == OA.JumpRelByte:
+                    fixups.append((len(ops), len(buf), True))
+                    buf.append(0)
+                elif a == OA.JumpWord:
+                    fixups.append((len(ops), len(buf), False))
+                    buf += b"\x00\x00"
+            ops.append((pc, buf))
+            pc += len(buf)
+        ops.append((pc, bytearray(b"\xc9")))  # ret
+
+        # Point every jump at the start of some op.
+        op_starts = [op_pc for op_pc, _ in ops]
+        for op_idx, arg_offs, is_relative in fixups:
+            op_pc, buf = ops[op_idx]
+            op_end = op_pc + len(buf)
+            if is_relative:
+                target = rand.choice(
+                    [p for p in op_starts if -128 <= p - op_end <= 127]
+                )
+                buf[arg_offs] = (target - op_end) & 0xFF
+            else:
+                target = rand.choice(op_starts)
+                buf[arg_offs : arg_offs + 2] = struct.pack("<H", target + virt_base)
+        for op_pc, buf in ops:
+            self.data[bank_phys_addr + op_pc : bank_phys_addr + op_pc + len(buf)] = buf
+
+        bank_str = f"{bank_idx:02X}"
+        if bank_idx != 0:
+            self.annot_lines.append(f"code {bank_str}:{virt_base:04X} entry_{bank_str}")
+        for i in range(4 * self.annot_scale):
+            target = rand.choice(op_starts)
+            self.annot_lines.append(
+                f"code {bank_str}:{target + virt_base:04X} sub_{bank_str}_{i}"
+            )
+        return op_starts
+
+    def build_data(self, bank_idx: int, op_starts: list[int]) -> None:
+        rand = self.rand
+        bank_phys_addr = bank_idx * BANK_SIZE
+        virt_base = _virt_base(bank_idx)
+        bank_str = f"{bank_idx:02X}"
+
+        def addr(offs: int) -> str:
+            return f"{bank_str}:{virt_base + DATA_BASE + offs:04X}"
+
+        # Jump table
+        jump_table = b"".join(
+            struct.pack("<H", rand.choice(op_starts) + virt_base) for _ in range(8)
+        )
+        jt_phys_addr = bank_phys_addr + DATA_BASE + 0x40
+        self.data[jt_phys_addr : jt_phys_addr + len(jump_table)] = jump_table
+
+        self.annot_lines += [
+            f"arraylabel {addr(0x0000)} byte 32 data_{bank_str}_bytes",
+            f"arraylabel {addr(0x0020)} word 16 data_{bank_str}_words",
+            f"arraylabel {addr(0x0040)} codewptr 8 data_{bank_str}_jt",
+            f"label {addr(0x0048)} byte data_{bank_str}_jt_mid",
+            f"stridearraylabel {addr(0x0060)} 4 word 8 data_{bank_str}_stride",
+            f"binexport {addr(0x0100)} {0x800:05X} {self.data_dir}/blob_{bank_str}.bin",
+            f"label {addr(0x0300)} byte blob_{bank_str}_mid",
+            f"label {addr(0x0500)} byte blob_{bank_str}_mid2",
+            f"binexport {addr(0x0900)} {0x100:05X} {self.data_dir}/blob_{bank_str}b.bin",
+            f"banksetting 1 {bank_str} {addr(0x1000)} {addr(0x1010)}",
+            f"label {addr(0x1800)} byte data_{bank_str}_tail",
+        ]
+
+        # Bigger annotation files just name more of the leftover data.
+        extra_count = 32 * self.annot_scale
+        stride = EXTRA_LABEL_SPACE // extra_count
+        for i in range(extra_count):
+            offs = EXTRA_LABEL_BASE - DATA_BASE + i * stride
+            ltype = "word" if stride >= 2 and rand.random() < 0.5 else "byte"
+            self.annot_lines.append(
+                f"label {addr(offs)} {ltype} data_{bank_str}_extra_{i}"
+            )
+
+
+def build_synthetic_rom(
+    *, seed: int, bank_count: int = 16, annot_scale: int = 1, data_dir: str
+) -> tuple[bytes, list[str]]:
+    builder = SyntheticRomBuilder(
+        seed=seed, bank_count=bank_count, annot_scale=annot_scale, data_dir=data_dir
+    )
+    return builder.build()
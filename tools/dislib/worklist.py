@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+import array
+
+from typing import (
+    Optional,
+)
+
+from dislib.miscdefs import (
+    PhysAddress,
+    VirtAddress,
+    format_virt,
+)
+
+# Where a root came from, i.e. nowhere in the code.
+NO_SOURCE = -1
+
+
+class TracerWorklist:
+    # Code addresses still waiting for the Tracer.
+    #
+    # Each address only ever gets in once, as a bit gets set for it on the way in.
+    # That's by physical address, so the same code seen through two slots is one entry.
+    # Waiting addresses are kept per bank, and a bank is emptied before moving on,
+    # so the Tracer stays in one bank for as long as it can.
+    # The order doesn't change what comes out, as AddrTypeMap.set_addr_type doesn't care
+    # what order the types turn up in.
+    # Each address also remembers the op which pushed it, for working out how the
+    # Tracer got somewhere.
+
+    def __init__(self, *, bank_count: int, bank_size: int) -> None:
+        self._bank_count = bank_count
+        self._bank_size = bank_size
+        self._visited = bytearray((bank_count * bank_size + 7) // 8)
+        # Virtual address of the op which pushed each address, or NO_SOURCE for roots.
+        self._sources = array.array("i", [NO_SOURCE]) * (bank_count * bank_size)
+        self._pending: list[list[VirtAddress]] = [[] for _ in range(bank_count)]
+        self._pending_count = 0
+        self._bank_idx = 0
+        # What the Tracer is decoding right now, if anything.
+        self.current: Optional[VirtAddress] = None
+        self.push_count = 0
+        self.duplicate_push_count = 0
+
+    def __len__(self) -> int:
+        return self._pending_count
+
+    def _phys(self, v: VirtAddress) -> PhysAddress:
+        return PhysAddress((v >> 16) * self._bank_size + (v & 0xFFFF) % self._bank_size)
+
+    def push(self, v: VirtAddress) -> bool:
+        # Whatever's being decoded right now is where v came from.
+        # Returns False if v has already been seen, or isn't in the ROM.
+        # This happens for nearly every op, hence everything being done by hand.
+        bank_idx = v >> 16
+        if bank_idx >= self._bank_count:
+            # Don't attempt to run from RAM
+            return False
+        p = bank_idx * self._bank_size + (v & 0xFFFF) % self._bank_size
+        visited = self._visited
+        bit = 1 << (p & 7)
+        if visited[p >> 3] & bit:
+            self.duplicate_push_count += 1
+            return False
+        visited[p >> 3] |= bit
+        current = self.current
+        if current is not None:
+            self._sources[p] = current
+        self._pending[bank_idx].append(v)
+        self._pending_count += 1
+        self.push_count += 1
+        return True
+
+    def pop(self) -> VirtAddress:
+        pending = self._pending[self._bank_idx]
+        if len(pending) == 0:
+            assert self._pending_count >= 1
+            self._bank_idx = next(
+                i for i, bank_pending in enumerate(self._pending) if bank_pending
+            )
+            pending = self._pending[self._bank_idx]
+        self._pending_count -= 1
+        self.current = pending.pop()
+        return self.current
+
+    def pending(self) -> list[VirtAddress]:
+        # Everything still waiting, in no particular order.
+        return [v for bank_pending in self._pending for v in bank_pending]
+
+    def mark_visited(self, p: PhysAddress) -> None:
+        # For something that got decoded by an earlier run.
+        self._visited[p >> 3] |= 1 << (p & 7)
+
+    def forget(self, p: PhysAddress) -> None:
+        # For something that's no longer decoded, so it can be pushed again.
+        self._visited[p >> 3] &= ~(1 << (p & 7))
+        self._sources[p] = NO_SOURCE
+
+    def path_to(self, v: VirtAddress) -> list[VirtAddress]:
+        # The ops which led the Tracer to v, starting with v and ending at a root.
+        path = [v]
+        seen = {v}
+        while True:
+            p = self._phys(path[-1])
+            if not (0 <= p < len(self._sources)):
+                break
+            source = VirtAddress(self._sources[p])
+            if source == NO_SOURCE or source in seen:
+                break
+            path.append(source)
+            seen.add(source)
+        return path
+
+    def format_path_to(self, v: VirtAddress) -> str:
+        # Runs of ops which just fell through into each other get squashed.
+        parts: list[str] = []
+        run_length = 0
+        path = self.path_to(v)
+        for i, step in enumerate(path):
+            next_step = path[i + 1] if i + 1 < len(path) else None
+            if (
+                0 < i
+                and next_step is not None
+                and (next_step >> 16) == (step >> 16)
+                and 1 <= step - next_step <= 4
+                and 1 <= path[i - 1] - step <= 4
+            ):
+                run_length += 1
+                continue
+            if run_length >= 1:
+                parts.append(f"({run_length} ops)")
+                run_length = 0
+            parts.append(format_virt(step))
+        return " <- ".join(parts)
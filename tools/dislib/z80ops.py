@@ -5,6 +5,7 @@ import dataclasses
 import enum
 
 from typing import (
+    Optional,
     Sequence,
 )
 
@@ -38,6 +39,9 @@ class OA(enum.Enum):
     MemHL = enum.auto()
     MemIXdd = enum.auto()
     MemIYdd = enum.auto()
+    # DD CB dd xx / FD CB dd xx, where the displacement comes before the opcode
+    MemIXddCB = enum.auto()
+    MemIYddCB = enum.auto()
     MemByteImmWord = enum.auto()
     MemWordImmWord = enum.auto()
 
@@ -404,3 +408,196 @@ for rz, vz in enumerate(
         OP_SPECS_CB[0o100 + (ry * 8) + rz] = OS(name="BIT", args=[OA_CONST_0_7[ry], vz])
         OP_SPECS_CB[0o200 + (ry * 8) + rz] = OS(name="RES", args=[OA_CONST_0_7[ry], vz])
         OP_SPECS_CB[0o300 + (ry * 8) + rz] = OS(name="SET", args=[OA_CONST_0_7[ry], vz])
+
+
+# How many bytes each arg type takes up after the opcode
+OA_SIZES = {
+    OA.Byte: 1,
+    OA.Word: 2,
+    OA.JumpRelByte: 1,
+    OA.JumpWord: 2,
+    OA.MemIXdd: 1,
+    OA.MemIYdd: 1,
+    OA.MemByteImmWord: 2,
+    OA.MemWordImmWord: 2,
+    OA.PortByteImm: 1,
+}
+
+
+def _parse_cycle_rows(first_opcode: int, rows: Sequence[str]) -> dict[int, int]:
+    # Rows of 16 T-state counts, "-" for anything that isn't an op.
+    cycles: dict[int, int] = {}
+    for row_idx, row in enumerate(rows):
+        vals = row.split()
+        assert len(vals) == 16
+        for col_idx, val in enumerate(vals):
+            if val != "-":
+                cycles[first_opcode + row_idx * 16 + col_idx] = int(val)
+    return cycles
+
+
+# T-states for each op, prefixes included.
+# Conditional ops cost this much when the condition fails,
+# and repeating block ops cost this much on the last go around.
+CYCLES_XX = _parse_cycle_rows(
+    0x00,
+    [
+        " 4 10  7  6  4  4  7  4  4 11  7  6  4  4  7  4",  # 00
+        " 8 10  7  6  4  4  7  4 12 11  7  6  4  4  7  4",  # 10
+        " 7 10 16  6  4  4  7  4  7 11 16  6  4  4  7  4",  # 20
+        " 7 10 13  6 11 11 10  4  7 11 13  6  4  4  7  4",  # 30
+        " 4  4  4  4  4  4  7  4  4  4  4  4  4  4  7  4",  # 40
+        " 4  4  4  4  4  4  7  4  4  4  4  4  4  4  7  4",  # 50
+        " 4  4  4  4  4  4  7  4  4  4  4  4  4  4  7  4",  # 60
+        " 7  7  7  7  7  7  4  7  4  4  4  4  4  4  7  4",  # 70
+        " 4  4  4  4  4  4  7  4  4  4  4  4  4  4  7  4",  # 80
+        " 4  4  4  4  4  4  7  4  4  4  4  4  4  4  7  4",  # 90
+        " 4  4  4  4  4  4  7  4  4  4  4  4  4  4  7  4",  # A0
+        " 4  4  4  4  4  4  7  4  4  4  4  4  4  4  7  4",  # B0
+        " 5 10 10 10 10 11  7 11  5 10 10  - 10 17  7 11",  # C0
+        " 5 10 10 11 10 11  7 11  5  4 10 11 10  -  7 11",  # D0
+        " 5 10 10 19 10 11  7 11  5  4 10  4 10  -  7 11",  # E0
+        " 5 10 10  4 10 11  7 11  5  6 10  4 10  -  7 11",  # F0
+    ],
+)
+CYCLES_ED = _parse_cycle_rows(
+    0x40,
+    [
+        "12 12 15 20  8 14  8  9 12 12 15 20  8 14  8  9",  # 40
+        "12 12 15 20  8 14  8  9 12 12 15 20  8 14  8  9",  # 50
+        "12 12 15 20  8 14  8 18 12 12 15 20  8 14  8 18",  # 60
+        "12 12 15 20  8 14  8  8 12 12 15 20  8 14  8  8",  # 70
+        " -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -",  # 80
+        " -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -",  # 90
+        "16 16 16 16  -  -  -  - 16 16 16 16  -  -  -  -",  # A0
+        "16 16 16 16  -  -  -  - 16 16 16 16  -  -  -  -",  # B0
+    ],
+)
+# DD and FD cost the same.
+CYCLES_DD_XX = _parse_cycle_rows(
+    0x00,
+    [
+        " -  -  -  -  -  -  -  -  - 15  -  -  -  -  -  -",  # 00
+        " -  -  -  -  -  -  -  -  - 15  -  -  -  -  -  -",  # 10
+        " - 14 20 10  -  -  -  -  - 15 20 10  -  -  -  -",  # 20
+        " -  -  -  - 23 23 19  -  - 15  -  -  -  -  -  -",  # 30
+        " -  -  -  -  -  - 19  -  -  -  -  -  -  - 19  -",  # 40
+        " -  -  -  -  -  - 19  -  -  -  -  -  -  - 19  -",  # 50
+        " -  -  -  -  -  - 19  -  -  -  -  -  -  - 19  -",  # 60
+        "19 19 19 19 19 19  - 19  -  -  -  -  -  - 19  -",  # 70
+        " -  -  -  -  -  - 19  -  -  -  -  -  -  - 19  -",  # 80
+        " -  -  -  -  -  - 19  -  -  -  -  -  -  - 19  -",  # 90
+        " -  -  -  -  -  - 19  -  -  -  -  -  -  - 19  -",  # A0
+        " -  -  -  -  -  - 19  -  -  -  -  -  -  - 19  -",  # B0
+        " -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -",  # C0
+        " -  -  -  -  -  -  -  -  -  -  -  -  -  -  -  -",  # D0
+        " - 14  - 23  - 15  -  -  -  8  -  -  -  -  -  -",  # E0
+        " -  -  -  -  -  -  -  -  - 10  -  -  -  -  -  -",  # F0
+    ],
+)
+# CB ops cost 8, or 15 on (hl), except BIT which only reads it.
+CYCLES_CB = {
+    op: (8 if op & 0o7 != 0o6 else 12 if 0o100 <= op < 0o200 else 15)
+    for op in range(0x100)
+}
+# DD CB dd xx / FD CB dd xx always work on (ix+dd) / (iy+dd).
+CYCLES_DD_CB = {op: (20 if 0o100 <= op < 0o200 else 23) for op in range(0x100)}
+
+# What conditional ops cost when the condition holds,
+# and what repeating block ops cost when they go around again.
+CYCLES_TAKEN_XX = {
+    0x10: 13,  # djnz
+    **{op: 12 for op in [0x20, 0x28, 0x30, 0x38]},  # jr cc
+    **{op: 11 for op in range(0xC0, 0x100, 0x08)},  # ret cc
+    **{op: 17 for op in range(0xC4, 0x100, 0x08)},  # call cc
+}
+CYCLES_TAKEN_ED = {op: 21 for op in [0xB0, 0xB1, 0xB2, 0xB3, 0xB8, 0xB9, 0xBA, 0xBB]}
+
+
+# Op table Entry
+@dataclasses.dataclass(frozen=True)
+class OE:
+    spec: OS
+    # Length of the whole op, prefixes included
+    length: int
+    # (arg type, offset from the start of the op, text if the arg is a constant)
+    layout: Sequence[tuple[OA, int, str]]
+    # Lowercase, and padded if there are args
+    mnemonic: str
+    # Where this sits in OP_ENTRIES
+    idx: int
+    # T-states, see CYCLES_XX
+    cycles: int
+    # T-states if a conditional op's condition holds or a block op repeats, otherwise the same as cycles
+    cycles_taken: int
+
+
+# Every entry from every table, so an entry can be stored as a small int.
+OP_ENTRIES: list[OE] = []
+
+
+def _build_op_table(
+    specs: dict[int, OS],
+    *,
+    opcode_offs: int,
+    cycles: dict[int, int],
+    cycles_taken: Optional[dict[int, int]] = None,
+    ixy_cb_mem: Optional[OA] = None,
+) -> list[Optional[OE]]:
+    table: list[Optional[OE]] = [None] * 256
+    for opcode, spec in specs.items():
+        layout: list[tuple[OA, int, str]] = []
+        offs = opcode_offs + 1
+        for a in spec.args:
+            if a == OA.MemHL and ixy_cb_mem is not None:
+                # The displacement sits between the CB and the opcode.
+                layout.append((ixy_cb_mem, opcode_offs - 1, ""))
+            elif a == OA.MemHL:
+                layout.append((a, offs, "(hl)"))
+            else:
+                layout.append((a, offs, CONST_OAS.get(a, "")))
+            offs += OA_SIZES.get(a, 0)
+        mnemonic = spec.name + (" " * (6 - len(spec.name)) if spec.args else "")
+        entry = OE(
+            spec=spec,
+            length=offs,
+            layout=layout,
+            mnemonic=mnemonic.lower(),
+            idx=len(OP_ENTRIES),
+            cycles=cycles[opcode],
+            cycles_taken=(cycles_taken or {}).get(opcode, cycles[opcode]),
+        )
+        OP_ENTRIES.append(entry)
+        table[opcode] = entry
+    return table
+
+
+# Flat 256-entry tables, indexed by the byte after any prefixes.
+OP_TABLE_XX = _build_op_table(
+    OP_SPECS_XX, opcode_offs=0, cycles=CYCLES_XX, cycles_taken=CYCLES_TAKEN_XX
+)
+OP_TABLE_CB = _build_op_table(OP_SPECS_CB, opcode_offs=1, cycles=CYCLES_CB)
+OP_TABLE_ED = _build_op_table(
+    OP_SPECS_ED, opcode_offs=1, cycles=CYCLES_ED, cycles_taken=CYCLES_TAKEN_ED
+)
+OP_TABLE_DD_XX = _build_op_table(OP_SPECS_DD_XX, opcode_offs=1, cycles=CYCLES_DD_XX)
+OP_TABLE_FD_XX = _build_op_table(OP_SPECS_FD_XX, opcode_offs=1, cycles=CYCLES_DD_XX)
+OP_TABLE_DD_CB = _build_op_table(
+    OP_SPECS_CB, opcode_offs=3, cycles=CYCLES_DD_CB, ixy_cb_mem=OA.MemIXddCB
+)
+OP_TABLE_FD_CB = _build_op_table(
+    OP_SPECS_CB, opcode_offs=3, cycles=CYCLES_DD_CB, ixy_cb_mem=OA.MemIYddCB
+)
+
+# Prefix byte -> (table, group name for error messages)
+OP_PREFIX_TABLES = {
+    0xCB: (OP_TABLE_CB, "(CB)"),
+    0xDD: (OP_TABLE_DD_XX, "(DD)"),
+    0xED: (OP_TABLE_ED, "(ED)"),
+    0xFD: (OP_TABLE_FD_XX, "(FD)"),
+}
+# Prefix byte followed by CB -> (table, group name for error messages)
+OP_PREFIX_CB_TABLES = {
+    0xDD: (OP_TABLE_DD_CB, "(DDCB)"),
+    0xFD: (OP_TABLE_FD_CB, "(FDCB)"),
+}
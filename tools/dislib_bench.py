@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import os.path
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from typing import (
+    Any,
+    Optional,
+)
+
+from dislib.miscdefs import PhysAddress
+from dislib.rom import Rom
+from dislib.synthrom import build_synthetic_rom
+
+PHASES = ["annotate", "trace", "save"]
+
+# name -> (bank count, annotation scale)
+DEFAULT_CASES = {
+    "b16_a1": (16, 1),
+    "b16_a8": (16, 8),
+    "b64_a1": (64, 1),
+}
+
+
+def run_case(
+    *, seed: int, bank_count: int, annot_scale: int, repeat: int
+) -> dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix="dislib_bench_") as tmp_dir:
+        data_dir = os.path.join(tmp_dir, "data")
+        os.makedirs(data_dir)
+        data, annot_lines = build_synthetic_rom(
+            seed=seed,
+            bank_count=bank_count,
+            annot_scale=annot_scale,
+            data_dir=data_dir,
+        )
+        annot_fname = os.path.join(tmp_dir, "bench.cfg")
+        with open(annot_fname, "w") as outfp:
+            outfp.write("\n".join(annot_lines) + "\n")
+        whole_fname = os.path.join(tmp_dir, "whole.asm")
+
+        # Best of N for each phase, as anything slower is just noise from elsewhere.
+        best: dict[str, float] = {}
+        for _ in range(repeat):
+            if os.path.exists(whole_fname):
+                os.remove(whole_fname)
+            times = [time.perf_counter()]
+            with contextlib.redirect_stdout(io.StringIO()):
+                rom = Rom(data=data)
+                rom.load_annotations(file_name=annot_fname)
+                times.append(time.perf_counter())
+                rom.run_tracer()
+                times.append(time.perf_counter())
+                rom.save(file_name=whole_fname)
+                times.append(time.perf_counter())
+            for phase, start, end in zip(PHASES, times, times[1:]):
+                best[phase] = min(best.get(phase, end - start), end - start)
+
+    return {
+        "bank_count": bank_count,
+        "annot_scale": annot_scale,
+        "annot_lines": len(annot_lines),
+        "ops_decoded": rom.stats["tracer.ops_decoded"],
+        "lines_saved": rom.stats["saver.lines"],
+        "seconds": best,
+    }
+
+
+def run_decode(*, seed: int, bank_count: int, repeat: int) -> dict[str, Any]:
+    # Just the tracer, as decoded ops per second.
+    # This only uses what the Rom has always had, so it runs on older trees too.
+    with tempfile.TemporaryDirectory(prefix="dislib_bench_") as tmp_dir:
+        data_dir = os.path.join(tmp_dir, "data")
+        os.makedirs(data_dir)
+        data, annot_lines = build_synthetic_rom(
+            seed=seed, bank_count=bank_count, data_dir=data_dir
+        )
+        annot_fname = os.path.join(tmp_dir, "bench.cfg")
+        with open(annot_fname, "w") as outfp:
+            outfp.write("\n".join(annot_lines) + "\n")
+
+        best = None
+        ops = 0
+        for _ in range(repeat):
+            with contextlib.redirect_stdout(io.StringIO()):
+                rom = Rom(data=data)
+                rom.load_annotations(file_name=annot_fname)
+                start = time.perf_counter()
+                rom.run_tracer()
+                end = time.perf_counter()
+            ops = len(rom.op_decodes)
+            best = min(best if best is not None else end - start, end - start)
+        assert best is not None
+
+    return {
+        "bank_count": bank_count,
+        "ops": ops,
+        "seconds": best,
+        "ops_per_second": ops / best,
+    }
+
+
+def print_decode(decode: dict[str, Any], *, baseline: Optional[dict[str, Any]]) -> None:
+    print(f"decode: {decode['bank_count']} banks, {decode['ops']} ops")
+    line = f"  {decode['ops_per_second']:10.0f} ops/s"
+    if baseline is not None:
+        base_rate = baseline["ops_per_second"]
+        change = (decode["ops_per_second"] - base_rate) / base_rate * 100.0
+        line += f"  (baseline {base_rate:10.0f} ops/s, {change:+6.1f}%)"
+    print(line)
+    if baseline is not None and baseline["ops"] != decode["ops"]:
+        print(
+            f"  WARNING: baseline decoded {baseline['ops']} ops, this run decoded {decode['ops']}"
+        )
+
+
+def run_addr_micro(*, seed: int, bank_count: int, repeat: int) -> dict[str, Any]:
+    # The address conversions the tracer does for a word operand, once per decoded op.
+    # Every result is kept, so the allocations can be counted afterwards.
+    with tempfile.TemporaryDirectory(prefix="dislib_bench_") as tmp_dir:
+        data_dir = os.path.join(tmp_dir, "data")
+        os.makedirs(data_dir)
+        data, annot_lines = build_synthetic_rom(
+            seed=seed, bank_count=bank_count, data_dir=data_dir
+        )
+        annot_fname = os.path.join(tmp_dir, "bench.cfg")
+        with open(annot_fname, "w") as outfp:
+            outfp.write("\n".join(annot_lines) + "\n")
+        with contextlib.redirect_stdout(io.StringIO()):
+            rom = Rom(data=data)
+            rom.load_annotations(file_name=annot_fname)
+            rom.run_tracer()
+
+    ops = [
+        (PhysAddress(p + 1), decode.virt_addr, data[p] | (data[p + 1] << 8))
+        for p, decode in rom.op_decodes.items()
+        if p + 2 <= len(data)
+    ]
+    kept: list[Any] = [None] * (3 * len(ops))
+
+    def work() -> None:
+        i = 0
+        for arg_phys_addr, op_virt_addr, val in ops:
+            relative_to = rom.phys_to_virt(arg_phys_addr, relative_to=op_virt_addr)
+            virt_val = rom.naive_to_virt(val, relative_to=relative_to)
+            kept[i] = relative_to
+            kept[i + 1] = virt_val
+            kept[i + 2] = rom.virt_to_phys(virt_val)
+            i += 3
+
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        work()
+        end = time.perf_counter()
+        best = min(best if best is not None else end - start, end - start)
+        kept[:] = [None] * len(kept)
+    assert best is not None
+
+    tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        work()
+        after = tracemalloc.take_snapshot()
+    finally:
+        tracemalloc.stop()
+    stats = after.compare_to(before, "filename")
+    blocks = sum(stat.count_diff for stat in stats)
+    size = sum(stat.size_diff for stat in stats)
+
+    return {
+        "ops": len(ops),
+        "ns_per_op": best / len(ops) * 1e9,
+        "blocks_per_op": blocks / len(ops),
+        "bytes_per_op": size / len(ops),
+    }
+
+
+def print_addr_micro(
+    micro: dict[str, Any], *, baseline: Optional[dict[str, Any]]
+) -> None:
+    print(f"addr_micro: {micro['ops']} ops")
+    for key, unit in [("ns_per_op", "ns"), ("blocks_per_op", ""), ("bytes_per_op", "")]:
+        line = f"  {key:<14s} {micro[key]:8.2f}{unit}"
+        if baseline is not None and key in baseline:
+            line += f"  (baseline {baseline[key]:8.2f}{unit})"
+        print(line)
+
+
+def print_results(
+    results: dict[str, Any], *, baseline: Optional[dict[str, Any]]
+) -> None:
+    for name, case in results["cases"].items():
+        base_case = None
+        if baseline is not None:
+            base_case = baseline["cases"].get(name)
+        print(
+            f"{name}: {case['bank_count']} banks, {case['annot_lines']} annotation lines, {case['ops_decoded']} ops"
+        )
+        for phase in PHASES:
+            seconds = case["seconds"][phase]
+            line = f"  {phase:<10s} {seconds:8.3f}s"
+            if base_case is not None:
+                base_seconds = base_case["seconds"][phase]
+                change = (seconds - base_seconds) / base_seconds * 100.0
+                line += f"  (baseline {base_seconds:8.3f}s, {change:+6.1f}%)"
+            print(line)
+        if base_case is not None and base_case["ops_decoded"] != case["ops_decoded"]:
+            # Timings don't mean much if the work done isn't the same.
+            print(
+                f"  WARNING: baseline decoded {base_case['ops_decoded']} ops, this run decoded {case['ops_decoded']}"
+            )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Time the dislib annotate, trace and save phases on made-up ROMs."
+    )
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="runs per case, keeping the best time"
+    )
+    parser.add_argument(
+        "--banks",
+        type=int,
+        help="run just one case with this many 16 KB banks instead of the default set",
+    )
+    parser.add_argument(
+        "--annot-scale",
+        type=int,
+        default=1,
+        help="multiplier for the number of code roots and labels (1-64, used with --banks)",
+    )
+    parser.add_argument(
+        "--save",
+        metavar="JSON_FILE",
+        help="write the results here, for use as a baseline",
+    )
+    parser.add_argument(
+        "--compare", metavar="JSON_FILE", help="compare against a saved baseline"
+    )
+    parser.add_argument(
+        "--addr-micro",
+        action="store_true",
+        help="also count the allocations the virtual address helpers make per decoded op",
+    )
+    parser.add_argument(
+        "--decode",
+        action="store_true",
+        help="only time the tracer on a 16 bank ROM, as decoded ops per second, instead of the phases",
+    )
+    args = parser.parse_args()
+    seed: int = args.seed
+    repeat: int = args.repeat
+    save_fname: Optional[str] = args.save
+    compare_fname: Optional[str] = args.compare
+
+    cases = DEFAULT_CASES
+    if args.banks is not None:
+        cases = {f"b{args.banks}_a{args.annot_scale}": (args.banks, args.annot_scale)}
+
+    baseline: Optional[dict[str, Any]] = None
+    if compare_fname is not None:
+        with open(compare_fname, "r") as infp:
+            baseline = json.load(infp)
+        assert baseline is not None
+        if baseline["seed"] != seed:
+            print(f"WARNING: baseline used seed {baseline['seed']}, not {seed}")
+
+    results: dict[str, Any] = {
+        "python": sys.version.split()[0],
+        "seed": seed,
+        "repeat": repeat,
+        "cases": {},
+    }
+    if args.decode:
+        results["decode"] = run_decode(seed=seed, bank_count=16, repeat=repeat)
+        print_decode(
+            results["decode"],
+            baseline=None if baseline is None else baseline.get("decode"),
+        )
+    else:
+        for name, (bank_count, annot_scale) in cases.items():
+            results["cases"][name] = run_case(
+                seed=seed, bank_count=bank_count, annot_scale=annot_scale, repeat=repeat
+            )
+        print_results(results, baseline=baseline)
+
+    if args.addr_micro:
+        results["addr_micro"] = run_addr_micro(seed=seed, bank_count=16, repeat=repeat)
+        print_addr_micro(
+            results["addr_micro"],
+            baseline=None if baseline is None else baseline.get("addr_micro"),
+        )
+
+    if save_fname is not None:
+        with open(save_fname, "w") as outfp:
+            json.dump(results, outfp, indent=2)
+            outfp.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,191 @@
+from __future__ import annotations
+
+import struct
+
+from typing import (
+    NamedTuple,
+    Optional,
+)
+
+# Level header pointers, relative to this
+LEVEL_HEADERS_PTR = 0x15580
+LEVEL_COUNT = 0x25
+LEVEL_HEADER_SIZE = 37
+LEVEL_HEADER_FORMAT = "<B HH HHHH BB HH H HBH BBBB H BBBB B"
+
+# Where each header's offsets are relative to
+LAYOUT_BASE = 0x14000
+TILEMAP_BASE = 0x10000
+ART0_BASE = 0x30000
+
+# Bank 01 pointers to the 32-byte base palettes, indexed by the header
+LUT_BASE_PAL3S = 0x627C
+LUT_BASE_PAL3S_BANK = 0x01
+
+# The unpacked layout always fills this much RAM, whatever the level's width.
+LAYOUT_SIZE = 0x1000
+METATILE_COUNT = 0x100
+# 4x4 tiles, one byte each, the name table high byte being just the priority bit
+METATILE_SIZE = 16
+PALETTE_SIZE = 0x20
+
+
+class LevelHeader(NamedTuple):
+    tile_flags_idx: int
+    # In metatiles
+    width: int
+    height: int
+    # Camera limits, in pixels
+    x0: int
+    x1: int
+    y0: int
+    y1: int
+    start_x: int
+    start_y: int
+    layout_offs: int
+    layout_size: int
+    tilemap_offs: int
+    art0_offs: int
+    art1_bank: int
+    art1_offs: int
+    palette_idx: int
+    objects_offs: int
+
+
+class LevelData(NamedTuple):
+    # Everything that decides what the level map looks like
+    width: int
+    height: int
+    layout: bytes
+    tilemap: bytes
+    palette: bytes
+    art0: bytes
+
+
+def read_level_headers(rom: bytes) -> list[Optional[LevelHeader]]:
+    # One for each level index, None where the pointer is 0.
+    headers: list[Optional[LevelHeader]] = []
+    for level_idx in range(LEVEL_COUNT):
+        ptr = LEVEL_HEADERS_PTR + level_idx * 2
+        (header_offs,) = struct.unpack("<H", rom[ptr : ptr + 2])
+        if header_offs == 0:
+            headers.append(None)
+            continue
+        start = LEVEL_HEADERS_PTR + header_offs
+        fields = struct.unpack(
+            LEVEL_HEADER_FORMAT, rom[start : start + LEVEL_HEADER_SIZE]
+        )
+        (
+            tile_flags_idx,
+            width,
+            height,
+            x0,
+            x1,
+            y0,
+            y1,
+            start_x,
+            start_y,
+            layout_offs,
+            layout_size,
+            tilemap_offs,
+            art0_offs,
+            art1_bank,
+            art1_offs,
+            palette_idx,
+        ) = fields[:16]
+        objects_offs = fields[19]
+        headers.append(
+            LevelHeader(
+                tile_flags_idx=tile_flags_idx,
+                width=width,
+                height=height,
+                x0=x0,
+                x1=x1,
+                y0=y0,
+                y1=y1,
+                start_x=start_x,
+                start_y=start_y,
+                layout_offs=layout_offs,
+                layout_size=layout_size,
+                tilemap_offs=tilemap_offs,
+                art0_offs=art0_offs,
+                art1_bank=art1_bank,
+                art1_offs=art1_offs,
+                palette_idx=palette_idx,
+                objects_offs=objects_offs,
+            )
+        )
+    return headers
+
+
+def unpack_layout(data: bytes) -> bytes:
+    # A byte repeated is followed by how many more of it there are, 0 meaning $100.
+    # Like the game, it stops at the end of the layout RAM.
+    layout = bytearray()
+    prev = -1
+    offs = 0
+    while offs < len(data) and len(layout) < LAYOUT_SIZE:
+        v = data[offs]
+        offs += 1
+        if v != prev:
+            layout.append(v)
+            prev = v
+        else:
+            count = data[offs] if offs < len(data) else 0
+            offs += 1
+            layout += bytes([v]) * (count or 0x100)
+            prev = -1
+    return bytes(layout[:LAYOUT_SIZE].ljust(LAYOUT_SIZE, b"\x00"))
+
+
+def unpack_art(rom: bytes, start: int) -> bytes:
+    # "HY" art: a bit per row saying whether it's a new row or a repeat of an earlier one,
+    # with repeats pointing back by a byte, or two if the first is $F0 or more.
+    magic, offsets_ptr, rows_ptr, row_count = struct.unpack(
+        "<HHHH", rom[start : start + 8]
+    )
+    assert magic == 0x5948, f"no HY signature on the art at ${start:05X}"
+    bitmask = rom[start + 8 : start + offsets_ptr]
+    offsets_offs = start + offsets_ptr
+    rows_offs = start + rows_ptr
+    out = bytearray()
+    new_rows = 0
+    for row_idx in range(row_count):
+        if bitmask[row_idx >> 3] & (1 << (row_idx & 7)) == 0:
+            use_row = new_rows
+            new_rows += 1
+        else:
+            use_row = rom[offsets_offs]
+            offsets_offs += 1
+            if use_row >= 0xF0:
+                use_row = ((use_row - 0xF0) << 8) + rom[offsets_offs]
+                offsets_offs += 1
+        out += rom[rows_offs + use_row * 4 : rows_offs + use_row * 4 + 4]
+    return bytes(out)
+
+
+def read_level_data(rom: bytes, header: LevelHeader) -> LevelData:
+    layout_start = LAYOUT_BASE + header.layout_offs
+    layout = unpack_layout(rom[layout_start : layout_start + header.layout_size])
+
+    # The game takes all 256 metatiles from wherever the tilemap starts.
+    tilemap_start = TILEMAP_BASE + header.tilemap_offs
+    tilemap = rom[tilemap_start : tilemap_start + METATILE_COUNT * METATILE_SIZE]
+    tilemap = tilemap.ljust(METATILE_COUNT * METATILE_SIZE, b"\x00")
+
+    ptr = LUT_BASE_PAL3S + header.palette_idx * 2
+    (palette_ptr,) = struct.unpack("<H", rom[ptr : ptr + 2])
+    palette_start = LUT_BASE_PAL3S_BANK * 0x4000 + (palette_ptr & 0x3FFF)
+    palette = rom[palette_start : palette_start + PALETTE_SIZE]
+
+    # Rows past the end of the layout RAM don't exist
+    width = max(header.width, 1)
+    height = min(header.height, LAYOUT_SIZE // width) or LAYOUT_SIZE // width
+    return LevelData(
+        width=width,
+        height=height,
+        layout=layout,
+        tilemap=tilemap,
+        palette=palette,
+        art0=unpack_art(rom, ART0_BASE + header.art0_offs),
+    )
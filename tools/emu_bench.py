@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+import time
+
+from typing import (
+    Any,
+    Optional,
+)
+
+from emulib.benchrom import build_bench_rom
+from emulib.machine import (
+    CYCLES_PER_FRAME,
+    SmsMachine,
+)
+
+# NTSC
+FRAMES_PER_SECOND = 60
+
+
+def run_bench(*, rom: bytes, frames: int, repeat: int) -> dict[str, Any]:
+    # Best of N, as anything slower is just noise from elsewhere.
+    best: Optional[float] = None
+    for _ in range(repeat):
+        machine = SmsMachine(rom=rom)
+        start = time.perf_counter()
+        for _ in range(frames):
+            machine.run_frame()
+        end = time.perf_counter()
+        best = min(best if best is not None else end - start, end - start)
+    assert best is not None
+
+    cpu = machine.cpu
+    return {
+        "frames": frames,
+        "ops": cpu.op_count,
+        "busy_cycles": cpu.cycles - cpu.idle_cycles,
+        "seconds": best,
+        "ops_per_second": cpu.op_count / best,
+        "realtime": frames / FRAMES_PER_SECOND / best,
+    }
+
+
+def print_results(
+    result: dict[str, Any], *, baseline: Optional[dict[str, Any]]
+) -> None:
+    busy_pct = 100.0 * result["busy_cycles"] / (result["frames"] * CYCLES_PER_FRAME)
+    print(
+        f"{result['frames']} frames, {result['ops']} ops, {result['busy_cycles']} T-states not halted ({busy_pct:.1f}%)"
+    )
+    for key, fmt, unit in [
+        ("seconds", "8.3f", "s"),
+        ("ops_per_second", "8.0f", ""),
+        ("realtime", "8.3f", "x"),
+    ]:
+        line = f"  {key:<15s} {result[key]:{fmt}}{unit}"
+        if baseline is not None:
+            change = (result[key] - baseline[key]) / baseline[key] * 100.0
+            line += f"  (baseline {baseline[key]:{fmt}}{unit}, {change:+6.1f}%)"
+        print(line)
+    if baseline is not None and baseline["ops"] != result["ops"]:
+        # Timings don't mean much if the work done isn't the same.
+        print(
+            f"  WARNING: baseline ran {baseline['ops']} ops, this run ran {result['ops']}"
+        )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Time the emulator, in emulated Z80 ops per second."
+    )
+    parser.add_argument(
+        "--rom",
+        metavar="FILE",
+        help="run this ROM from reset instead of the built-in test program (e.g. out/s1.sms, which goes into demo mode by itself)",
+    )
+    parser.add_argument(
+        "--frames",
+        type=int,
+        default=600,
+        help="frames to run each time (default: 600, 10 seconds of game time)",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="runs to do, keeping the best time"
+    )
+    parser.add_argument(
+        "--save",
+        metavar="JSON_FILE",
+        help="write the results here, for use as a baseline",
+    )
+    parser.add_argument(
+        "--compare", metavar="JSON_FILE", help="compare against a saved baseline"
+    )
+    args = parser.parse_args()
+    rom_fname: Optional[str] = args.rom
+    frames: int = args.frames
+    repeat: int = args.repeat
+    save_fname: Optional[str] = args.save
+    compare_fname: Optional[str] = args.compare
+
+    if rom_fname is not None:
+        with open(rom_fname, "rb") as infp:
+            rom = infp.read()
+    else:
+        rom = build_bench_rom()
+
+    baseline: Optional[dict[str, Any]] = None
+    if compare_fname is not None:
+        with open(compare_fname, "r") as infp:
+            baseline = json.load(infp)
+        assert baseline is not None
+        if baseline["rom"] != rom_fname:
+            print(f"WARNING: baseline ran {baseline['rom'] or 'the test program'}")
+
+    result = run_bench(rom=rom, frames=frames, repeat=repeat)
+    print_results(result, baseline=baseline)
+
+    if save_fname is not None:
+        with open(save_fname, "w") as outfp:
+            json.dump(
+                {"python": sys.version.split()[0], "rom": rom_fname, **result},
+                outfp,
+                indent=2,
+            )
+            outfp.write("\n")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import struct
+
+from emulib.memory import BANK_SIZE
+
+U16 = struct.Struct("<H")
+
+
+class _Assembler:
+    # Just enough to lay out the benchmark program without counting bytes by hand.
+
+    def __init__(self, size: int) -> None:
+        self.data = bytearray(size)
+        self.pc = 0
+        self.labels: dict[str, int] = {}
+        # (where, label, is relative)
+        self.fixups: list[tuple[int, str, bool]] = []
+
+    def org(self, addr: int) -> None:
+        self.pc = addr
+
+    def label(self, name: str) -> None:
+        self.labels[name] = self.pc
+
+    def emit(self, *vals: int) -> None:
+        for val in vals:
+            self.data[self.pc] = val
+            self.pc += 1
+
+    def emit_word_ref(self, opcode: int, name: str) -> None:
+        # jp/call/ld with a 16-bit address
+        self.emit(opcode)
+        self.fixups.append((self.pc, name, False))
+        self.emit(0, 0)
+
+    def emit_rel_ref(self, opcode: int, name: str) -> None:
+        # jr/djnz
+        self.emit(opcode)
+        self.fixups.append((self.pc, name, True))
+        self.emit(0)
+
+    def finish(self) -> bytes:
+        for where, name, relative in self.fixups:
+            target = self.labels[name]
+            if relative:
+                offs = target - (where + 1)
+                assert -0x80 <= offs <= 0x7F
+                self.data[where] = offs & 0xFF
+            else:
+                U16.pack_into(self.data, where, target)
+        return bytes(self.data)
+
+
+def build_bench_rom() -> bytes:
+    # A made-up program for timing the emulator without the real ROM.
+    # The main loop never halts, and mixes the sort of things a game does every frame:
+    # filling and copying RAM, adding things up, and updating objects through ix.
+    # The frame interrupt counts frames at $C000.
+    asm = _Assembler(2 * BANK_SIZE)
+
+    asm.emit(0xF3)  # di
+    asm.emit(0xED, 0x56)  # im 1
+    asm.emit(0x31, 0xF0, 0xDF)  # ld sp, $DFF0
+    asm.emit_word_ref(0xC3, "main")  # jp main
+
+    asm.org(0x0038)
+    asm.emit(0xF5)  # push af
+    asm.emit(0xE5)  # push hl
+    asm.emit(0xDB, 0xBF)  # in a, ($BF)
+    asm.emit(0x2A, 0x00, 0xC0)  # ld hl, ($C000)
+    asm.emit(0x23)  # inc hl
+    asm.emit(0x22, 0x00, 0xC0)  # ld ($C000), hl
+    asm.emit(0xE1)  # pop hl
+    asm.emit(0xF1)  # pop af
+    asm.emit(0xFB)  # ei
+    asm.emit(0xC9)  # ret
+
+    asm.org(0x0100)
+    asm.label("main")
+    asm.emit(0x3E, 0x60, 0xD3, 0xBF)  # ld a, $60 / out ($BF), a
+    asm.emit(0x3E, 0x81, 0xD3, 0xBF)  # ld a, $81 / out ($BF), a
+    asm.emit(0xFB)  # ei
+
+    asm.label("loop")
+    # Fill $C100-$C1FF
+    asm.emit(0x21, 0x00, 0xC1)  # ld hl, $C100
+    asm.emit(0x06, 0x00)  # ld b, 0
+    asm.label("fill")
+    asm.emit(0x75)  # ld (hl), l
+    asm.emit(0x23)  # inc hl
+    asm.emit_rel_ref(0x10, "fill")  # djnz fill
+
+    # Copy it to $C200
+    asm.emit(0x21, 0x00, 0xC1)  # ld hl, $C100
+    asm.emit(0x11, 0x00, 0xC2)  # ld de, $C200
+    asm.emit(0x01, 0x00, 0x01)  # ld bc, $0100
+    asm.emit(0xED, 0xB0)  # ldir
+
+    # Add it up into de
+    asm.emit(0x21, 0x00, 0xC2)  # ld hl, $C200
+    asm.emit(0x11, 0x00, 0x00)  # ld de, 0
+    asm.emit(0x06, 0x00)  # ld b, 0
+    asm.label("sum")
+    asm.emit(0x7E)  # ld a, (hl)
+    asm.emit(0x83)  # add a, e
+    asm.emit(0x5F)  # ld e, a
+    asm.emit(0x7A)  # ld a, d
+    asm.emit(0xCE, 0x00)  # adc a, 0
+    asm.emit(0x57)  # ld d, a
+    asm.emit(0x23)  # inc hl
+    asm.emit_rel_ref(0x10, "sum")  # djnz sum
+
+    # 32 objects of 8 bytes at $C300
+    asm.emit(0xDD, 0x21, 0x00, 0xC3)  # ld ix, $C300
+    asm.emit(0x06, 0x20)  # ld b, 32
+    asm.label("object")
+    asm.emit(0xDD, 0x7E, 0x00)  # ld a, (ix+0)
+    asm.emit(0xDD, 0x86, 0x01)  # add a, (ix+1)
+    asm.emit(0xDD, 0x77, 0x00)  # ld (ix+0), a
+    asm.emit(0xDD, 0xCB, 0x02, 0x46)  # bit 0, (ix+2)
+    asm.emit_rel_ref(0x28, "object_skip")  # jr z, object_skip
+    asm.emit(0xDD, 0x34, 0x03)  # inc (ix+3)
+    asm.label("object_skip")
+    asm.emit(0x11, 0x08, 0x00)  # ld de, 8
+    asm.emit(0xDD, 0x19)  # add ix, de
+    asm.emit_word_ref(0xCD, "shuffle")  # call shuffle
+    asm.emit_rel_ref(0x10, "object")  # djnz object
+    asm.emit_word_ref(0xC3, "loop")  # jp loop
+
+    asm.label("shuffle")
+    asm.emit(0xC5)  # push bc
+    asm.emit(0x06, 0x04)  # ld b, 4
+    asm.label("shuffle_loop")
+    asm.emit(0xCB, 0x01)  # rlc c
+    asm.emit(0xCB, 0x3A)  # srl d
+    asm.emit(0x79)  # ld a, c
+    asm.emit(0xE6, 0x0F)  # and $0F
+    asm.emit(0xFE, 0x08)  # cp 8
+    asm.emit_rel_ref(0x30, "shuffle_next")  # jr nc, shuffle_next
+    asm.emit(0x0C)  # inc c
+    asm.label("shuffle_next")
+    asm.emit_rel_ref(0x10, "shuffle_loop")  # djnz shuffle_loop
+    asm.emit(0xC1)  # pop bc
+    asm.emit(0xC9)  # ret
+
+    return asm.finish()
@@ -0,0 +1,152 @@
+from __future__ import annotations
+
+import glob
+import hashlib
+import os
+import os.path
+import pickle
+import zlib
+
+from typing import (
+    Any,
+    Optional,
+)
+
+from emulib.inputscript import InputScript
+from emulib.machine import SmsMachine
+
+# Bump this if the layout of a checkpoint changes in a way the code hash won't catch.
+CHECKPOINT_FORMAT_VERSION = 1
+
+# Plain values, copied across as they are
+CPU_ATTRS = ["iff1", "iff2", "im", "halted", "cycles", "idle_cycles", "op_count"]
+VDP_ATTRS = [
+    "addr",
+    "code",
+    "latch",
+    "read_buffer",
+    "status",
+    "line",
+    "line_counter",
+    "line_irq",
+]
+MACHINE_ATTRS = ["port_dc", "port_dd", "frame_count", "_line_overrun"]
+
+
+def emulib_code_hash() -> str:
+    # A checkpoint from an older emulator might not be where this one would have got to.
+    h = hashlib.sha256()
+    for fname in sorted(glob.glob(os.path.join(os.path.dirname(__file__), "*.py"))):
+        h.update(os.path.basename(fname).encode("utf-8") + b"\x00")
+        with open(fname, "rb") as infp:
+            h.update(infp.read())
+    return h.hexdigest()
+
+
+def checkpoint_key(*, rom: bytes) -> str:
+    h = hashlib.sha256()
+    h.update(f"v{CHECKPOINT_FORMAT_VERSION}\x00".encode("utf-8"))
+    h.update(hashlib.sha256(rom).hexdigest().encode("utf-8"))
+    h.update(emulib_code_hash().encode("utf-8"))
+    return h.hexdigest()
+
+
+def save_machine_state(machine: SmsMachine) -> dict[str, Any]:
+    cpu = machine.cpu
+    memory = machine.memory
+    vdp = machine.vdp
+    return {
+        "cpu_regs": list(cpu.regs),
+        "cpu": {attr: getattr(cpu, attr) for attr in CPU_ATTRS},
+        "ram": bytes(memory.ram),
+        "slot_banks": list(memory.slot_banks),
+        "ram_control": memory.ram_control,
+        "vram": bytes(vdp.vram),
+        "cram": bytes(vdp.cram),
+        "vdp_regs": bytes(vdp.regs),
+        "vdp": {attr: getattr(vdp, attr) for attr in VDP_ATTRS},
+        "machine": {attr: getattr(machine, attr) for attr in MACHINE_ATTRS},
+    }
+
+
+def restore_machine_state(machine: SmsMachine, state: dict[str, Any]) -> None:
+    # Everything gets changed in place, as the CPU hangs on to its registers and the pages.
+    cpu = machine.cpu
+    memory = machine.memory
+    vdp = machine.vdp
+    cpu.regs[:] = state["cpu_regs"]
+    for attr, val in state["cpu"].items():
+        setattr(cpu, attr, val)
+    memory.ram[:] = state["ram"]
+    for slot_idx, bank_idx in enumerate(state["slot_banks"]):
+        memory.map_slot(slot_idx, bank_idx)
+    memory.ram_control = state["ram_control"]
+    vdp.vram[:] = state["vram"]
+    vdp.cram[:] = state["cram"]
+    vdp.regs[:] = state["vdp_regs"]
+    for attr, val in state["vdp"].items():
+        setattr(vdp, attr, val)
+    for attr, val in state["machine"].items():
+        setattr(machine, attr, val)
+
+
+class CheckpointFile:
+    # Machine states from one ROM, at the start of every so many frames of a run.
+    # Each one is compressed by itself, so only the one being resumed from gets unpacked.
+    # A checkpoint is only any good for the same inputs up to its frame,
+    # so each one keeps the input script up to there to check against.
+
+    def __init__(self, *, key: str) -> None:
+        self.key = key
+        # frame -> (input script text before that frame, compressed state)
+        self.checkpoints: dict[int, tuple[str, bytes]] = {}
+
+    def add(self, machine: SmsMachine, *, script: InputScript) -> None:
+        blob = zlib.compress(
+            pickle.dumps(save_machine_state(machine), protocol=pickle.HIGHEST_PROTOCOL)
+        )
+        frame = machine.frame_count
+        self.checkpoints[frame] = (script.before(frame).format(), blob)
+
+    def nearest(self, frame: int, *, script: InputScript) -> Optional[int]:
+        # The latest checkpoint at or before frame which had the same inputs getting there.
+        usable = [
+            checkpoint_frame
+            for checkpoint_frame, (inputs, _) in self.checkpoints.items()
+            if checkpoint_frame <= frame
+            and script.before(checkpoint_frame).format() == inputs
+        ]
+        return max(usable, default=None)
+
+    def restore(self, machine: SmsMachine, frame: int) -> None:
+        _, blob = self.checkpoints[frame]
+        restore_machine_state(machine, pickle.loads(zlib.decompress(blob)))
+
+    def save(self, *, file_name: str) -> None:
+        blob = pickle.dumps(
+            (self.key, self.checkpoints), protocol=pickle.HIGHEST_PROTOCOL
+        )
+        tmp_file_name = file_name + ".tmp"
+        with open(tmp_file_name, "wb") as outfp:
+            outfp.write(blob)
+        os.replace(tmp_file_name, file_name)
+
+
+def load_checkpoint_file(*, file_name: str, key: str) -> CheckpointFile:
+    # Starts afresh if there's no file, or it's for another ROM or emulator.
+    checkpoint_file = CheckpointFile(key=key)
+    try:
+        with open(file_name, "rb") as infp:
+            blob = infp.read()
+    except FileNotFoundError:
+        return checkpoint_file
+
+    try:
+        cached_key, checkpoints = pickle.loads(blob)
+    except Exception as e:
+        print(f"WARNING: Ignoring unreadable checkpoint file {file_name!r}: {e}")
+        return checkpoint_file
+
+    if cached_key == key:
+        checkpoint_file.checkpoints = checkpoints
+    return checkpoint_file
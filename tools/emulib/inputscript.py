@@ -0,0 +1,98 @@
+from __future__ import annotations
+
+import bisect
+
+from emulib.machine import (
+    JOY_BUTTON_1,
+    JOY_BUTTON_2,
+    JOY_DOWN,
+    JOY_LEFT,
+    JOY_RIGHT,
+    JOY_UP,
+)
+
+# One letter per button, in the order they get written back out
+BUTTON_LETTERS = {
+    "U": JOY_UP,
+    "D": JOY_DOWN,
+    "L": JOY_LEFT,
+    "R": JOY_RIGHT,
+    "1": JOY_BUTTON_1,
+    "2": JOY_BUTTON_2,
+}
+
+
+class InputScriptError(Exception):
+    pass
+
+
+class InputScript:
+    # What's held on joypad 1 for each frame of a run, counting from reset.
+    #
+    # Each line of the file is a frame number and what's held from then on,
+    # as letters from U D L R 1 2, or "-" for nothing:
+    #
+    #    # Start a game from the title screen
+    #    300 1
+    #    310 -
+    #    # Then run right and jump
+    #    600 R
+    #    640 R1
+    #    650 R
+    #
+    # Nothing's held before the first line. Frame numbers have to go up.
+
+    def __init__(self, *, changes: list[tuple[int, int]]) -> None:
+        self.frames = [frame for frame, _ in changes]
+        self.helds = [held for _, held in changes]
+
+    def held_at(self, frame: int) -> int:
+        idx = bisect.bisect_right(self.frames, frame) - 1
+        return self.helds[idx] if idx >= 0 else 0
+
+    def before(self, frame: int) -> InputScript:
+        # Just the changes a run up to this frame would have seen
+        idx = bisect.bisect_left(self.frames, frame)
+        return InputScript(changes=list(zip(self.frames[:idx], self.helds[:idx])))
+
+    def format(self) -> str:
+        lines = []
+        for frame, held in zip(self.frames, self.helds):
+            letters = "".join(
+                letter for letter, bit in BUTTON_LETTERS.items() if held & bit
+            )
+            lines.append(f"{frame} {letters or '-'}\n")
+        return "".join(lines)
+
+
+def parse_input_script(text: str, *, file_name: str) -> InputScript:
+    changes: list[tuple[int, int]] = []
+    for line_num, line in enumerate(text.splitlines(), start=1):
+        line = line.split("#", 1)[0].strip()
+        if line == "":
+            continue
+        parts = line.split()
+        if len(parts) != 2 or not parts[0].isdigit():
+            raise InputScriptError(
+                f"{file_name}:{line_num}: expected a frame number and buttons, got {line!r}"
+            )
+        frame = int(parts[0])
+        if changes and frame <= changes[-1][0]:
+            raise InputScriptError(
+                f"{file_name}:{line_num}: frame {frame} isn't after frame {changes[-1][0]}"
+            )
+        held = 0
+        if parts[1] != "-":
+            for letter in parts[1].upper():
+                if letter not in BUTTON_LETTERS:
+                    raise InputScriptError(
+                        f"{file_name}:{line_num}: unknown button {letter!r}, expected some of {''.join(BUTTON_LETTERS)}"
+                    )
+                held |= BUTTON_LETTERS[letter]
+        changes.append((frame, held))
+    return InputScript(changes=changes)
+
+
+def read_input_script(file_name: str) -> InputScript:
+    with open(file_name, "r") as infp:
+        return parse_input_script(infp.read(), file_name=file_name)
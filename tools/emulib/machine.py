@@ -0,0 +1,93 @@
+from __future__ import annotations
+
+from emulib.memory import SmsMemory
+from emulib.vdp import (
+    LINES_PER_FRAME,
+    SmsVdp,
+)
+from emulib.z80cpu import Z80Cpu
+
+# NTSC
+CYCLES_PER_LINE = 228
+CYCLES_PER_FRAME = CYCLES_PER_LINE * LINES_PER_FRAME
+
+# Joypad bits, which read as 0 while held
+JOY_UP = 0x01
+JOY_DOWN = 0x02
+JOY_LEFT = 0x04
+JOY_RIGHT = 0x08
+JOY_BUTTON_1 = 0x10
+JOY_BUTTON_2 = 0x20
+
+
+class SmsMachine:
+    # A headless SMS: CPU, memory, VDP ports and the joypads.
+    # The PSG and the memory/IO control ports take writes and do nothing with them.
+    # Everything runs a scanline at a time, which is as fine-grained as the interrupts get.
+
+    def __init__(self, *, rom: bytes) -> None:
+        self.memory = SmsMemory(rom=rom)
+        self.vdp = SmsVdp()
+        self.cpu = Z80Cpu(
+            read_pages=self.memory.read_pages,
+            write=self.memory.write,
+            port_in=self.port_in,
+            port_out=self.port_out,
+        )
+        # What ports $DC and $DD read as, i.e. nothing held
+        self.port_dc = 0xFF
+        self.port_dd = 0xFF
+        self.frame_count = 0
+        # Left over from the last line, as ops don't stop on the line boundary
+        self._line_overrun = 0
+
+    def reset(self) -> None:
+        self.memory.reset()
+        self.vdp.reset()
+        self.cpu.reset()
+        self.frame_count = 0
+        self._line_overrun = 0
+
+    def set_joypad_1(self, held: int) -> None:
+        # held is JOY_* bits set for whatever's held down
+        self.port_dc = (self.port_dc & 0xC0) | (~held & 0x3F)
+
+    def port_in(self, port: int) -> int:
+        # Only A7, A6 and A0 matter.
+        port &= 0xC1
+        if port == 0x40:
+            return self.vdp.read_v_counter()
+        elif port == 0x41:
+            # H counter, nothing sensible to give here
+            return 0
+        elif port == 0x80:
+            return self.vdp.read_data()
+        elif port == 0x81:
+            return self.vdp.read_status()
+        elif port == 0xC0:
+            return self.port_dc
+        elif port == 0xC1:
+            return self.port_dd
+        else:
+            return 0xFF
+
+    def port_out(self, port: int, val: int) -> None:
+        port &= 0xC1
+        if port == 0x80:
+            self.vdp.write_data(val)
+        elif port == 0x81:
+            self.vdp.write_control(val)
+
+    def run_frame(self) -> int:
+        # Returns the T-states the CPU spent doing something, rather than halted.
+        cpu = self.cpu
+        vdp = self.vdp
+        busy_start = cpu.cycles - cpu.idle_cycles
+        for line in range(LINES_PER_FRAME):
+            vdp.start_line(line)
+            budget = CYCLES_PER_LINE - self._line_overrun
+            if cpu.iff1 and vdp.irq_pending:
+                budget -= cpu.interrupt()
+            self._line_overrun = cpu.run(budget) - budget if budget > 0 else -budget
+        self.frame_count += 1
+        return cpu.cycles - cpu.idle_cycles - busy_start
@@ -0,0 +1,94 @@
+from __future__ import annotations
+
+# The CPU sees memory as 64 pages of 1 KB, so slot 0 can keep its first 1 KB fixed.
+PAGE_SHIFT = 10
+PAGE_MASK = 0x3FF
+PAGE_SIZE = 1 << PAGE_SHIFT
+PAGE_COUNT = 0x10000 >> PAGE_SHIFT
+
+BANK_SIZE = 0x4000
+RAM_SIZE = 0x2000
+PAGES_PER_BANK = BANK_SIZE >> PAGE_SHIFT
+
+# Sega mapper registers, mirrored into RAM
+MAPPER_RAM_CONTROL = 0xFFFC
+MAPPER_SLOT_0 = 0xFFFD
+MAPPER_SLOT_1 = 0xFFFE
+MAPPER_SLOT_2 = 0xFFFF
+
+
+class SmsMemory:
+    # The SMS memory map, with the Sega mapper.
+    #
+    # $0000-$BFFF is three 16 KB ROM slots, paged through $FFFD-$FFFF,
+    # except $0000-$03FF which is always the start of bank 0.
+    # $C000-$DFFF is RAM, and $E000-$FFFF is the same RAM again.
+    # Cartridge RAM ($FFFC bit 3) isn't supported.
+    #
+    # read_pages and write_pages get changed in place when paging,
+    # so the CPU can hang on to them.
+
+    def __init__(self, *, rom: bytes) -> None:
+        assert len(rom) % BANK_SIZE == 0
+        self.rom = memoryview(rom)
+        self.bank_count = len(rom) // BANK_SIZE
+        self.ram = bytearray(RAM_SIZE)
+        # Writes to ROM go here and get forgotten.
+        self._rom_write_page = memoryview(bytearray(PAGE_SIZE))
+        ram = memoryview(self.ram)
+        ram_pages = [
+            ram[i * PAGE_SIZE : (i + 1) * PAGE_SIZE]
+            for i in range(RAM_SIZE // PAGE_SIZE)
+        ]
+
+        # One extra page past the end which is page 0 again,
+        # so an op at $FFFF can read its args without wrapping.
+        self.read_pages: list[memoryview] = [self._rom_write_page] * (PAGE_COUNT + 1)
+        self.write_pages: list[memoryview] = [self._rom_write_page] * PAGE_COUNT
+        for i in range(0xC000 >> PAGE_SHIFT, PAGE_COUNT):
+            page = ram_pages[i % len(ram_pages)]
+            self.read_pages[i] = page
+            self.write_pages[i] = page
+
+        # Where each page comes from, as a ROM address, or past the end of the ROM for RAM.
+        # This is what the profiler counts things against.
+        self.page_phys = [0] * (PAGE_COUNT + 1)
+        for i in range(0xC000 >> PAGE_SHIFT, PAGE_COUNT):
+            self.page_phys[i] = len(rom) + (i % len(ram_pages)) * PAGE_SIZE
+
+        self.slot_banks = [0, 0, 0]
+        self.ram_control = 0
+        self.reset()
+
+    def reset(self) -> None:
+        self.ram[:] = bytes(RAM_SIZE)
+        self.ram_control = 0
+        for slot_idx in range(3):
+            self.map_slot(slot_idx, slot_idx)
+
+    def map_slot(self, slot_idx: int, bank_idx: int) -> None:
+        bank_idx %= self.bank_count
+        self.slot_banks[slot_idx] = bank_idx
+        bank_addr = bank_idx * BANK_SIZE
+        first_page = slot_idx * PAGES_PER_BANK
+        for i in range(PAGES_PER_BANK):
+            if slot_idx == 0 and i == 0:
+                # Always bank 0, so the interrupt handlers stay put
+                page_addr = 0
+            else:
+                page_addr = bank_addr + i * PAGE_SIZE
+            self.read_pages[first_page + i] = self.rom[page_addr:][:PAGE_SIZE]
+            self.page_phys[first_page + i] = page_addr
+        self.read_pages[PAGE_COUNT] = self.read_pages[0]
+        self.page_phys[PAGE_COUNT] = self.page_phys[0]
+
+    def read(self, addr: int) -> int:
+        return self.read_pages[addr >> PAGE_SHIFT][addr & PAGE_MASK]
+
+    def write(self, addr: int, val: int) -> None:
+        self.write_pages[addr >> PAGE_SHIFT][addr & PAGE_MASK] = val
+        if addr >= MAPPER_RAM_CONTROL:
+            if addr == MAPPER_RAM_CONTROL:
+                self.ram_control = val
+            else:
+                self.map_slot(addr - MAPPER_SLOT_0, val)
@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import struct
+import zlib
+
+import numpy as np
+import numpy.typing as npt
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# 8 bits per channel, truecolour
+PNG_BIT_DEPTH = 8
+PNG_COLOUR_RGB = 2
+
+
+def _chunk(kind: bytes, data: bytes) -> bytes:
+    return (
+        struct.pack(">I", len(data))
+        + kind
+        + data
+        + struct.pack(">I", zlib.crc32(kind + data))
+    )
+
+
+def encode_png(rgb: npt.NDArray[np.uint8], *, level: int = 6) -> bytes:
+    # An RGB image shaped (y, x, 3) as a PNG, with no filtering.
+    height, width, _ = rgb.shape
+    # Each row starts with a filter type byte, 0 for none
+    rows = np.zeros((height, 1 + width * 3), dtype=np.uint8)
+    rows[:, 1:] = rgb.reshape(height, width * 3)
+    header = struct.pack(
+        ">IIBBBBB", width, height, PNG_BIT_DEPTH, PNG_COLOUR_RGB, 0, 0, 0
+    )
+    return (
+        PNG_SIGNATURE
+        + _chunk(b"IHDR", header)
+        + _chunk(b"IDAT", zlib.compress(rows.tobytes(), level))
+        + _chunk(b"IEND", b"")
+    )
+
+
+def write_png(file_name: str, rgb: npt.NDArray[np.uint8]) -> None:
+    with open(file_name, "wb") as outfp:
+        outfp.write(encode_png(rgb))
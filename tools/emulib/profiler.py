@@ -0,0 +1,135 @@
+from __future__ import annotations
+
+import array
+import bisect
+
+from typing import (
+    NamedTuple,
+    Optional,
+)
+
+from dislib.heatmap import (
+    HeatCount,
+    HeatMap,
+)
+from dislib.miscdefs import PhysAddress
+from dislib.rom import Rom
+from emulib.memory import (
+    BANK_SIZE,
+    RAM_SIZE,
+    SmsMemory,
+)
+
+
+class ExecutionProfile:
+    # Ops run, T-states and calls counted against each address, see Z80Cpu.profile.
+    # Addresses are ROM addresses, with RAM after the end of the ROM.
+    # T-states go against the op which took them, and calls against where they went.
+
+    def __init__(self, *, memory: SmsMemory) -> None:
+        self.rom_size = len(memory.rom)
+        size = self.rom_size + RAM_SIZE
+        # Shared with the memory, so paging shows up here.
+        self.page_phys = memory.page_phys
+        self.ops = array.array("Q", [0]) * size
+        self.cycles = array.array("Q", [0]) * size
+        self.calls = array.array("Q", [0]) * size
+
+    def total_cycles(self) -> int:
+        return sum(self.cycles)
+
+    def heat_map(self, *, frames: int) -> HeatMap:
+        # ROM addresses only, as RAM doesn't have a listing to annotate.
+        counts: dict[PhysAddress, HeatCount] = {}
+        for p in range(self.rom_size):
+            if self.ops[p]:
+                counts[PhysAddress(p)] = HeatCount(
+                    ops=self.ops[p], cycles=self.cycles[p]
+                )
+        return HeatMap(counts=counts, total_cycles=self.total_cycles(), frames=frames)
+
+
+class RoutineMap:
+    # Which routine each ROM address belongs to, going by where each one starts.
+    # A routine runs up to the next start in the same bank.
+
+    def __init__(self, *, starts: dict[PhysAddress, str]) -> None:
+        self.names = dict(starts)
+        self.starts = sorted(starts)
+        self.addr_of = {name: p for p, name in sorted(starts.items(), reverse=True)}
+
+    def routine_at(self, p: int) -> Optional[PhysAddress]:
+        idx = bisect.bisect_right(self.starts, p) - 1
+        if idx >= 0 and self.starts[idx] // BANK_SIZE == p // BANK_SIZE:
+            return self.starts[idx]
+        return None
+
+    def routine_end(self, start: PhysAddress) -> PhysAddress:
+        idx = bisect.bisect_right(self.starts, start)
+        bank_end = start - start % BANK_SIZE + BANK_SIZE
+        if idx < len(self.starts):
+            return PhysAddress(min(self.starts[idx], bank_end))
+        return PhysAddress(bank_end)
+
+
+def rom_routine_map(rom: Rom) -> RoutineMap:
+    # Routines start at global code labels.
+    # Local and relative labels are inside routines, so they don't start one.
+    starts: dict[PhysAddress, str] = {}
+    for label, virt_addr in rom.label_to_addr.items():
+        p = rom.virt_to_phys(virt_addr)
+        if p in rom.op_decodes and p not in starts:
+            # The first global label, if there's more than one
+            starts[p] = next(
+                name for name in rom.labels_from_addr[p] if name in rom.label_to_addr
+            )
+    return RoutineMap(starts=starts)
+
+
+class ProfileRow(NamedTuple):
+    name: str
+    # None for code in RAM
+    phys_addr: Optional[PhysAddress]
+    # T-states in the routine itself, not counting what it calls
+    cycles: int
+    ops: int
+    # Times it got called at its entry point, interrupts included
+    calls: int
+
+
+def flat_profile(profile: ExecutionProfile, routines: RoutineMap) -> list[ProfileRow]:
+    # Self time per routine, heaviest first.
+    names = dict(routines.names)
+    rows: dict[Optional[PhysAddress], list[int]] = {}
+    for addr in range(profile.rom_size + RAM_SIZE):
+        ops = profile.ops[addr]
+        calls = profile.calls[addr]
+        if not (ops or calls):
+            continue
+        start: Optional[PhysAddress] = None
+        if addr < profile.rom_size:
+            start = routines.routine_at(addr)
+            if start is None:
+                # Code before the first label in its bank counts against the bank.
+                start = PhysAddress(addr - addr % BANK_SIZE)
+                if start not in names:
+                    names[start] = f"(bank {addr // BANK_SIZE:02X})"
+        row = rows.setdefault(start, [0, 0, 0])
+        row[0] += profile.cycles[addr]
+        row[1] += ops
+        if start is None or addr == start:
+            row[2] += calls
+
+    return sorted(
+        (
+            ProfileRow(
+                name=names[start] if start is not None else "(RAM)",
+                phys_addr=start,
+                cycles=cycles,
+                ops=ops,
+                calls=calls,
+            )
+            for start, (cycles, ops, calls) in rows.items()
+        ),
+        key=lambda row: (-row.cycles, row.name),
+    )
@@ -0,0 +1,128 @@
+from __future__ import annotations
+
+from typing import (
+    NamedTuple,
+    Optional,
+    Sequence,
+)
+
+from dislib.annotparser import AnnotRecord
+from dislib.miscdefs import (
+    LTYPEMAP,
+    LTYPESIZE,
+    VirtAddress,
+    virt_bank,
+    virt_offs,
+)
+from emulib.memory import RAM_SIZE
+
+RAM_START = 0xC000
+# The annotations put RAM labels in this bank
+RAM_BANK = 0xF0
+
+
+class RamField(NamedTuple):
+    name: str
+    # Which element of an array, or None if it isn't one
+    idx: Optional[int]
+    # Byte within the element
+    offs: int
+
+    def format(self) -> str:
+        text = self.name
+        if self.idx is not None:
+            text += f"[{self.idx}]"
+        if self.offs:
+            text += f"+{self.offs}"
+        return text
+
+
+class RamLabelMap:
+    # Which bytes of RAM the annotations put a label on, and what to call each one.
+    # Smaller labels win over bigger ones they overlap, so a field inside an array
+    # gets its own name. A table of stride arrays (like the object list) gets
+    # covered from one end to the other, with the gaps named after the field before them.
+
+    def __init__(
+        self, *, records: Sequence[AnnotRecord], ignore_prefixes: Sequence[str] = ()
+    ) -> None:
+        self.fields: list[Optional[RamField]] = [None] * RAM_SIZE
+
+        # (start, element size, count, stride, name)
+        arrays: list[tuple[VirtAddress, int, int, int, str]] = []
+        for record in records:
+            if record.cmd == "label":
+                virt_addr, ltype, name = record.args
+                arrays.append((virt_addr, LTYPESIZE[LTYPEMAP[ltype]], 1, 0, name))
+            elif record.cmd == "arraylabel":
+                virt_addr, ltype, count, name = record.args
+                size = LTYPESIZE[LTYPEMAP[ltype]]
+                arrays.append((virt_addr, size, count, size, name))
+            elif record.cmd == "stridearraylabel":
+                virt_addr, stride, ltype, count, name = record.args
+                arrays.append(
+                    (virt_addr, LTYPESIZE[LTYPEMAP[ltype]], count, stride, name)
+                )
+
+        # (start, end) of each stride array table
+        tables: list[tuple[int, int]] = []
+        # Biggest first, so smaller ones overwrite them
+        by_size = sorted(
+            (
+                (virt_offs(virt_addr) - RAM_START, size, count, stride, name)
+                for virt_addr, size, count, stride, name in arrays
+                if virt_bank(virt_addr) == RAM_BANK
+                and RAM_START <= virt_offs(virt_addr) < RAM_START + RAM_SIZE
+                and not name.startswith(tuple(ignore_prefixes))
+            ),
+            key=lambda array: -(array[1] + array[3] * (array[2] - 1)),
+        )
+        for start, size, count, stride, name in by_size:
+            if stride > size:
+                tables.append((start, min(start + stride * count, RAM_SIZE)))
+            for idx in range(count):
+                for offs in range(size):
+                    addr = start + idx * stride + offs
+                    if addr < RAM_SIZE:
+                        self.fields[addr] = RamField(
+                            name=name, idx=idx if count > 1 else None, offs=offs
+                        )
+
+        for start, end in tables:
+            prev: Optional[RamField] = None
+            for addr in range(start, end):
+                field = self.fields[addr]
+                if field is None and prev is not None:
+                    self.fields[addr] = prev._replace(offs=prev.offs + 1)
+                prev = self.fields[addr]
+
+        # Runs of labelled bytes, to compare in one go each
+        self.ranges: list[tuple[int, int]] = []
+        addr = 0
+        while addr < RAM_SIZE:
+            if self.fields[addr] is None:
+                addr += 1
+                continue
+            start = addr
+            while addr < RAM_SIZE and self.fields[addr] is not None:
+                addr += 1
+            self.ranges.append((start, addr))
+
+    def labelled_size(self) -> int:
+        return sum(end - start for start, end in self.ranges)
+
+    def differences(self, ram_a: bytearray, ram_b: bytearray) -> list[int]:
+        # Offsets into RAM of every labelled byte which isn't the same in both.
+        if ram_a == ram_b:
+            return []
+        offsets: list[int] = []
+        for start, end in self.ranges:
+            if ram_a[start:end] != ram_b[start:end]:
+                offsets.extend(
+                    offs for offs in range(start, end) if ram_a[offs] != ram_b[offs]
+                )
+        return offsets
+
+    def format_offs(self, offs: int) -> str:
+        field = self.fields[offs]
+        return field.format() if field is not None else "?"
@@ -0,0 +1,76 @@
+from __future__ import annotations
+
+from typing import (
+    Optional,
+)
+
+from emulib.checkpoint import CheckpointFile
+from emulib.inputscript import InputScript
+from emulib.machine import SmsMachine
+
+# Where the game keeps IY, and what it keeps there
+IY_BASE = 0xD200
+# (IY+$05) bit 1 is set while the demo's playing
+DEMO_FLAG_OFFS = 0x05
+DEMO_FLAG_BIT = 1
+# What the game thinks is held on joypad 1 this frame, 0 for held
+INPUTS_PLAYER_1 = 0xD203
+
+
+class ReplayRunner:
+    # Runs a ROM from reset with an input script, one frame at a time.
+    # With a checkpoint file, it takes a checkpoint at the start of every interval frames,
+    # and seek() starts from the nearest usable one rather than from reset.
+
+    def __init__(
+        self,
+        *,
+        rom: bytes,
+        script: InputScript,
+        checkpoints: Optional[CheckpointFile] = None,
+        interval: int = 0,
+    ) -> None:
+        self.machine = SmsMachine(rom=rom)
+        self.script = script
+        self.checkpoints = checkpoints
+        self.interval = interval
+
+    @property
+    def frame(self) -> int:
+        return self.machine.frame_count
+
+    def run_frame(self) -> int:
+        # Returns the T-states the CPU spent doing something, as SmsMachine.run_frame does.
+        machine = self.machine
+        frame = machine.frame_count
+        if (
+            self.checkpoints is not None
+            and self.interval > 0
+            and frame % self.interval == 0
+            and self.checkpoints.nearest(frame, script=self.script) != frame
+        ):
+            self.checkpoints.add(machine, script=self.script)
+        machine.set_joypad_1(self.script.held_at(frame))
+        return machine.run_frame()
+
+    def seek(self, frame: int) -> int:
+        # Gets to the start of this frame, and returns the frame it went from.
+        start = self.frame if self.frame <= frame else None
+        if self.checkpoints is not None:
+            nearest = self.checkpoints.nearest(frame, script=self.script)
+            if nearest is not None and (start is None or nearest > start):
+                self.checkpoints.restore(self.machine, nearest)
+                start = nearest
+        if start is None:
+            self.machine.reset()
+            start = 0
+        while self.frame < frame:
+            self.run_frame()
+        return start
+
+    def demo_playing(self) -> bool:
+        ram = self.machine.memory
+        return bool(ram.read(IY_BASE + DEMO_FLAG_OFFS) & (1 << DEMO_FLAG_BIT))
+
+    def game_inputs(self) -> int:
+        return self.machine.memory.read(INPUTS_PLAYER_1)
@@ -0,0 +1,42 @@
+from __future__ import annotations
+
+import re
+
+from dislib.miscdefs import PhysAddress
+from emulib.memory import BANK_SIZE
+
+SYM_LABEL_RE = re.compile(r"^([0-9A-Fa-f]+):([0-9A-Fa-f]{4}) (\S+)$")
+
+
+def read_sym_labels(file_name: str) -> dict[PhysAddress, str]:
+    # Global ROM labels from the [labels] section of a "wlalink -s" symbol file,
+    # which is how a built ROM says where things ended up.
+    # Local labels (_foo), child labels (foo@bar) and anonymous ones (-, +, __) get left out,
+    # as does anything in RAM. The first label at an address wins.
+    labels: dict[PhysAddress, str] = {}
+    section = ""
+    with open(file_name, "r") as infp:
+        for line in infp:
+            line = line.split(";", 1)[0].strip()
+            if line.startswith("["):
+                section = line
+                continue
+            if section != "[labels]" or line == "":
+                continue
+            m = SYM_LABEL_RE.match(line)
+            if m is None:
+                continue
+            bank = int(m.group(1), 16)
+            offs = int(m.group(2), 16)
+            name = m.group(3)
+            if (
+                offs >= 0xC000
+                or name.startswith("_")
+                or "@" in name
+                or name.strip("+-") == ""
+            ):
+                continue
+            p = PhysAddress(bank * BANK_SIZE + offs % BANK_SIZE)
+            if p not in labels:
+                labels[p] = name
+    return labels
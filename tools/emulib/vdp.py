@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+from typing import (
+    Optional,
+)
+
+VRAM_SIZE = 0x4000
+CRAM_SIZE = 0x20
+REG_COUNT = 16
+
+# NTSC, 192 line mode
+LINES_PER_FRAME = 262
+ACTIVE_LINES = 192
+# The frame interrupt goes off on the line after the last visible one.
+FRAME_IRQ_LINE = ACTIVE_LINES + 1
+
+STATUS_FRAME_IRQ = 0x80
+
+# What the top two bits of the second control byte mean
+CODE_VRAM_READ = 0
+CODE_VRAM_WRITE = 1
+CODE_REG_WRITE = 2
+CODE_CRAM_WRITE = 3
+
+
+class SmsVdp:
+    # Just enough of the VDP to keep the game happy: the ports, VRAM/CRAM/registers,
+    # and the frame and line interrupts. Nothing gets drawn here.
+
+    def __init__(self) -> None:
+        self.vram = bytearray(VRAM_SIZE)
+        self.cram = bytearray(CRAM_SIZE)
+        self.regs = bytearray(REG_COUNT)
+        self.reset()
+
+    def reset(self) -> None:
+        self.vram[:] = bytes(VRAM_SIZE)
+        self.cram[:] = bytes(CRAM_SIZE)
+        self.regs[:] = bytes(REG_COUNT)
+        self.addr = 0
+        self.code = CODE_VRAM_READ
+        # The first control byte, while waiting for the second
+        self.latch: Optional[int] = None
+        self.read_buffer = 0
+        self.status = 0
+        self.line = 0
+        self.line_counter = 0
+        self.line_irq = False
+
+    @property
+    def irq_pending(self) -> bool:
+        return bool(
+            (self.status & STATUS_FRAME_IRQ and self.regs[1] & 0x20)
+            or (self.line_irq and self.regs[0] & 0x10)
+        )
+
+    def start_line(self, line: int) -> None:
+        self.line = line
+        if line <= ACTIVE_LINES:
+            self.line_counter -= 1
+            if self.line_counter < 0:
+                self.line_counter = self.regs[10]
+                self.line_irq = True
+        else:
+            self.line_counter = self.regs[10]
+        if line == FRAME_IRQ_LINE:
+            self.status |= STATUS_FRAME_IRQ
+
+    def read_v_counter(self) -> int:
+        # $00-$DA, then jumps back to $D5-$FF
+        return self.line if self.line <= 0xDA else self.line - 6
+
+    def read_status(self) -> int:
+        val = self.status
+        self.status = 0
+        self.line_irq = False
+        self.latch = None
+        return val
+
+    def write_control(self, val: int) -> None:
+        if self.latch is None:
+            self.latch = val
+            return
+        self.code = val >> 6
+        self.addr = ((val & 0x3F) << 8) | self.latch
+        self.latch = None
+        if self.code == CODE_VRAM_READ:
+            self.read_buffer = self.vram[self.addr]
+            self.addr = (self.addr + 1) & 0x3FFF
+        elif self.code == CODE_REG_WRITE:
+            self.regs[val & 0x0F] = self.addr & 0xFF
+
+    def read_data(self) -> int:
+        self.latch = None
+        val = self.read_buffer
+        self.read_buffer = self.vram[self.addr]
+        self.addr = (self.addr + 1) & 0x3FFF
+        return val
+
+    def write_data(self, val: int) -> None:
+        self.latch = None
+        if self.code == CODE_CRAM_WRITE:
+            self.cram[self.addr & (CRAM_SIZE - 1)] = val
+        else:
+            self.vram[self.addr] = val
+        self.read_buffer = val
+        self.addr = (self.addr + 1) & 0x3FFF
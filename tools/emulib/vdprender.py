@@ -0,0 +1,348 @@
+from __future__ import annotations
+
+from typing import (
+    Optional,
+    Sequence,
+)
+
+import numpy as np
+import numpy.typing as npt
+
+from emulib.vdp import (
+    ACTIVE_LINES,
+    CRAM_SIZE,
+    REG_COUNT,
+    VRAM_SIZE,
+)
+
+SCREEN_WIDTH = 256
+SCREEN_HEIGHT = ACTIVE_LINES
+# 32x28 tiles in the name table, which the vertical scroll wraps around
+BG_WIDTH = 256
+BG_HEIGHT = 224
+
+TILE_COUNT = VRAM_SIZE // 32
+SPRITE_COUNT = 64
+SPRITES_PER_LINE = 8
+# A sprite Y of this ends the sprite list, in 192 line mode.
+SPRITE_LIST_END = 0xD0
+
+# How many frames render_frames does at once.
+# Much more than this and everything for a batch stops fitting in the cache.
+FRAME_BATCH = 16
+
+# Name table entry bits
+NT_TILE_MASK = 0x01FF
+NT_HFLIP = 0x0200
+NT_VFLIP = 0x0400
+NT_SPRITE_PALETTE = 0x0800
+NT_PRIORITY = 0x1000
+
+# Each 2-bit colour component as 8 bits
+LEVELS = np.array([0x00, 0x55, 0xAA, 0xFF], dtype=np.uint8)
+
+U8Array = npt.NDArray[np.uint8]
+U64Array = npt.NDArray[np.uint64]
+
+# Copies a byte into all 8 bytes of a uint64, i.e. across a whole tile row
+BYTE_SPREAD = np.uint64(0x0101010101010101)
+
+
+def _make_plane_lut() -> U64Array:
+    # A bit plane byte spread out into 8 pixel bytes, leftmost pixel first in memory
+    vals = np.arange(256, dtype=np.uint64)
+    lut = np.zeros(256, dtype=np.uint64)
+    for x in range(8):
+        lut |= ((vals >> np.uint64(7 - x)) & np.uint64(1)) << np.uint64(8 * x)
+    return lut
+
+
+PLANE_LUT = _make_plane_lut()
+
+
+def _make_pixel_lut() -> npt.NDArray[np.intp]:
+    # Each background pixel is a byte of colour + 16 for the sprite palette + 32 for priority.
+    # With a sprite colour (0 for none) on top of it, as (sprite << 6) | background,
+    # this says which CRAM index ends up on screen.
+    bg = np.arange(64)[None, :]
+    sprite = np.arange(16)[:, None]
+    bg_over = (bg & 32 != 0) & (bg & 15 != 0)
+    return np.where((sprite != 0) & ~bg_over, sprite + 16, bg & 31).ravel()
+
+
+PIXEL_LUT = _make_pixel_lut()
+
+
+def decode_tiles(vram: bytes) -> U8Array:
+    # All 512 tiles as colour indexes, shaped (tile, y, x).
+    # Each row is 4 bytes, one per bit plane, leftmost pixel in bit 7.
+    planes = np.frombuffer(vram, dtype=np.uint8, count=VRAM_SIZE).reshape(-1, 4)
+    rows = (
+        PLANE_LUT[planes[:, 0]]
+        | (PLANE_LUT[planes[:, 1]] << np.uint64(1))
+        | (PLANE_LUT[planes[:, 2]] << np.uint64(2))
+        | (PLANE_LUT[planes[:, 3]] << np.uint64(3))
+    )
+    tiles: U8Array = rows.view(np.uint8).reshape(TILE_COUNT, 8, 8)
+    return tiles
+
+
+def decode_cram(cram: bytes) -> U8Array:
+    # --BBGGRR to RGB, shaped (colour, 3)
+    vals = np.frombuffer(cram, dtype=np.uint8, count=CRAM_SIZE)
+    return np.stack(
+        [LEVELS[vals & 3], LEVELS[(vals >> 2) & 3], LEVELS[(vals >> 4) & 3]], axis=1
+    )
+
+
+def _decode_tile_rows(vram: U8Array) -> U64Array:
+    # Each frame's 512 tiles, shaped (frame, tile, y), with a row of 8 pixel bytes in each uint64.
+    planes = vram.reshape(-1, 4)
+    rows: U64Array = (
+        PLANE_LUT[planes[:, 0]]
+        | (PLANE_LUT[planes[:, 1]] << np.uint64(1))
+        | (PLANE_LUT[planes[:, 2]] << np.uint64(2))
+        | (PLANE_LUT[planes[:, 3]] << np.uint64(3))
+    )
+    return rows.reshape(len(vram), TILE_COUNT, 8)
+
+
+def render_backgrounds(
+    tile_rows: U64Array, vram: U8Array, name_tables: npt.NDArray[np.intp]
+) -> U8Array:
+    # Each frame's whole 256x224 name table, as background pixel bytes (see _make_pixel_lut),
+    # shaped (frame, y, x).
+    # A tile row is 8 bytes, so it gets handled as one uint64,
+    # which makes a horizontal flip a byte swap.
+    frame_count = len(vram)
+    entries = vram.view("<u2")[
+        np.arange(frame_count)[:, None],
+        (name_tables // 2)[:, None] + np.arange(32 * 28),
+    ].reshape(frame_count, 28, 32)
+    # Every tile in all 4 flips, indexed by the name table's flip bits
+    flipped = np.empty((frame_count, 4, TILE_COUNT, 8), dtype=np.uint64)
+    flipped[:, 0] = tile_rows
+    flipped[:, 1] = tile_rows.byteswap()
+    flipped[:, 2] = tile_rows[:, :, ::-1]
+    flipped[:, 3] = flipped[:, 2].byteswap()
+    flips = (entries & (NT_HFLIP | NT_VFLIP)) >> 9
+    tiles = (np.arange(frame_count)[:, None, None] * 4 + flips) * TILE_COUNT + (
+        entries & NT_TILE_MASK
+    )
+    # (frame, row, col, y)
+    pixels = np.take(flipped.reshape(-1, 8), tiles, axis=0)
+    attrs = (entries & (NT_SPRITE_PALETTE | NT_PRIORITY)) >> 7
+    pixels |= (attrs.astype(np.uint64) * BYTE_SPREAD)[..., None]
+    bg: U8Array = (
+        np.ascontiguousarray(pixels.transpose(0, 1, 3, 2))
+        .view(np.uint8)
+        .reshape(frame_count, BG_HEIGHT, BG_WIDTH)
+    )
+    return bg
+
+
+def draw_sprites(
+    combined: npt.NDArray[np.uint16], tile_rows: U64Array, vram: U8Array, regs: U8Array
+) -> None:
+    # Puts each frame's sprite colours on top of the background pixels in combined,
+    # shaped (frame, y, x), as (sprite << 6) | background.
+    # Earlier sprites go on top, and only the first 8 on a line get drawn.
+    # Zoomed sprites get drawn unzoomed.
+    frame_count = len(vram)
+    frame_idxs = np.arange(frame_count)[:, None]
+    sprite_idxs = np.arange(SPRITE_COUNT)
+    sat = ((regs[:, 5].astype(np.intp) & 0x7E) << 7)[:, None]
+    tile_base = np.where(regs[:, 6] & 0x04, 0x100, 0)[:, None]
+    tall = regs[:, 1] & 0x02 != 0
+    x_shift = np.where(regs[:, 0] & 0x08, 8, 0)[:, None]
+
+    # (frame, sprite)
+    ys = vram[frame_idxs, sat + sprite_idxs].astype(np.intp)
+    # A sprite Y of SPRITE_LIST_END ends the list.
+    listed = np.logical_and.accumulate(ys != SPRITE_LIST_END, axis=1)
+    # Drawn a line down from where it says, and Ys past the bottom wrap to the top.
+    tops = np.where(ys < 0xF0, ys + 1, ys + 1 - 0x100)
+    xs = vram[frame_idxs, sat + 0x80 + sprite_idxs * 2].astype(np.intp) - x_shift
+    sprite_tiles = vram[frame_idxs, sat + 0x81 + sprite_idxs * 2] + tile_base
+    sprite_tiles = np.where(tall[:, None], sprite_tiles & ~1, sprite_tiles)
+
+    # Every row of every listed sprite that's on screen, in sprite order for each frame
+    # (frame, sprite, row)
+    sprite_rows = np.arange(16)
+    lines = tops[:, :, None] + sprite_rows
+    on_screen = (
+        listed[:, :, None]
+        & (sprite_rows < np.where(tall, 16, 8)[:, None, None])
+        & (lines >= 0)
+        & (lines < SCREEN_HEIGHT)
+    )
+    frame_pos, sprite_pos, rows = np.nonzero(on_screen)
+    if len(frame_pos) == 0:
+        return
+    lines = lines[frame_pos, sprite_pos, rows]
+
+    # Where each row comes among the ones on the same line, from 0.
+    # Sorting by line keeps them in sprite order, and only the first 8 get drawn.
+    # Small keys get a radix sort, which is a lot quicker.
+    line_keys = (frame_pos * SCREEN_HEIGHT + lines).astype(
+        np.min_scalar_type(frame_count * SCREEN_HEIGHT)
+    )
+    order = np.argsort(line_keys, kind="stable")
+    sorted_keys = line_keys[order]
+    row_idxs = np.arange(len(order))
+    line_starts = np.ones(len(order), dtype=bool)
+    line_starts[1:] = sorted_keys[1:] != sorted_keys[:-1]
+    places = row_idxs - np.maximum.accumulate(np.where(line_starts, row_idxs, 0))
+    order = order[places < SPRITES_PER_LINE]
+    places = places[places < SPRITES_PER_LINE].astype(np.uint8)
+    # Then last place first, so the earlier sprites end up on top
+    by_place = np.argsort(SPRITES_PER_LINE - 1 - places, kind="stable")
+    order = order[by_place]
+    places = places[by_place]
+
+    # Each of those rows as 8 pixels
+    frame_pos = frame_pos[order]
+    sprite_pos = sprite_pos[order]
+    rows = rows[order]
+    row_tiles = sprite_tiles[frame_pos, sprite_pos] + np.where(
+        tall[frame_pos], rows >> 3, 0
+    )
+    pixels = (
+        np.take(tile_rows, (frame_pos * TILE_COUNT + row_tiles) * 8 + (rows & 7))
+        .view(np.uint8)
+        .reshape(-1, 8)
+    )
+    cols = xs[frame_pos, sprite_pos, None] + np.arange(8)
+    drawn = (pixels != 0) & (cols >= 0) & (cols < SCREEN_WIDTH)
+    dests = ((frame_pos * SCREEN_HEIGHT + lines[order]) * SCREEN_WIDTH)[:, None] + cols
+    dests = dests[drawn]
+    colours = pixels[drawn].astype(np.uint16) << 6
+
+    # Each place on a line only has the one sprite, so nothing gets drawn twice in one go.
+    place_counts = np.bincount(
+        SPRITES_PER_LINE - 1 - places,
+        weights=drawn.sum(axis=1),
+        minlength=SPRITES_PER_LINE,
+    )
+    bounds = [0] + np.cumsum(place_counts).astype(np.intp).tolist()
+    combined_flat = combined.reshape(-1)
+    for start, end in zip(bounds, bounds[1:]):
+        place_dests = dests[start:end]
+        combined_flat[place_dests] = (combined_flat[place_dests] & 0x3F) | colours[
+            start:end
+        ]
+
+
+def _wrapped_runs(
+    start: int, end: int, offset: int, size: int
+) -> list[tuple[int, int]]:
+    # Splits start to end into (start, source start) runs where (i + offset) % size doesn't wrap.
+    runs: list[tuple[int, int]] = []
+    while start < end:
+        src = (start + offset) % size
+        runs.append((start, src))
+        start += min(end - start, size - src)
+    return runs
+
+
+def _copy_scrolled(
+    dest: npt.NDArray[np.uint16],
+    bg: U8Array,
+    *,
+    top: int = 0,
+    bottom: int = SCREEN_HEIGHT,
+    left: int = 0,
+    right: int = SCREEN_WIDTH,
+    v_scroll: int,
+    h_scroll: int,
+) -> None:
+    # dest[y, x] = bg[(y + v_scroll) % BG_HEIGHT, (x - h_scroll) % BG_WIDTH] over that rectangle,
+    # as a few slices rather than pixel by pixel.
+    row_runs = _wrapped_runs(top, bottom, v_scroll, BG_HEIGHT)
+    col_runs = _wrapped_runs(left, right, -h_scroll, BG_WIDTH)
+    for run_idx, (y, src_y) in enumerate(row_runs):
+        y_end = row_runs[run_idx + 1][0] if run_idx + 1 < len(row_runs) else bottom
+        for col_idx, (x, src_x) in enumerate(col_runs):
+            x_end = col_runs[col_idx + 1][0] if col_idx + 1 < len(col_runs) else right
+            dest[y:y_end, x:x_end] = bg[
+                src_y : src_y + y_end - y, src_x : src_x + x_end - x
+            ]
+
+
+def render_frames(frames: Sequence[tuple[bytes, bytes, bytes]]) -> U8Array:
+    # The visible 256x192 screen as RGB for each (VRAM, CRAM, registers) in frames,
+    # shaped (frame, y, x, 3), in the SMS's own 192 line mode.
+    # The sprite table is wherever register 5 says it is in VRAM.
+    # Frames get done FRAME_BATCH at a time, with most steps done for the whole batch at once.
+    # What comes back is a view into an RGBX array, so it isn't contiguous.
+    out = np.empty((len(frames), SCREEN_HEIGHT, SCREEN_WIDTH, 4), dtype=np.uint8)
+    out_rgbx = out.view(np.uint32).reshape(len(frames), SCREEN_HEIGHT, SCREEN_WIDTH)
+    for start in range(0, len(frames), FRAME_BATCH):
+        batch = frames[start : start + FRAME_BATCH]
+        _render_batch(batch, out_rgbx[start : start + len(batch)])
+    return out[..., :3]
+
+
+def _render_batch(
+    frames: Sequence[tuple[bytes, bytes, bytes]], out: npt.NDArray[np.uint32]
+) -> None:
+    frame_count = len(frames)
+    vram = np.frombuffer(
+        b"".join(vram[:VRAM_SIZE] for vram, _, _ in frames), dtype=np.uint8
+    ).reshape(frame_count, VRAM_SIZE)
+    cram = np.frombuffer(
+        b"".join(cram[:CRAM_SIZE] for _, cram, _ in frames), dtype=np.uint8
+    ).reshape(frame_count, CRAM_SIZE)
+    regs = np.frombuffer(
+        b"".join(regs[:REG_COUNT] for _, _, regs in frames), dtype=np.uint8
+    ).reshape(frame_count, REG_COUNT)
+
+    rgb = np.zeros((frame_count, CRAM_SIZE, 4), dtype=np.uint8)
+    rgb[:, :, 0] = LEVELS[cram & 3]
+    rgb[:, :, 1] = LEVELS[(cram >> 2) & 3]
+    rgb[:, :, 2] = LEVELS[(cram >> 4) & 3]
+    # Every background and sprite pixel combination straight to RGBX as a uint32
+    pixel_rgb = rgb.view(np.uint32)[:, PIXEL_LUT, 0]
+
+    tile_rows = _decode_tile_rows(vram)
+    bg = render_backgrounds(tile_rows, vram, (regs[:, 2].astype(np.intp) & 0x0E) << 10)
+
+    # Which background pixel each screen pixel comes from
+    combined = np.empty((frame_count, SCREEN_HEIGHT, SCREEN_WIDTH), dtype=np.uint16)
+    for frame_idx, (_, _, frame_regs) in enumerate(frames):
+        h_scroll = frame_regs[8]
+        v_scroll = frame_regs[9]
+        pixels = combined[frame_idx]
+        frame_bg = bg[frame_idx]
+        _copy_scrolled(pixels, frame_bg, v_scroll=v_scroll, h_scroll=h_scroll)
+        h_lock = frame_regs[0] & 0x40 and h_scroll
+        v_lock = frame_regs[0] & 0x80 and v_scroll
+        if h_lock:
+            # The top two rows don't scroll sideways, for a status bar.
+            _copy_scrolled(pixels, frame_bg, bottom=16, v_scroll=v_scroll, h_scroll=0)
+        if v_lock:
+            # Nor do the right eight columns scroll up and down.
+            _copy_scrolled(pixels, frame_bg, left=192, v_scroll=0, h_scroll=h_scroll)
+            if frame_regs[0] & 0x40:
+                _copy_scrolled(
+                    pixels, frame_bg, bottom=16, left=192, v_scroll=0, h_scroll=0
+                )
+
+    draw_sprites(combined, tile_rows, vram, regs)
+
+    for frame_idx, (_, _, frame_regs) in enumerate(frames):
+        pixels = combined[frame_idx]
+        backdrop = 16 + (frame_regs[7] & 0x0F)
+        if not frame_regs[1] & 0x40:
+            # Display off
+            pixels[:] = backdrop
+        elif frame_regs[0] & 0x20:
+            # The leftmost column gets blanked to the backdrop.
+            pixels[:, :8] = backdrop
+        np.take(pixel_rgb[frame_idx], pixels, out=out[frame_idx], mode="clip")
+
+
+def render_frame(vram: bytes, cram: bytes, regs: bytes) -> U8Array:
+    # Just the one frame, shaped (y, x, 3). See render_frames.
+    frame: U8Array = render_frames([(vram, cram, regs)])[0]
+    return frame
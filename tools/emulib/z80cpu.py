@@ -0,0 +1,1399 @@
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+from typing import (
+    Callable,
+    Optional,
+)
+
+from dislib.z80ops import (
+    OA,
+    OA_CONST_0_7,
+    OA_MAP_CONST_ADDR,
+    OE,
+    OP_TABLE_CB,
+    OP_TABLE_DD_CB,
+    OP_TABLE_DD_XX,
+    OP_TABLE_ED,
+    OP_TABLE_FD_CB,
+    OP_TABLE_FD_XX,
+    OP_TABLE_XX,
+)
+
+if TYPE_CHECKING:
+    from emulib.profiler import ExecutionProfile
+
+# (op address) -> T-states taken. Each one sets PC itself.
+Handler = Callable[[int], int]
+PortIn = Callable[[int], int]
+PortOut = Callable[[int, int], None]
+
+# Indexes into Z80Cpu.regs.
+# The 8-bit ones go in the same order as the r field of an opcode, with F where (hl) would be.
+REG_B = 0
+REG_C = 1
+REG_D = 2
+REG_E = 3
+REG_H = 4
+REG_L = 5
+REG_F = 6
+REG_A = 7
+REG_IX = 8
+REG_IY = 9
+REG_SP = 10
+REG_PC = 11
+# B' C' D' E' H' L' F' A'
+REG_SHADOW = 12
+REG_COUNT = 20
+
+FLAG_C = 0x01
+FLAG_N = 0x02
+FLAG_PV = 0x04
+FLAG_3 = 0x08
+FLAG_H = 0x10
+FLAG_5 = 0x20
+FLAG_Z = 0x40
+FLAG_S = 0x80
+
+# Added onto what HALT returns, so Z80Cpu.run stops straight away.
+HALT_IDLE = 1 << 30
+
+REG8_IDX = {
+    OA.RegB: REG_B,
+    OA.RegC: REG_C,
+    OA.RegD: REG_D,
+    OA.RegE: REG_E,
+    OA.RegH: REG_H,
+    OA.RegL: REG_L,
+    OA.RegA: REG_A,
+}
+# (high, low)
+REG_PAIR_IDX = {
+    OA.RegBC: (REG_B, REG_C),
+    OA.RegDE: (REG_D, REG_E),
+    OA.RegHL: (REG_H, REG_L),
+    OA.RegAF: (REG_A, REG_F),
+}
+REG16_IDX = {
+    OA.RegSP: REG_SP,
+    OA.RegIX: REG_IX,
+    OA.RegIY: REG_IY,
+}
+# (flag mask, what the flags need to be for it to hold)
+COND_FLAGS = {
+    OA.CondNZ: (FLAG_Z, 0),
+    OA.CondZ: (FLAG_Z, FLAG_Z),
+    OA.CondNC: (FLAG_C, 0),
+    OA.CondC: (FLAG_C, FLAG_C),
+    OA.CondPO: (FLAG_PV, 0),
+    OA.CondPE: (FLAG_PV, FLAG_PV),
+    OA.CondP: (FLAG_S, 0),
+    OA.CondM: (FLAG_S, FLAG_S),
+}
+MEM_IXY = {
+    OA.MemIXdd: REG_IX,
+    OA.MemIXddCB: REG_IX,
+    OA.MemIYdd: REG_IY,
+    OA.MemIYddCB: REG_IY,
+}
+
+S8 = [v - 0x100 if v >= 0x80 else v for v in range(0x100)]
+
+# Lengths of the unprefixed ops which can call somewhere, 0 for everything else.
+# If PC doesn't end up just past one of these, the call happened.
+CALL_LENGTHS = [
+    entry.length if entry is not None and entry.spec.name in {"CALL", "RST"} else 0
+    for entry in OP_TABLE_XX
+]
+
+
+def _parity(v: int) -> int:
+    return FLAG_PV if bin(v).count("1") % 2 == 0 else 0
+
+
+SZ53 = bytes(
+    (v & (FLAG_S | FLAG_5 | FLAG_3)) | (FLAG_Z if v == 0 else 0) for v in range(0x100)
+)
+SZ53P = bytes(SZ53[v] | _parity(v) for v in range(0x100))
+# Indexed by the result, and they leave C alone
+INC_FLAGS = bytes(
+    SZ53[v] | (FLAG_H if v & 0x0F == 0 else 0) | (FLAG_PV if v == 0x80 else 0)
+    for v in range(0x100)
+)
+DEC_FLAGS = bytes(
+    SZ53[v]
+    | FLAG_N
+    | (FLAG_H if v & 0x0F == 0x0F else 0)
+    | (FLAG_PV if v == 0x7F else 0)
+    for v in range(0x100)
+)
+
+
+def _add_flags(idx: int) -> int:
+    carry, a, b = idx >> 16, (idx >> 8) & 0xFF, idx & 0xFF
+    r = a + b + carry
+    return (
+        SZ53[r & 0xFF]
+        | (r >> 8)
+        | ((a ^ b ^ r) & FLAG_H)
+        | ((~(a ^ b) & (a ^ r) & 0x80) >> 5)
+    )
+
+
+def _sub_flags(idx: int) -> int:
+    carry, a, b = idx >> 16, (idx >> 8) & 0xFF, idx & 0xFF
+    r = a - b - carry
+    return (
+        SZ53[r & 0xFF]
+        | FLAG_N
+        | ((r >> 8) & FLAG_C)
+        | ((a ^ b ^ r) & FLAG_H)
+        | (((a ^ b) & (a ^ r) & 0x80) >> 5)
+    )
+
+
+# Indexed by carry << 16 | a << 8 | b
+ADD_FLAGS = bytes(_add_flags(idx) for idx in range(0x20000))
+SUB_FLAGS = bytes(_sub_flags(idx) for idx in range(0x20000))
+
+
+# The CB shifts and rotates: (value, flags) -> carry << 8 | result
+def _rlc(v: int, f: int) -> int:
+    return ((v << 1) | (v >> 7)) & 0xFF | (v >> 7) << 8
+
+
+def _rrc(v: int, f: int) -> int:
+    return (v >> 1) | ((v & 1) << 7) | (v & 1) << 8
+
+
+def _rl(v: int, f: int) -> int:
+    return (v << 1) | (f & FLAG_C)
+
+
+def _rr(v: int, f: int) -> int:
+    return (v >> 1) | ((f & FLAG_C) << 7) | (v & 1) << 8
+
+
+def _sla(v: int, f: int) -> int:
+    return v << 1
+
+
+def _sra(v: int, f: int) -> int:
+    return (v >> 1) | (v & 0x80) | (v & 1) << 8
+
+
+def _srl(v: int, f: int) -> int:
+    return (v >> 1) | (v & 1) << 8
+
+
+SHIFTS: dict[str, Callable[[int, int], int]] = {
+    "RLC": _rlc,
+    "RRC": _rrc,
+    "RL": _rl,
+    "RR": _rr,
+    "SLA": _sla,
+    "SRA": _sra,
+    "SRL": _srl,
+}
+
+
+class Z80Error(Exception):
+    pass
+
+
+class Z80Cpu:
+    # A Z80 interpreter, going by the same op tables as the disassembler.
+    #
+    # Every op in dislib.z80ops gets its own handler, made once up front,
+    # and the handlers sit in 256-entry tables indexed by opcode.
+    # Anything the op tables don't have is an error, same as when tracing.
+    #
+    # Memory reads go straight to read_pages (1 KB pages, see SmsMemory),
+    # everything else goes through the callbacks.
+    # Only interrupt mode 1 is done, as that's all the SMS uses.
+
+    def __init__(
+        self,
+        *,
+        read_pages: list[memoryview],
+        write: Callable[[int, int], None],
+        port_in: PortIn,
+        port_out: PortOut,
+    ) -> None:
+        self.regs = [0] * REG_COUNT
+        self.read_pages = read_pages
+        self.write = write
+        self.port_in = port_in
+        self.port_out = port_out
+        self.iff1 = False
+        self.iff2 = False
+        self.im = 0
+        self.halted = False
+        self.cycles = 0
+        self.idle_cycles = 0
+        self.op_count = 0
+        # Counts per address get kept here while it's set, which slows things down.
+        self.profile: Optional[ExecutionProfile] = None
+
+        self.table_xx = self._build_table(OP_TABLE_XX, prefix_len=0)
+        self.table_cb = self._build_table(OP_TABLE_CB, prefix_len=1)
+        self.table_ed = self._build_table(OP_TABLE_ED, prefix_len=1)
+        self.table_dd = self._build_table(OP_TABLE_DD_XX, prefix_len=1)
+        self.table_fd = self._build_table(OP_TABLE_FD_XX, prefix_len=1)
+        self.table_dd_cb = self._build_table(OP_TABLE_DD_CB, prefix_len=3)
+        self.table_fd_cb = self._build_table(OP_TABLE_FD_CB, prefix_len=3)
+        self.table_xx[0xCB] = self._make_prefix(self.table_cb, 1)
+        self.table_xx[0xED] = self._make_prefix(self.table_ed, 1)
+        self.table_xx[0xDD] = self._make_prefix(self.table_dd, 1)
+        self.table_xx[0xFD] = self._make_prefix(self.table_fd, 1)
+        self.table_dd[0xCB] = self._make_prefix(self.table_dd_cb, 3)
+        self.table_fd[0xCB] = self._make_prefix(self.table_fd_cb, 3)
+
+        self.reset()
+
+    def reset(self) -> None:
+        R = self.regs
+        R[:] = [0] * REG_COUNT
+        R[REG_A] = 0xFF
+        R[REG_F] = 0xFF
+        R[REG_SP] = 0xFFFF
+        self.iff1 = False
+        self.iff2 = False
+        self.im = 0
+        self.halted = False
+
+    def read(self, addr: int) -> int:
+        return self.read_pages[addr >> 10][addr & 0x3FF]
+
+    def read_word(self, addr: int) -> int:
+        P = self.read_pages
+        return P[addr >> 10][addr & 0x3FF] | (
+            P[(addr + 1) >> 10][(addr + 1) & 0x3FF] << 8
+        )
+
+    def write_word(self, addr: int, val: int) -> None:
+        self.write(addr, val & 0xFF)
+        self.write((addr + 1) & 0xFFFF, val >> 8)
+
+    def push(self, val: int) -> None:
+        sp = (self.regs[REG_SP] - 2) & 0xFFFF
+        self.regs[REG_SP] = sp
+        self.write_word(sp, val)
+
+    def run(self, cycles: int) -> int:
+        # Runs ops until at least this many T-states have gone by.
+        # Sitting in a HALT counts as time going by, but not as ops.
+        # Returns how many T-states actually went by.
+        if self.halted:
+            self.cycles += cycles
+            self.idle_cycles += cycles
+            return cycles
+
+        if self.profile is not None:
+            done, op_count = self._run_profiled(cycles, self.profile)
+        else:
+            R = self.regs
+            P = self.read_pages
+            table = self.table_xx
+            done = 0
+            op_count = 0
+            while done < cycles:
+                pc = R[REG_PC]
+                done += table[P[pc >> 10][pc & 0x3FF]](pc)
+                op_count += 1
+
+        if self.halted:
+            busy = done - HALT_IDLE
+            done = max(busy, cycles)
+            self.idle_cycles += done - busy
+        self.cycles += done
+        self.op_count += op_count
+        return done
+
+    def _run_profiled(self, cycles: int, profile: ExecutionProfile) -> tuple[int, int]:
+        # The same as the loop in run(), but counting everything against the op's address.
+        # An op straight after EI gets counted against the EI.
+        R = self.regs
+        P = self.read_pages
+        table = self.table_xx
+        page_phys = profile.page_phys
+        addr_ops = profile.ops
+        addr_cycles = profile.cycles
+        addr_calls = profile.calls
+        done = 0
+        op_count = 0
+        phys_addr = 0
+        while done < cycles:
+            pc = R[REG_PC]
+            op = P[pc >> 10][pc & 0x3FF]
+            op_cycles = table[op](pc)
+            done += op_cycles
+            op_count += 1
+            phys_addr = page_phys[pc >> 10] + (pc & 0x3FF)
+            addr_ops[phys_addr] += 1
+            addr_cycles[phys_addr] += op_cycles
+            if CALL_LENGTHS[op]:
+                new_pc = R[REG_PC]
+                if new_pc != (pc + CALL_LENGTHS[op]) & 0xFFFF:
+                    addr_calls[page_phys[new_pc >> 10] + (new_pc & 0x3FF)] += 1
+        if self.halted:
+            addr_cycles[phys_addr] -= HALT_IDLE
+        return (done, op_count)
+
+    def interrupt(self) -> int:
+        # Mode 1: push PC and go to $0038.
+        # Returns the T-states it took, or 0 if interrupts are off.
+        if not self.iff1:
+            return 0
+        self.iff1 = False
+        self.iff2 = False
+        self.halted = False
+        self.push(self.regs[REG_PC])
+        self.regs[REG_PC] = 0x0038
+        self.cycles += 13
+        if self.profile is not None:
+            # Counted as a call, with the T-states going against the handler
+            phys_addr = self.profile.page_phys[0] + 0x0038
+            self.profile.calls[phys_addr] += 1
+            self.profile.cycles[phys_addr] += 13
+        return 13
+
+    def _build_table(
+        self, entries: list[Optional[OE]], *, prefix_len: int
+    ) -> list[Handler]:
+        table: list[Handler] = []
+        for opcode, entry in enumerate(entries):
+            if entry is None or (
+                prefix_len == 3 and not any(a in MEM_IXY for a, _, _ in entry.layout)
+            ):
+                # The DD CB / FD CB tables share specs with CB, but only the (ix+dd) ones are real.
+                table.append(self._make_unknown(prefix_len))
+                continue
+            factory = self._factories.get(entry.spec.name)
+            if factory is None:
+                raise Z80Error(f"no handler for {entry.spec.name!r}")
+            table.append(factory(self, entry))
+        return table
+
+    def _make_prefix(self, table: list[Handler], opcode_offs: int) -> Handler:
+        P = self.read_pages
+
+        def h(pc: int) -> int:
+            p = pc + opcode_offs
+            return table[P[p >> 10][p & 0x3FF]](pc)
+
+        return h
+
+    def _make_unknown(self, prefix_len: int) -> Handler:
+        def h(pc: int) -> int:
+            op_bytes = " ".join(
+                f"{self.read((pc + i) & 0xFFFF):02X}" for i in range(prefix_len + 1)
+            )
+            raise Z80Error(f"unknown op {op_bytes} at ${pc:04X}")
+
+        return h
+
+    # Operand access, for the less common forms
+
+    def _addr_of(self, a: OA, offs: int) -> Callable[[int], int]:
+        R = self.regs
+        P = self.read_pages
+        read_word = self.read_word
+
+        if a == OA.MemHL:
+
+            def addr(pc: int) -> int:
+                return R[REG_H] << 8 | R[REG_L]
+
+        elif a == OA.MemBC:
+
+            def addr(pc: int) -> int:
+                return R[REG_B] << 8 | R[REG_C]
+
+        elif a == OA.MemDE:
+
+            def addr(pc: int) -> int:
+                return R[REG_D] << 8 | R[REG_E]
+
+        elif a in MEM_IXY:
+            base = MEM_IXY[a]
+
+            def addr(pc: int) -> int:
+                p = pc + offs
+                return (R[base] + S8[P[p >> 10][p & 0x3FF]]) & 0xFFFF
+
+        elif a in {OA.MemByteImmWord, OA.MemWordImmWord}:
+
+            def addr(pc: int) -> int:
+                return read_word(pc + offs)
+
+        else:
+            raise Z80Error(f"{a} isn't a memory operand")
+        return addr
+
+    def _getter(self, a: OA, offs: int) -> Callable[[int], int]:
+        R = self.regs
+        P = self.read_pages
+
+        if a in REG8_IDX:
+            idx = REG8_IDX[a]
+
+            def get(pc: int) -> int:
+                return R[idx]
+
+        elif a == OA.Byte:
+
+            def get(pc: int) -> int:
+                p = pc + offs
+                return P[p >> 10][p & 0x3FF]
+
+        else:
+            addr = self._addr_of(a, offs)
+
+            def get(pc: int) -> int:
+                p = addr(pc)
+                return P[p >> 10][p & 0x3FF]
+
+        return get
+
+    def _setter(self, a: OA, offs: int) -> Callable[[int, int], None]:
+        R = self.regs
+        write = self.write
+
+        if a in REG8_IDX:
+            idx = REG8_IDX[a]
+
+            def put(pc: int, v: int) -> None:
+                R[idx] = v
+
+        else:
+            addr = self._addr_of(a, offs)
+
+            def put(pc: int, v: int) -> None:
+                write(addr(pc), v)
+
+        return put
+
+    def _getter16(self, a: OA, offs: int) -> Callable[[int], int]:
+        R = self.regs
+        read_word = self.read_word
+
+        if a in REG_PAIR_IDX:
+            hi, lo = REG_PAIR_IDX[a]
+
+            def get(pc: int) -> int:
+                return R[hi] << 8 | R[lo]
+
+        elif a in REG16_IDX:
+            idx = REG16_IDX[a]
+
+            def get(pc: int) -> int:
+                return R[idx]
+
+        elif a == OA.Word:
+
+            def get(pc: int) -> int:
+                return read_word(pc + offs)
+
+        elif a == OA.MemWordImmWord:
+
+            def get(pc: int) -> int:
+                return read_word(read_word(pc + offs))
+
+        else:
+            raise Z80Error(f"{a} isn't a 16-bit operand")
+        return get
+
+    def _setter16(self, a: OA, offs: int) -> Callable[[int, int], None]:
+        R = self.regs
+        read_word = self.read_word
+        write_word = self.write_word
+
+        if a in REG_PAIR_IDX:
+            hi, lo = REG_PAIR_IDX[a]
+
+            def put(pc: int, v: int) -> None:
+                R[hi] = v >> 8
+                R[lo] = v & 0xFF
+
+        elif a in REG16_IDX:
+            idx = REG16_IDX[a]
+
+            def put(pc: int, v: int) -> None:
+                R[idx] = v
+
+        elif a == OA.MemWordImmWord:
+
+            def put(pc: int, v: int) -> None:
+                write_word(read_word(pc + offs), v)
+
+        else:
+            raise Z80Error(f"{a} isn't a 16-bit operand")
+        return put
+
+    # Handler factories, one per op name
+
+    def _op_nop(self, entry: OE) -> Handler:
+        R = self.regs
+        length = entry.length
+        cyc = entry.cycles
+
+        def h(pc: int) -> int:
+            R[REG_PC] = (pc + length) & 0xFFFF
+            return cyc
+
+        return h
+
+    def _op_ld(self, entry: OE) -> Handler:
+        R = self.regs
+        P = self.read_pages
+        write = self.write
+        length = entry.length
+        cyc = entry.cycles
+        (dst, dst_offs, _), (src, src_offs, _) = entry.layout
+
+        if dst in REG8_IDX and src in REG8_IDX:
+            d = REG8_IDX[dst]
+            s = REG8_IDX[src]
+
+            def h(pc: int) -> int:
+                R[d] = R[s]
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        elif dst in REG8_IDX and src == OA.Byte:
+            d = REG8_IDX[dst]
+
+            def h(pc: int) -> int:
+                p = pc + src_offs
+                R[d] = P[p >> 10][p & 0x3FF]
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        elif dst in REG8_IDX and src == OA.MemHL:
+            d = REG8_IDX[dst]
+
+            def h(pc: int) -> int:
+                p = R[REG_H] << 8 | R[REG_L]
+                R[d] = P[p >> 10][p & 0x3FF]
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        elif dst == OA.MemHL and src in REG8_IDX:
+            s = REG8_IDX[src]
+
+            def h(pc: int) -> int:
+                write(R[REG_H] << 8 | R[REG_L], R[s])
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        elif (
+            dst in REG_PAIR_IDX
+            or dst in REG16_IDX
+            or src in REG_PAIR_IDX
+            or src in REG16_IDX
+        ):
+            get16 = self._getter16(src, src_offs)
+            put16 = self._setter16(dst, dst_offs)
+
+            def h(pc: int) -> int:
+                put16(pc, get16(pc))
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        else:
+            get = self._getter(src, src_offs)
+            put = self._setter(dst, dst_offs)
+
+            def h(pc: int) -> int:
+                put(pc, get(pc))
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        return h
+
+    def _make_alu(self, name: str) -> Callable[[int], None]:
+        # The 8-bit ops on A, given the other value
+        R = self.regs
+
+        if name == "ADD":
+
+            def alu(v: int) -> None:
+                a = R[REG_A]
+                R[REG_F] = ADD_FLAGS[a << 8 | v]
+                R[REG_A] = (a + v) & 0xFF
+
+        elif name == "ADC":
+
+            def alu(v: int) -> None:
+                a = R[REG_A]
+                c = R[REG_F] & FLAG_C
+                R[REG_F] = ADD_FLAGS[c << 16 | a << 8 | v]
+                R[REG_A] = (a + v + c) & 0xFF
+
+        elif name == "SUB":
+
+            def alu(v: int) -> None:
+                a = R[REG_A]
+                R[REG_F] = SUB_FLAGS[a << 8 | v]
+                R[REG_A] = (a - v) & 0xFF
+
+        elif name == "SBC":
+
+            def alu(v: int) -> None:
+                a = R[REG_A]
+                c = R[REG_F] & FLAG_C
+                R[REG_F] = SUB_FLAGS[c << 16 | a << 8 | v]
+                R[REG_A] = (a - v - c) & 0xFF
+
+        elif name == "AND":
+
+            def alu(v: int) -> None:
+                a = R[REG_A] & v
+                R[REG_A] = a
+                R[REG_F] = SZ53P[a] | FLAG_H
+
+        elif name == "XOR":
+
+            def alu(v: int) -> None:
+                a = R[REG_A] ^ v
+                R[REG_A] = a
+                R[REG_F] = SZ53P[a]
+
+        elif name == "OR":
+
+            def alu(v: int) -> None:
+                a = R[REG_A] | v
+                R[REG_A] = a
+                R[REG_F] = SZ53P[a]
+
+        elif name == "CP":
+
+            def alu(v: int) -> None:
+                # 5 and 3 come from the operand, not the result
+                R[REG_F] = (SUB_FLAGS[R[REG_A] << 8 | v] & ~(FLAG_5 | FLAG_3)) | (
+                    v & (FLAG_5 | FLAG_3)
+                )
+
+        else:
+            raise Z80Error(f"no ALU op {name!r}")
+        return alu
+
+    def _op_alu(self, entry: OE) -> Handler:
+        R = self.regs
+        length = entry.length
+        cyc = entry.cycles
+        dst = entry.layout[0][0]
+        if dst in REG_PAIR_IDX or dst in REG16_IDX:
+            return self._op_alu16(entry)
+
+        alu = self._make_alu(entry.spec.name)
+        src, src_offs, _ = entry.layout[-1]
+        if src in REG8_IDX:
+            s = REG8_IDX[src]
+
+            def h(pc: int) -> int:
+                alu(R[s])
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        else:
+            get = self._getter(src, src_offs)
+
+            def h(pc: int) -> int:
+                alu(get(pc))
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        return h
+
+    def _op_alu16(self, entry: OE) -> Handler:
+        R = self.regs
+        length = entry.length
+        cyc = entry.cycles
+        name = entry.spec.name
+        (dst, dst_offs, _), (src, src_offs, _) = entry.layout
+        if dst in REG16_IDX and src == OA.RegHL:
+            # add ix, ix is DD 29, which is add hl, hl otherwise
+            src = dst
+        get_dst = self._getter16(dst, dst_offs)
+        put_dst = self._setter16(dst, dst_offs)
+        get_src = self._getter16(src, src_offs)
+
+        if name == "ADD":
+
+            def h(pc: int) -> int:
+                a = get_dst(pc)
+                b = get_src(pc)
+                r = a + b
+                R[REG_F] = (
+                    (R[REG_F] & (FLAG_S | FLAG_Z | FLAG_PV))
+                    | ((r >> 8) & (FLAG_5 | FLAG_3))
+                    | (((a ^ b ^ r) >> 8) & FLAG_H)
+                    | (r >> 16)
+                )
+                put_dst(pc, r & 0xFFFF)
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        elif name == "ADC":
+
+            def h(pc: int) -> int:
+                a = get_dst(pc)
+                b = get_src(pc)
+                r = a + b + (R[REG_F] & FLAG_C)
+                R[REG_F] = (
+                    ((r >> 8) & (FLAG_S | FLAG_5 | FLAG_3))
+                    | (0 if r & 0xFFFF else FLAG_Z)
+                    | (((a ^ b ^ r) >> 8) & FLAG_H)
+                    | ((~(a ^ b) & (a ^ r) & 0x8000) >> 13)
+                    | (r >> 16)
+                )
+                put_dst(pc, r & 0xFFFF)
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        elif name == "SBC":
+
+            def h(pc: int) -> int:
+                a = get_dst(pc)
+                b = get_src(pc)
+                r = a - b - (R[REG_F] & FLAG_C)
+                R[REG_F] = (
+                    ((r >> 8) & (FLAG_S | FLAG_5 | FLAG_3))
+                    | (0 if r & 0xFFFF else FLAG_Z)
+                    | (((a ^ b ^ r) >> 8) & FLAG_H)
+                    | (((a ^ b) & (a ^ r) & 0x8000) >> 13)
+                    | FLAG_N
+                    | ((r >> 16) & FLAG_C)
+                )
+                put_dst(pc, r & 0xFFFF)
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        else:
+            raise Z80Error(f"no 16-bit {name!r}")
+        return h
+
+    def _op_inc_dec(self, entry: OE) -> Handler:
+        R = self.regs
+        P = self.read_pages
+        write = self.write
+        length = entry.length
+        cyc = entry.cycles
+        a, offs, _ = entry.layout[0]
+        step = 1 if entry.spec.name == "INC" else -1
+        flags = INC_FLAGS if step == 1 else DEC_FLAGS
+
+        if a in REG8_IDX:
+            idx = REG8_IDX[a]
+
+            def h(pc: int) -> int:
+                r = (R[idx] + step) & 0xFF
+                R[idx] = r
+                R[REG_F] = (R[REG_F] & FLAG_C) | flags[r]
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        elif a in REG_PAIR_IDX:
+            # Flags stay as they are for 16-bit ones
+            hi, lo = REG_PAIR_IDX[a]
+
+            def h(pc: int) -> int:
+                r = ((R[hi] << 8 | R[lo]) + step) & 0xFFFF
+                R[hi] = r >> 8
+                R[lo] = r & 0xFF
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        elif a in REG16_IDX:
+            idx = REG16_IDX[a]
+
+            def h(pc: int) -> int:
+                R[idx] = (R[idx] + step) & 0xFFFF
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        else:
+            addr = self._addr_of(a, offs)
+
+            def h(pc: int) -> int:
+                p = addr(pc)
+                r = (P[p >> 10][p & 0x3FF] + step) & 0xFF
+                write(p, r)
+                R[REG_F] = (R[REG_F] & FLAG_C) | flags[r]
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        return h
+
+    def _op_rotate_a(self, entry: OE) -> Handler:
+        # RLCA/RRCA/RLA/RRA, which unlike the CB ones leave S, Z and P/V alone
+        R = self.regs
+        length = entry.length
+        cyc = entry.cycles
+        shift = SHIFTS[entry.spec.name[:-1]]
+
+        def h(pc: int) -> int:
+            f = R[REG_F]
+            x = shift(R[REG_A], f)
+            r = x & 0xFF
+            R[REG_A] = r
+            R[REG_F] = (
+                (f & (FLAG_S | FLAG_Z | FLAG_PV)) | (r & (FLAG_5 | FLAG_3)) | (x >> 8)
+            )
+            R[REG_PC] = (pc + length) & 0xFFFF
+            return cyc
+
+        return h
+
+    def _op_misc_a(self, entry: OE) -> Handler:
+        # DAA, CPL, SCF, CCF and NEG
+        R = self.regs
+        length = entry.length
+        cyc = entry.cycles
+        name = entry.spec.name
+
+        def daa() -> None:
+            a = R[REG_A]
+            f = R[REG_F]
+            corr = 0
+            carry = f & FLAG_C
+            if f & FLAG_H or (a & 0x0F) > 9:
+                corr |= 0x06
+            if carry or a > 0x99:
+                corr |= 0x60
+                carry = FLAG_C
+            if f & FLAG_N:
+                r = (a - corr) & 0xFF
+                half = FLAG_H if f & FLAG_H and (a & 0x0F) < 6 else 0
+            else:
+                r = (a + corr) & 0xFF
+                half = FLAG_H if (a & 0x0F) > 9 else 0
+            R[REG_A] = r
+            R[REG_F] = SZ53P[r] | half | (f & FLAG_N) | carry
+
+        def cpl() -> None:
+            r = R[REG_A] ^ 0xFF
+            R[REG_A] = r
+            R[REG_F] = (
+                (R[REG_F] & (FLAG_S | FLAG_Z | FLAG_PV | FLAG_C))
+                | FLAG_H
+                | FLAG_N
+                | (r & (FLAG_5 | FLAG_3))
+            )
+
+        def scf() -> None:
+            R[REG_F] = (
+                (R[REG_F] & (FLAG_S | FLAG_Z | FLAG_PV))
+                | FLAG_C
+                | (R[REG_A] & (FLAG_5 | FLAG_3))
+            )
+
+        def ccf() -> None:
+            f = R[REG_F]
+            R[REG_F] = (
+                (f & (FLAG_S | FLAG_Z | FLAG_PV))
+                | ((f & FLAG_C) << 4)
+                | ((f & FLAG_C) ^ FLAG_C)
+                | (R[REG_A] & (FLAG_5 | FLAG_3))
+            )
+
+        def neg() -> None:
+            a = R[REG_A]
+            R[REG_F] = SUB_FLAGS[a]
+            R[REG_A] = (-a) & 0xFF
+
+        op = {"DAA": daa, "CPL": cpl, "SCF": scf, "CCF": ccf, "NEG": neg}[name]
+
+        def h(pc: int) -> int:
+            op()
+            R[REG_PC] = (pc + length) & 0xFFFF
+            return cyc
+
+        return h
+
+    def _op_ex(self, entry: OE) -> Handler:
+        R = self.regs
+        length = entry.length
+        cyc = entry.cycles
+        first = entry.layout[0][0]
+
+        if first == OA.RegAF:
+
+            def h(pc: int) -> int:
+                R[REG_F], R[REG_A], R[REG_SHADOW + REG_F], R[REG_SHADOW + REG_A] = (
+                    R[REG_SHADOW + REG_F],
+                    R[REG_SHADOW + REG_A],
+                    R[REG_F],
+                    R[REG_A],
+                )
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        else:
+
+            def h(pc: int) -> int:
+                R[REG_D], R[REG_E], R[REG_H], R[REG_L] = (
+                    R[REG_H],
+                    R[REG_L],
+                    R[REG_D],
+                    R[REG_E],
+                )
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        return h
+
+    def _op_exx(self, entry: OE) -> Handler:
+        R = self.regs
+        length = entry.length
+        cyc = entry.cycles
+
+        def h(pc: int) -> int:
+            R[REG_B : REG_L + 1], R[REG_SHADOW + REG_B : REG_SHADOW + REG_L + 1] = (
+                R[REG_SHADOW + REG_B : REG_SHADOW + REG_L + 1],
+                R[REG_B : REG_L + 1],
+            )
+            R[REG_PC] = (pc + length) & 0xFFFF
+            return cyc
+
+        return h
+
+    def _op_jp(self, entry: OE) -> Handler:
+        R = self.regs
+        read_word = self.read_word
+        length = entry.length
+        cyc = entry.cycles
+        first = entry.layout[0][0]
+        offs = entry.layout[-1][1]
+
+        if first == OA.MemHL:
+
+            def h(pc: int) -> int:
+                R[REG_PC] = R[REG_H] << 8 | R[REG_L]
+                return cyc
+
+        elif first in COND_FLAGS:
+            mask, want = COND_FLAGS[first]
+
+            def h(pc: int) -> int:
+                if R[REG_F] & mask == want:
+                    R[REG_PC] = read_word(pc + offs)
+                else:
+                    R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        else:
+
+            def h(pc: int) -> int:
+                R[REG_PC] = read_word(pc + offs)
+                return cyc
+
+        return h
+
+    def _op_jr(self, entry: OE) -> Handler:
+        R = self.regs
+        P = self.read_pages
+        length = entry.length
+        cyc = entry.cycles
+        cyc_taken = entry.cycles_taken
+        first = entry.layout[0][0]
+        offs = entry.layout[-1][1]
+
+        if entry.spec.name == "DJNZ":
+
+            def h(pc: int) -> int:
+                b = (R[REG_B] - 1) & 0xFF
+                R[REG_B] = b
+                if b:
+                    p = pc + offs
+                    R[REG_PC] = (pc + length + S8[P[p >> 10][p & 0x3FF]]) & 0xFFFF
+                    return cyc_taken
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        elif first in COND_FLAGS:
+            mask, want = COND_FLAGS[first]
+
+            def h(pc: int) -> int:
+                if R[REG_F] & mask == want:
+                    p = pc + offs
+                    R[REG_PC] = (pc + length + S8[P[p >> 10][p & 0x3FF]]) & 0xFFFF
+                    return cyc_taken
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        else:
+
+            def h(pc: int) -> int:
+                p = pc + offs
+                R[REG_PC] = (pc + length + S8[P[p >> 10][p & 0x3FF]]) & 0xFFFF
+                return cyc
+
+        return h
+
+    def _op_call(self, entry: OE) -> Handler:
+        R = self.regs
+        read_word = self.read_word
+        write_word = self.write_word
+        length = entry.length
+        cyc = entry.cycles
+        cyc_taken = entry.cycles_taken
+        first = entry.layout[0][0]
+        offs = entry.layout[-1][1]
+        mask, want = COND_FLAGS.get(first, (0, 0))
+
+        def h(pc: int) -> int:
+            if R[REG_F] & mask == want:
+                sp = (R[REG_SP] - 2) & 0xFFFF
+                R[REG_SP] = sp
+                write_word(sp, (pc + length) & 0xFFFF)
+                R[REG_PC] = read_word(pc + offs)
+                return cyc_taken
+            R[REG_PC] = (pc + length) & 0xFFFF
+            return cyc
+
+        return h
+
+    def _op_rst(self, entry: OE) -> Handler:
+        R = self.regs
+        write_word = self.write_word
+        length = entry.length
+        cyc = entry.cycles
+        target = OA_MAP_CONST_ADDR[entry.layout[0][0]]
+
+        def h(pc: int) -> int:
+            sp = (R[REG_SP] - 2) & 0xFFFF
+            R[REG_SP] = sp
+            write_word(sp, (pc + length) & 0xFFFF)
+            R[REG_PC] = target
+            return cyc
+
+        return h
+
+    def _op_ret(self, entry: OE) -> Handler:
+        R = self.regs
+        read_word = self.read_word
+        length = entry.length
+        cyc = entry.cycles
+        cyc_taken = entry.cycles_taken
+        mask, want = (
+            COND_FLAGS[entry.layout[0][0]] if len(entry.layout) >= 1 else (0, 0)
+        )
+
+        def h(pc: int) -> int:
+            if R[REG_F] & mask == want:
+                sp = R[REG_SP]
+                R[REG_PC] = read_word(sp)
+                R[REG_SP] = (sp + 2) & 0xFFFF
+                return cyc_taken
+            R[REG_PC] = (pc + length) & 0xFFFF
+            return cyc
+
+        return h
+
+    def _op_push_pop(self, entry: OE) -> Handler:
+        R = self.regs
+        length = entry.length
+        cyc = entry.cycles
+        get16 = self._getter16(entry.layout[0][0], 0)
+        put16 = self._setter16(entry.layout[0][0], 0)
+        read_word = self.read_word
+        write_word = self.write_word
+
+        if entry.spec.name == "PUSH":
+
+            def h(pc: int) -> int:
+                sp = (R[REG_SP] - 2) & 0xFFFF
+                R[REG_SP] = sp
+                write_word(sp, get16(pc))
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        else:
+
+            def h(pc: int) -> int:
+                sp = R[REG_SP]
+                put16(pc, read_word(sp))
+                R[REG_SP] = (sp + 2) & 0xFFFF
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        return h
+
+    def _op_interrupts(self, entry: OE) -> Handler:
+        # DI, EI, IM and HALT
+        R = self.regs
+        P = self.read_pages
+        length = entry.length
+        cyc = entry.cycles
+        name = entry.spec.name
+
+        if name == "DI":
+
+            def h(pc: int) -> int:
+                self.iff1 = False
+                self.iff2 = False
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        elif name == "EI":
+
+            def h(pc: int) -> int:
+                # Interrupts only come in after the next op,
+                # so just do that one now as well.
+                self.iff1 = True
+                self.iff2 = True
+                pc = (pc + length) & 0xFFFF
+                R[REG_PC] = pc
+                return cyc + self.table_xx[P[pc >> 10][pc & 0x3FF]](pc)
+
+        elif name == "IM":
+            mode = OA_CONST_0_7.index(entry.layout[0][0])
+
+            def h(pc: int) -> int:
+                self.im = mode
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        elif name == "HALT":
+
+            def h(pc: int) -> int:
+                self.halted = True
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc + HALT_IDLE
+
+        else:
+            raise Z80Error(f"no interrupt op {name!r}")
+        return h
+
+    def _op_in_out(self, entry: OE) -> Handler:
+        R = self.regs
+        P = self.read_pages
+        port_in = self.port_in
+        port_out = self.port_out
+        length = entry.length
+        cyc = entry.cycles
+
+        if entry.spec.name == "IN":
+            offs = entry.layout[1][1]
+
+            def h(pc: int) -> int:
+                p = pc + offs
+                R[REG_A] = port_in(P[p >> 10][p & 0x3FF])
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        else:
+            offs = entry.layout[0][1]
+
+            def h(pc: int) -> int:
+                p = pc + offs
+                port_out(P[p >> 10][p & 0x3FF], R[REG_A])
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        return h
+
+    def _op_block(self, entry: OE) -> Handler:
+        # LDI/LDIR and OUTI/OTIR. The repeating ones go around by leaving PC where it is.
+        R = self.regs
+        P = self.read_pages
+        write = self.write
+        port_out = self.port_out
+        length = entry.length
+        cyc = entry.cycles
+        cyc_taken = entry.cycles_taken
+        name = entry.spec.name
+        repeat = name in {"LDIR", "OTIR"}
+
+        if name in {"LDI", "LDIR"}:
+
+            def h(pc: int) -> int:
+                hl = R[REG_H] << 8 | R[REG_L]
+                de = R[REG_D] << 8 | R[REG_E]
+                v = P[hl >> 10][hl & 0x3FF]
+                write(de, v)
+                hl = (hl + 1) & 0xFFFF
+                de = (de + 1) & 0xFFFF
+                bc = ((R[REG_B] << 8 | R[REG_C]) - 1) & 0xFFFF
+                R[REG_H] = hl >> 8
+                R[REG_L] = hl & 0xFF
+                R[REG_D] = de >> 8
+                R[REG_E] = de & 0xFF
+                R[REG_B] = bc >> 8
+                R[REG_C] = bc & 0xFF
+                n = v + R[REG_A]
+                R[REG_F] = (
+                    (R[REG_F] & (FLAG_S | FLAG_Z | FLAG_C))
+                    | (FLAG_PV if bc else 0)
+                    | (n & FLAG_3)
+                    | ((n << 4) & FLAG_5)
+                )
+                if repeat and bc:
+                    R[REG_PC] = pc
+                    return cyc_taken
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        else:
+
+            def h(pc: int) -> int:
+                hl = R[REG_H] << 8 | R[REG_L]
+                v = P[hl >> 10][hl & 0x3FF]
+                b = (R[REG_B] - 1) & 0xFF
+                R[REG_B] = b
+                port_out(R[REG_C], v)
+                hl = (hl + 1) & 0xFFFF
+                R[REG_H] = hl >> 8
+                R[REG_L] = hl & 0xFF
+                R[REG_F] = SZ53[b] | (FLAG_N if v & 0x80 else 0)
+                if repeat and b:
+                    R[REG_PC] = pc
+                    return cyc_taken
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        return h
+
+    def _op_shift(self, entry: OE) -> Handler:
+        R = self.regs
+        P = self.read_pages
+        write = self.write
+        length = entry.length
+        cyc = entry.cycles
+        shift = SHIFTS[entry.spec.name]
+        a, offs, _ = entry.layout[0]
+
+        if a in REG8_IDX:
+            idx = REG8_IDX[a]
+
+            def h(pc: int) -> int:
+                x = shift(R[idx], R[REG_F])
+                r = x & 0xFF
+                R[idx] = r
+                R[REG_F] = SZ53P[r] | (x >> 8)
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        else:
+            addr = self._addr_of(a, offs)
+
+            def h(pc: int) -> int:
+                p = addr(pc)
+                x = shift(P[p >> 10][p & 0x3FF], R[REG_F])
+                r = x & 0xFF
+                write(p, r)
+                R[REG_F] = SZ53P[r] | (x >> 8)
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        return h
+
+    def _op_bit(self, entry: OE) -> Handler:
+        R = self.regs
+        length = entry.length
+        cyc = entry.cycles
+        (bit_a, _, _), (a, offs, _) = entry.layout
+        bit_idx = OA_CONST_0_7.index(bit_a)
+        mask = 1 << bit_idx
+        get = self._getter(a, offs)
+        set_flags = FLAG_H | (FLAG_S if bit_idx == 7 else 0)
+
+        def h(pc: int) -> int:
+            v = get(pc)
+            f = (R[REG_F] & FLAG_C) | (v & (FLAG_5 | FLAG_3))
+            if v & mask:
+                R[REG_F] = f | set_flags
+            else:
+                R[REG_F] = f | FLAG_H | FLAG_Z | FLAG_PV
+            R[REG_PC] = (pc + length) & 0xFFFF
+            return cyc
+
+        return h
+
+    def _op_res_set(self, entry: OE) -> Handler:
+        R = self.regs
+        P = self.read_pages
+        write = self.write
+        length = entry.length
+        cyc = entry.cycles
+        (bit_a, _, _), (a, offs, _) = entry.layout
+        bit = 1 << OA_CONST_0_7.index(bit_a)
+        is_set = entry.spec.name == "SET"
+        keep = 0xFF if is_set else 0xFF ^ bit
+        add = bit if is_set else 0
+
+        if a in REG8_IDX:
+            idx = REG8_IDX[a]
+
+            def h(pc: int) -> int:
+                R[idx] = (R[idx] & keep) | add
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        else:
+            addr = self._addr_of(a, offs)
+
+            def h(pc: int) -> int:
+                p = addr(pc)
+                write(p, (P[p >> 10][p & 0x3FF] & keep) | add)
+                R[REG_PC] = (pc + length) & 0xFFFF
+                return cyc
+
+        return h
+
+    _factories: dict[str, Callable[[Z80Cpu, OE], Handler]] = {
+        "NOP": _op_nop,
+        "LD": _op_ld,
+        "ADD": _op_alu,
+        "ADC": _op_alu,
+        "SUB": _op_alu,
+        "SBC": _op_alu,
+        "AND": _op_alu,
+        "XOR": _op_alu,
+        "OR": _op_alu,
+        "CP": _op_alu,
+        "INC": _op_inc_dec,
+        "DEC": _op_inc_dec,
+        "RLCA": _op_rotate_a,
+        "RRCA": _op_rotate_a,
+        "RLA": _op_rotate_a,
+        "RRA": _op_rotate_a,
+        "DAA": _op_misc_a,
+        "CPL": _op_misc_a,
+        "SCF": _op_misc_a,
+        "CCF": _op_misc_a,
+        "NEG": _op_misc_a,
+        "EX": _op_ex,
+        "EXX": _op_exx,
+        "JP": _op_jp,
+        "JR": _op_jr,
+        "DJNZ": _op_jr,
+        "CALL": _op_call,
+        "RST": _op_rst,
+        "RET": _op_ret,
+        "PUSH": _op_push_pop,
+        "POP": _op_push_pop,
+        "DI": _op_interrupts,
+        "EI": _op_interrupts,
+        "IM": _op_interrupts,
+        "HALT": _op_interrupts,
+        "IN": _op_in_out,
+        "OUT": _op_in_out,
+        "LDI": _op_block,
+        "LDIR": _op_block,
+        "OUTI": _op_block,
+        "OTIR": _op_block,
+        "RLC": _op_shift,
+        "RRC": _op_shift,
+        "RL": _op_shift,
+        "RR": _op_shift,
+        "SLA": _op_shift,
+        "SRA": _op_shift,
+        "SRL": _op_shift,
+        "BIT": _op_bit,
+        "RES": _op_res_set,
+        "SET": _op_res_set,
+    }
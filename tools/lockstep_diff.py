@@ -0,0 +1,190 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import os.path
+import sys
+import time
+
+from typing import (
+    Optional,
+)
+
+from dislib.annotparser import read_annot_file
+from emulib.checkpoint import (
+    CheckpointFile,
+    checkpoint_key,
+    load_checkpoint_file,
+)
+from emulib.inputscript import (
+    InputScript,
+    read_input_script,
+)
+from emulib.ramlabels import (
+    RAM_START,
+    RamLabelMap,
+)
+from emulib.replay import ReplayRunner
+from emulib.z80cpu import REG_PC
+
+DEFAULT_ROMS = ["out/s1.sms", "out/diets1.sms"]
+# Scratch space, which doesn't have to match between frames
+DEFAULT_IGNORE = ["tmp_"]
+
+
+def make_runner(
+    *, rom_fname: str, script: InputScript, checkpoint_dir: Optional[str], every: int
+) -> tuple[ReplayRunner, Optional[str], Optional[CheckpointFile]]:
+    with open(rom_fname, "rb") as infp:
+        rom = infp.read()
+    checkpoints_fname = None
+    checkpoints = None
+    if checkpoint_dir is not None:
+        base = os.path.splitext(os.path.basename(rom_fname))[0]
+        checkpoints_fname = os.path.join(checkpoint_dir, base + ".ckpt")
+        checkpoints = load_checkpoint_file(
+            file_name=checkpoints_fname, key=checkpoint_key(rom=rom)
+        )
+    runner = ReplayRunner(
+        rom=rom, script=script, checkpoints=checkpoints, interval=every
+    )
+    return (runner, checkpoints_fname, checkpoints)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Run two ROMs side by side with the same inputs, and stop at the first frame where the labelled RAM differs."
+    )
+    parser.add_argument(
+        "--input",
+        metavar="SCRIPT",
+        help="what to hold on joypad 1 and when, see emulib/inputscript.py (default: nothing)",
+    )
+    parser.add_argument(
+        "--frames",
+        type=int,
+        default=7200,
+        help="frames to run for (default: 7200, 2 minutes of game time)",
+    )
+    parser.add_argument(
+        "--start",
+        metavar="FRAME",
+        type=int,
+        default=0,
+        help="frame to start comparing at, e.g. one an earlier run got past (default: 0)",
+    )
+    parser.add_argument(
+        "--checkpoints",
+        metavar="DIR",
+        help="keep checkpoints for each ROM in here, so --start doesn't have to run from reset",
+    )
+    parser.add_argument(
+        "--every",
+        metavar="N",
+        type=int,
+        default=600,
+        help="frames between checkpoints (default: 600)",
+    )
+    parser.add_argument(
+        "--ignore",
+        metavar="PREFIX",
+        action="append",
+        help=f"don't compare labels starting with this, can be given more than once (default: {', '.join(DEFAULT_IGNORE)})",
+    )
+    parser.add_argument(
+        "--max-diffs",
+        metavar="N",
+        type=int,
+        default=40,
+        help="how many differing bytes to show (default: 40)",
+    )
+    parser.add_argument(
+        "--annot",
+        metavar="CFG",
+        default="annot/sonic1.cfg",
+        help="where the RAM labels come from (default: annot/sonic1.cfg)",
+    )
+    parser.add_argument(
+        "roms",
+        nargs="*",
+        help=f"the two ROMs to compare (default: {' '.join(DEFAULT_ROMS)})",
+    )
+    args = parser.parse_args()
+    input_fname: Optional[str] = args.input
+    frames: int = args.frames
+    start_frame: int = args.start
+    checkpoint_dir: Optional[str] = args.checkpoints
+    every: int = args.every
+    ignore_prefixes: list[str] = args.ignore or DEFAULT_IGNORE
+    max_diffs: int = args.max_diffs
+    annot_fname: str = args.annot
+    rom_fnames: list[str] = args.roms or DEFAULT_ROMS
+    if len(rom_fnames) != 2:
+        parser.error("give exactly two ROMs")
+
+    ram_labels = RamLabelMap(
+        records=read_annot_file(annot_fname), ignore_prefixes=ignore_prefixes
+    )
+    print(
+        f"Comparing {ram_labels.labelled_size()} labelled bytes of RAM in {len(ram_labels.ranges)} ranges"
+    )
+
+    if input_fname is not None:
+        script = read_input_script(input_fname)
+    else:
+        script = InputScript(changes=[])
+
+    runners = [
+        make_runner(
+            rom_fname=rom_fname,
+            script=script,
+            checkpoint_dir=checkpoint_dir,
+            every=every,
+        )
+        for rom_fname in rom_fnames
+    ]
+    runner_a = runners[0][0]
+    runner_b = runners[1][0]
+    ram_a = runner_a.machine.memory.ram
+    ram_b = runner_b.machine.memory.ram
+
+    start_time = time.perf_counter()
+    for runner, _, _ in runners:
+        runner.seek(start_frame)
+
+    diffs: list[int] = ram_labels.differences(ram_a, ram_b)
+    while not diffs and runner_a.frame < frames:
+        runner_a.run_frame()
+        runner_b.run_frame()
+        diffs = ram_labels.differences(ram_a, ram_b)
+    end_time = time.perf_counter()
+
+    for _, checkpoints_fname, checkpoints in runners:
+        if checkpoints is not None and checkpoints_fname is not None:
+            checkpoints.save(file_name=checkpoints_fname)
+
+    frame = runner_a.frame
+    print(f"Ran frames {start_frame} to {frame} in {end_time - start_time:.2f}s")
+    if not diffs:
+        print("No differences")
+        return
+
+    name_a, name_b = [os.path.basename(rom_fname) for rom_fname in rom_fnames]
+    print(f"Labelled RAM differs after frame {frame}, {len(diffs)} bytes:")
+    print(
+        f"  PC {name_a} ${runner_a.machine.cpu.regs[REG_PC]:04X}, {name_b} ${runner_b.machine.cpu.regs[REG_PC]:04X}"
+    )
+    width = max(len(ram_labels.format_offs(offs)) for offs in diffs[:max_diffs])
+    print(f"  {'':5s} {'':{width}s}  {name_a:>12s} {name_b:>12s}")
+    for offs in diffs[:max_diffs]:
+        print(
+            f"  ${RAM_START + offs:04X} {ram_labels.format_offs(offs):<{width}s}"
+            f"  {'$' + format(ram_a[offs], '02X'):>12s} {'$' + format(ram_b[offs], '02X'):>12s}"
+        )
+    if len(diffs) > max_diffs:
+        print(f"  ... and {len(diffs) - max_diffs} more")
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
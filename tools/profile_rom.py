@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import zlib
+
+from typing import (
+    Optional,
+)
+
+from dislib.analysiscache import analysis_cache_key
+from dislib.annotparser import read_annot_file
+from dislib.heatmap import write_heat_map
+from dislib.rom import Rom
+from emulib.machine import (
+    CYCLES_PER_FRAME,
+    SmsMachine,
+)
+from emulib.profiler import (
+    ExecutionProfile,
+    ProfileRow,
+    flat_profile,
+    rom_routine_map,
+)
+
+
+def format_row(row: ProfileRow, *, total_cycles: int, width: int) -> str:
+    addr = f"{row.phys_addr:05X}" if row.phys_addr is not None else "-----"
+    return (
+        f"{row.name:<{width}s} {addr}"
+        f" {row.cycles:12d}T"
+        f" {100.0 * row.cycles / max(1, total_cycles):7.2f}%"
+        f" {row.ops:10d} ops"
+        f" {row.calls:8d} calls"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Run a ROM in the emulator and count where the T-states went, by routine and by op."
+    )
+    parser.add_argument(
+        "--cache",
+        metavar="FILE",
+        help="reuse the traced ROM state from rom_unpack.py --cache, if it's up to date",
+    )
+    parser.add_argument(
+        "--frames",
+        type=int,
+        default=600,
+        help="frames to run from reset (default: 600, 10 seconds of game time)",
+    )
+    parser.add_argument(
+        "--top",
+        metavar="N",
+        type=int,
+        default=40,
+        help="how many of the busiest routines to list (default: 40)",
+    )
+    parser.add_argument(
+        "--flat",
+        metavar="TSV_FILE",
+        help="write every routine's counts here, tab separated",
+    )
+    parser.add_argument(
+        "--heat",
+        metavar="JSON_FILE",
+        help="write counts for each op here, for rom_unpack.py --heat",
+    )
+    parser.add_argument("rom_fname")
+    parser.add_argument("annot_fname")
+    args = parser.parse_args()
+    rom_fname: str = args.rom_fname
+    annot_fname: str = args.annot_fname
+    cache_fname: Optional[str] = args.cache
+    frames: int = args.frames
+    top: int = args.top
+    flat_fname: Optional[str] = args.flat
+    heat_fname: Optional[str] = args.heat
+
+    rom_data = open(rom_fname, "rb").read()
+    assert len(rom_data) == Rom.bank_count * Rom.bank_size
+    if (zlib.crc32(rom_data) & 0xFFFFFFFF) != Rom.rom_crc:
+        # It'll still run, but the labels are for the original layout.
+        print(
+            f"WARNING: {rom_fname} isn't the original ROM, so the routine names may be wrong"
+        )
+    rom = Rom(data=rom_data)
+
+    annot_records = read_annot_file(annot_fname)
+    if not (
+        cache_fname is not None
+        and rom.load_analysis(file_name=cache_fname, key=analysis_cache_key(rom=rom))
+        and rom.annot_lines == [record.text for record in annot_records]
+    ):
+        rom = Rom(data=rom_data)
+        rom.apply_annotations(annot_records, file_name=annot_fname)
+        rom.run_tracer()
+
+    machine = SmsMachine(rom=rom_data)
+    profile = ExecutionProfile(memory=machine.memory)
+    machine.cpu.profile = profile
+    for _ in range(frames):
+        machine.run_frame()
+
+    cpu = machine.cpu
+    total_cycles = profile.total_cycles()
+    rows = flat_profile(profile, rom_routine_map(rom))
+    print(
+        f"{frames} frames, {cpu.op_count} ops, {total_cycles}T not halted"
+        f" ({100.0 * total_cycles / (frames * CYCLES_PER_FRAME):.1f}% of the time)"
+    )
+    print()
+    ranked = rows[:top]
+    width = max([len(row.name) for row in ranked], default=0)
+    print(f"Top {len(ranked)} routines by T-states, not counting what they call:")
+    for row in ranked:
+        print(format_row(row, total_cycles=total_cycles, width=width))
+
+    if flat_fname is not None:
+        with open(flat_fname, "w") as outfp:
+            outfp.write("name\taddr\tcycles\tops\tcalls\n")
+            for row in rows:
+                addr = f"{row.phys_addr:05X}" if row.phys_addr is not None else ""
+                outfp.write(
+                    f"{row.name}\t{addr}\t{row.cycles}\t{row.ops}\t{row.calls}\n"
+                )
+
+    if heat_fname is not None:
+        write_heat_map(heat_fname, profile.heat_map(frames=frames))
+
+
+if __name__ == "__main__":
+    main()
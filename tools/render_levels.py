@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import os.path
+import time
+
+from concurrent.futures import ProcessPoolExecutor
+from typing import (
+    Optional,
+)
+
+import numpy as np
+import numpy.typing as npt
+
+from dislib.fileio import write_if_changed
+from edlib.leveldata import (
+    METATILE_COUNT,
+    LevelData,
+    read_level_data,
+    read_level_headers,
+)
+from emulib.pngfile import encode_png
+from emulib.vdp import VRAM_SIZE
+from emulib.vdprender import (
+    decode_cram,
+    decode_tiles,
+)
+
+# Bump this if the renders change in a way the code hash won't catch.
+RENDER_FORMAT_VERSION = 1
+CACHE_FNAME = "render_levels.json"
+# Whatever changes how a level gets drawn
+HASHED_SOURCES = [
+    "render_levels.py",
+    "edlib/leveldata.py",
+    "emulib/pngfile.py",
+    "emulib/vdprender.py",
+]
+
+
+def render_code_hash() -> str:
+    h = hashlib.sha256()
+    for fname in HASHED_SOURCES:
+        h.update(fname.encode("utf-8") + b"\x00")
+        with open(os.path.join(os.path.dirname(__file__), fname), "rb") as infp:
+            h.update(infp.read())
+    return h.hexdigest()
+
+
+def level_key(level: LevelData, *, code_hash: str) -> str:
+    h = hashlib.sha256()
+    h.update(f"v{RENDER_FORMAT_VERSION}\x00".encode("utf-8"))
+    h.update(code_hash.encode("utf-8"))
+    h.update(f"{level.width}x{level.height}\x00".encode("utf-8"))
+    for blob in [level.layout, level.tilemap, level.palette, level.art0]:
+        h.update(hashlib.sha256(blob).digest())
+    return h.hexdigest()
+
+
+def render_level(level: LevelData) -> npt.NDArray[np.uint8]:
+    # The whole map, a 32x32 pixel metatile for each layout byte.
+    # The level art only ever uses the first 256 tiles, with palette 0 and no flips.
+    vram = level.art0[:VRAM_SIZE].ljust(VRAM_SIZE, b"\x00")
+    tiles = decode_tiles(vram)
+    # (metatile, ty, tx) to (metatile, ty, y, tx, x), then metatile pixels
+    tilemap = np.frombuffer(level.tilemap, dtype=np.uint8).reshape(METATILE_COUNT, 4, 4)
+    metatiles = tiles[tilemap].transpose(0, 1, 3, 2, 4).reshape(METATILE_COUNT, 32, 32)
+
+    layout = np.frombuffer(
+        level.layout, dtype=np.uint8, count=level.width * level.height
+    ).reshape(level.height, level.width)
+    pixels = metatiles[layout].transpose(0, 2, 1, 3)
+    pixels = pixels.reshape(level.height * 32, level.width * 32)
+    rgb: npt.NDArray[np.uint8] = decode_cram(level.palette)[pixels]
+    return rgb
+
+
+def render_level_png(level: LevelData) -> bytes:
+    return encode_png(render_level(level))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Render the whole map of every level in a ROM to PNGs, skipping ones that haven't changed since last time."
+    )
+    parser.add_argument(
+        "--out",
+        metavar="DIR",
+        default="build/levels",
+        help="where to put the PNGs and the cache (default: build/levels)",
+    )
+    parser.add_argument(
+        "--jobs",
+        metavar="N",
+        type=int,
+        help="number of processes to render with (default: one per CPU)",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="render every level even if the cache says it's up to date",
+    )
+    parser.add_argument("rom_fname")
+    args = parser.parse_args()
+    out_dir: str = args.out
+    jobs: Optional[int] = args.jobs
+    force: bool = args.force
+    rom_fname: str = args.rom_fname
+
+    with open(rom_fname, "rb") as infp:
+        rom = infp.read()
+
+    start_time = time.perf_counter()
+    code_hash = render_code_hash()
+    # (PNG file name, level, key)
+    levels: list[tuple[str, LevelData, str]] = []
+    for level_idx, header in enumerate(read_level_headers(rom)):
+        if header is None:
+            continue
+        level = read_level_data(rom, header)
+        levels.append(
+            (f"level_{level_idx:02X}.png", level, level_key(level, code_hash=code_hash))
+        )
+
+    os.makedirs(out_dir, exist_ok=True)
+    cache_fname = os.path.join(out_dir, CACHE_FNAME)
+    cache: dict[str, str] = {}
+    if not force:
+        try:
+            with open(cache_fname, "r") as infp:
+                cache = json.load(infp)
+        except FileNotFoundError:
+            pass
+
+    stale = [
+        (png_fname, level, key)
+        for png_fname, level, key in levels
+        if cache.get(png_fname) != key
+        or not os.path.exists(os.path.join(out_dir, png_fname))
+    ]
+    stale_levels = [level for _, level, _ in stale]
+    if jobs == 1:
+        pngs = [render_level_png(level) for level in stale_levels]
+    else:
+        with ProcessPoolExecutor(
+            max_workers=jobs, mp_context=multiprocessing.get_context("fork")
+        ) as pool:
+            pngs = list(pool.map(render_level_png, stale_levels))
+
+    for (png_fname, level, key), png in zip(stale, pngs):
+        write_if_changed(os.path.join(out_dir, png_fname), png)
+        cache[png_fname] = key
+        print(f"wrote {png_fname!r}, {level.width}x{level.height} metatiles")
+    write_if_changed(
+        cache_fname,
+        (json.dumps(cache, indent=1, sort_keys=True) + "\n").encode("utf-8"),
+    )
+    end_time = time.perf_counter()
+    print(
+        f"Rendered {len(stale)} of {len(levels)} levels in {end_time - start_time:.2f}s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import hashlib
+import time
+
+from typing import (
+    Optional,
+)
+
+from emulib.checkpoint import (
+    checkpoint_key,
+    load_checkpoint_file,
+)
+from emulib.inputscript import (
+    InputScript,
+    read_input_script,
+)
+from emulib.replay import ReplayRunner
+
+
+def state_line(runner: ReplayRunner) -> str:
+    machine = runner.machine
+    ram_hash = hashlib.sha1(machine.memory.ram).hexdigest()[:16]
+    vram_hash = hashlib.sha1(machine.vdp.vram).hexdigest()[:16]
+    return (
+        f"frame {runner.frame}"
+        f" demo {'on ' if runner.demo_playing() else 'off'}"
+        f" inputs ${runner.game_inputs():02X}"
+        f" ram {ram_hash} vram {vram_hash}"
+    )
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Replay an input script on a ROM, resuming from saved checkpoints where it can."
+    )
+    parser.add_argument(
+        "--input",
+        metavar="SCRIPT",
+        help="what to hold on joypad 1 and when, see emulib/inputscript.py (default: nothing)",
+    )
+    parser.add_argument(
+        "--frames",
+        type=int,
+        default=1800,
+        help="frame to run up to (default: 1800, 30 seconds of game time)",
+    )
+    parser.add_argument(
+        "--checkpoints",
+        metavar="FILE",
+        help="resume from the nearest checkpoint in here, and add new ones as it goes",
+    )
+    parser.add_argument(
+        "--every",
+        metavar="N",
+        type=int,
+        default=600,
+        help="frames between checkpoints (default: 600)",
+    )
+    parser.add_argument(
+        "--log",
+        metavar="FILE",
+        help="write the demo flag, inputs and RAM/VRAM hashes at the end of every frame here",
+    )
+    parser.add_argument(
+        "--ram-out", metavar="FILE", help="write the 8 KB of RAM here at the end"
+    )
+    parser.add_argument(
+        "--screenshot",
+        metavar="PNG",
+        help="render the screen at the end to a PNG (needs numpy)",
+    )
+    parser.add_argument("rom_fname")
+    args = parser.parse_args()
+    rom_fname: str = args.rom_fname
+    input_fname: Optional[str] = args.input
+    frames: int = args.frames
+    checkpoints_fname: Optional[str] = args.checkpoints
+    every: int = args.every
+    log_fname: Optional[str] = args.log
+    ram_out_fname: Optional[str] = args.ram_out
+    screenshot_fname: Optional[str] = args.screenshot
+
+    with open(rom_fname, "rb") as infp:
+        rom = infp.read()
+    if input_fname is not None:
+        script = read_input_script(input_fname)
+    else:
+        script = InputScript(changes=[])
+
+    checkpoints = None
+    if checkpoints_fname is not None:
+        checkpoints = load_checkpoint_file(
+            file_name=checkpoints_fname, key=checkpoint_key(rom=rom)
+        )
+    runner = ReplayRunner(
+        rom=rom, script=script, checkpoints=checkpoints, interval=every
+    )
+
+    start_time = time.perf_counter()
+    if log_fname is None:
+        start = runner.seek(frames)
+    else:
+        # Every frame has to run to be logged, so this starts from reset.
+        start = runner.seek(0)
+        with open(log_fname, "w") as outfp:
+            while runner.frame < frames:
+                runner.run_frame()
+                outfp.write(state_line(runner) + "\n")
+    end_time = time.perf_counter()
+
+    if start > 0:
+        print(f"Resumed from the checkpoint at frame {start}")
+    print(state_line(runner))
+    print(f"{runner.frame - start} frames in {end_time - start_time:.2f}s")
+
+    if checkpoints is not None and checkpoints_fname is not None:
+        checkpoints.save(file_name=checkpoints_fname)
+    if ram_out_fname is not None:
+        with open(ram_out_fname, "wb") as outfp:
+            outfp.write(runner.machine.memory.ram)
+    if screenshot_fname is not None:
+        # Only this needs numpy, so it only gets imported for it
+        from emulib.pngfile import write_png
+        from emulib.vdprender import render_frame
+
+        vdp = runner.machine.vdp
+        write_png(
+            screenshot_fname,
+            render_frame(bytes(vdp.vram), bytes(vdp.cram), bytes(vdp.regs)),
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+from __future__ import annotations
+
+import argparse
+import os.path
+
+from typing import (
+    NamedTuple,
+    Optional,
+)
+
+from dislib.fileio import write_if_changed
+from emulib.inputscript import (
+    InputScript,
+    read_input_script,
+)
+from emulib.machine import (
+    CYCLES_PER_FRAME,
+    SmsMachine,
+)
+from emulib.profiler import (
+    ExecutionProfile,
+    RoutineMap,
+    flat_profile,
+)
+from emulib.symfile import read_sym_labels
+
+DEFAULT_ROMS = ["out/s1.sms", "out/diets1.sms", "out/compress/s1compr.sms"]
+DEFAULT_ROUTINES = ["load_art", "unpack_level_layout_into_ram"]
+# The game spins here waiting for the frame interrupt, so time in here isn't work.
+DEFAULT_IDLE_ROUTINE = "wait_until_irq_ticked"
+
+
+class RomResult(NamedTuple):
+    name: str
+    ops: int
+    # T-states of actual work in each frame, i.e. not halted or waiting for the interrupt
+    frame_cycles: list[int]
+    # Frames where the game never got round to waiting, so its work ran into the next frame
+    overruns: int
+    # (self T-states, calls) for each routine asked for, if the symbols have it
+    routines: dict[str, Optional[tuple[int, int]]]
+
+
+def run_rom(
+    *,
+    rom_fname: str,
+    frames: int,
+    script: InputScript,
+    routine_names: list[str],
+    idle_name: str,
+) -> RomResult:
+    with open(rom_fname, "rb") as infp:
+        rom_data = infp.read()
+
+    sym_fname = os.path.splitext(rom_fname)[0] + ".sym"
+    if os.path.exists(sym_fname):
+        routine_map = RoutineMap(starts=read_sym_labels(sym_fname))
+    else:
+        print(f"WARNING: No {sym_fname}, so no routine counts for {rom_fname}")
+        routine_map = RoutineMap(starts={})
+
+    machine = SmsMachine(rom=rom_data)
+    cpu = machine.cpu
+    profile = ExecutionProfile(memory=machine.memory)
+    cpu.profile = profile
+
+    idle_start = 0
+    idle_end = 0
+    if idle_name in routine_map.addr_of:
+        idle_start = routine_map.addr_of[idle_name]
+        idle_end = routine_map.routine_end(idle_start)
+    else:
+        print(f"WARNING: No {idle_name} in {rom_fname}, only counting HALT as idle")
+
+    def idle_cycles() -> int:
+        return cpu.idle_cycles + sum(profile.cycles[idle_start:idle_end])
+
+    frame_cycles: list[int] = []
+    overruns = 0
+    for frame in range(frames):
+        machine.set_joypad_1(script.held_at(frame))
+        cycles_before = cpu.cycles
+        idle_before = idle_cycles()
+        machine.run_frame()
+        idle = idle_cycles() - idle_before
+        frame_cycles.append(cpu.cycles - cycles_before - idle)
+        if idle == 0:
+            overruns += 1
+
+    rows = {row.name: row for row in flat_profile(profile, routine_map)}
+    return RomResult(
+        name=rom_fname,
+        ops=cpu.op_count,
+        frame_cycles=frame_cycles,
+        overruns=overruns,
+        routines={
+            name: (rows[name].cycles, rows[name].calls) if name in rows else None
+            for name in routine_names
+        },
+    )
+
+
+def format_busiest(frame_cycles: list[int]) -> str:
+    if not frame_cycles:
+        return "-"
+    busiest = max(frame_cycles)
+    return f"{busiest} (frame {frame_cycles.index(busiest)})"
+
+
+def format_table(results: list[RomResult], *, routine_names: list[str]) -> str:
+    # One column per ROM, and nothing that changes from run to run, so it diffs cleanly.
+    table: list[list[str]] = [["", *[os.path.basename(r.name) for r in results]]]
+    table.append(["frames", *[str(len(r.frame_cycles)) for r in results]])
+    table.append(["ops", *[str(r.ops) for r in results]])
+    table.append(["T-states used", *[str(sum(r.frame_cycles)) for r in results]])
+    table.append(
+        [
+            "T-states used per frame",
+            *[
+                f"{sum(r.frame_cycles) / max(1, len(r.frame_cycles)):.1f}"
+                for r in results
+            ],
+        ]
+    )
+    table.append(["busiest frame", *[format_busiest(r.frame_cycles) for r in results]])
+    table.append(["frames over budget", *[str(r.overruns) for r in results]])
+    for name in routine_names:
+        counts = [r.routines[name] for r in results]
+        table.append([f"{name} T-states", *[str(c[0]) if c else "-" for c in counts]])
+        table.append([f"{name} calls", *[str(c[1]) if c else "-" for c in counts]])
+
+    widths = [max(len(row[col]) for row in table) for col in range(len(table[0]))]
+    lines = []
+    for row in table:
+        cells = [row[0].ljust(widths[0])]
+        cells += [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])]
+        lines.append("  ".join(cells).rstrip() + "\n")
+    return "".join(lines)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="Run the built ROMs for the same frames with the same inputs, and compare how much work each one did."
+    )
+    parser.add_argument(
+        "--frames",
+        type=int,
+        default=1800,
+        help="frames to run each ROM for from reset (default: 1800, 30 seconds of game time)",
+    )
+    parser.add_argument(
+        "--input",
+        metavar="SCRIPT",
+        help="what to hold on joypad 1 and when, see emulib/inputscript.py (default: nothing, so the title screen and demo mode)",
+    )
+    parser.add_argument(
+        "--routine",
+        metavar="LABEL",
+        action="append",
+        help=f"count T-states and calls for this routine, can be given more than once (default: {', '.join(DEFAULT_ROUTINES)})",
+    )
+    parser.add_argument(
+        "--idle",
+        metavar="LABEL",
+        default=DEFAULT_IDLE_ROUTINE,
+        help=f"the routine the game waits for the next frame in (default: {DEFAULT_IDLE_ROUTINE})",
+    )
+    parser.add_argument(
+        "--out",
+        metavar="FILE",
+        help="write the table here as well, for diffing against another commit",
+    )
+    parser.add_argument(
+        "--per-frame",
+        metavar="TSV_FILE",
+        help="write the T-states used in every frame here, one column per ROM",
+    )
+    parser.add_argument(
+        "roms",
+        nargs="*",
+        help=f"ROMs to run, each with its .sym file next to it (default: {' '.join(DEFAULT_ROMS)})",
+    )
+    args = parser.parse_args()
+    frames: int = args.frames
+    input_fname: Optional[str] = args.input
+    routine_names: list[str] = args.routine or DEFAULT_ROUTINES
+    idle_name: str = args.idle
+    out_fname: Optional[str] = args.out
+    per_frame_fname: Optional[str] = args.per_frame
+    rom_fnames: list[str] = args.roms or DEFAULT_ROMS
+
+    if input_fname is not None:
+        script = read_input_script(input_fname)
+    else:
+        script = InputScript(changes=[])
+
+    results = [
+        run_rom(
+            rom_fname=rom_fname,
+            frames=frames,
+            script=script,
+            routine_names=routine_names,
+            idle_name=idle_name,
+        )
+        for rom_fname in rom_fnames
+    ]
+
+    text = format_table(results, routine_names=routine_names)
+    print(f"Frame budget: {CYCLES_PER_FRAME}T")
+    print(text, end="")
+    if out_fname is not None:
+        write_if_changed(out_fname, text.encode("utf-8"))
+
+    if per_frame_fname is not None:
+        with open(per_frame_fname, "w") as outfp:
+            outfp.write(
+                "\t".join(["frame", *[os.path.basename(r.name) for r in results]])
+                + "\n"
+            )
+            for frame in range(frames):
+                outfp.write(
+                    "\t".join(
+                        [str(frame), *[str(r.frame_cycles[frame]) for r in results]]
+                    )
+                    + "\n"
+                )
+
+
+if __name__ == "__main__":
+    main()